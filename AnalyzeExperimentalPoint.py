@@ -1,5 +1,5 @@
-import json
 import numpy as np
+import SweepResultStore
 # Water Temp: 28
 # Lambda = 0.1 {'cost': 1130.5307547912814, 'water_use': 1014.4913956197322, 'health_cost': 1160.3935917154927, 'g_l': 2, 'g_m': 20, 'g_h': 130}
 # Lambda = 1.0 {'cost': 1203.040897787921, 'water_use': 1198.3194266608537, 'health_cost': 4.721471127067363, 'g_l': 4, 'g_m': 20, 'g_h': 158}
@@ -9,73 +9,263 @@ import numpy as np
 # Lambda = 1.0 {'cost': 1270.7178261033218, 'water_use': 1266.8580000000647, 'health_cost': 3.859826103257095, 'g_l': 18, 'g_m': 30, 'g_h': 130}
 # Lambda = 10.0 {'cost': 1276.3194852495699, 'water_use': 1274.4623980976244, 'health_cost': 0.18570871519455145, 'g_l': 21, 'g_m': 26, 'g_h': 136}
 # Lambda = 100.0 {'cost': 1212.7778829323108, 'water_use': 1210.2642266609591, 'health_cost': 0.025136562713516993, 'g_l': 4, 'g_m': 20, 'g_h': 160}
+def build_gamma_grid_index(points, cell_size):
+    """
+    This function builds a uniform grid hash of (gamma_l, gamma_m, gamma_h) points for radius queries: points are
+    bucketed into cubic cells and sorted by cell
+    :param points: array of shape [N x 3] of gamma triples
+    :param cell_size: size of the cells, at least the radius of the queries
+    :return: dict of the index
+    """
+    points = np.asarray(points, dtype=float).reshape((-1, 3))
+    origin = points.min(axis=0) if len(points) > 0 else np.zeros((3,))
+
+    # Cells are shifted by one so that neighbours of every point have non-negative coordinates
+    cells = np.floor((points - origin) / cell_size).astype(np.int64) + 1
+    shape = cells.max(axis=0) + 2 if len(points) > 0 else np.ones((3,), dtype=np.int64)
+    keys = np.ravel_multi_index(cells.T, shape)
+    order = np.argsort(keys, kind='stable')
+
+    return {'points': points, 'origin': origin, 'cell_size': cell_size, 'shape': shape, 'keys': keys[order],
+            'order': order}
+
+
+def query_gamma_grid_index(index, query_points, radius):
+    """
+    This function finds, for all query points at once, the indexed points within a radius
+    :param index: index as returned by build_gamma_grid_index
+    :param query_points: array of shape [Q x 3] of gamma triples
+    :param radius: radius of the queries, at most the cell size of the index
+    :return: indices of query points, indices of indexed points, and distances of all (query, point) pairs within
+    the radius
+    """
+    query_points = np.asarray(query_points, dtype=float).reshape((-1, 3))
+    query_cells = np.floor((query_points - index['origin']) / index['cell_size']).astype(np.int64) + 1
+
+    query_indices = []
+    point_positions = []
+    for offset in np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1])).reshape((3, -1)).T:
+        cells = query_cells + offset
+        valid = np.flatnonzero(np.all((cells >= 0) & (cells < index['shape']), axis=1))
+        keys = np.ravel_multi_index(cells[valid].T, index['shape'])
+
+        starts = np.searchsorted(index['keys'], keys, side='left')
+        counts = np.searchsorted(index['keys'], keys, side='right') - starts
+
+        # Positions of the points of every matching cell in the sorted keys
+        pair_starts = np.cumsum(counts) - counts
+        query_indices.append(np.repeat(valid, counts))
+        point_positions.append(np.repeat(starts - pair_starts, counts) + np.arange(np.sum(counts)))
+
+    query_indices = np.concatenate(query_indices)
+    point_indices = index['order'][np.concatenate(point_positions)]
+
+    distances = np.sqrt(np.sum((query_points[query_indices] - index['points'][point_indices]) ** 2, axis=1))
+    within = distances <= radius
+    return query_indices[within], point_indices[within], distances[within]
+
+
+def find_costs_for_points(data, query_points, lambda_water_quality=1, radius=3, time_step_seconds=360):
+    """
+    This function smooths the sweep results at many gamma triples at once: water use and health cost at a query point
+    are the averages of the results within the radius, weighted by exp(-2 * distance^2)
+    :param data: sweep results as a list of dicts with gamma_l, gamma_m, gamma_h, water use (or water_use), and
+    health_cost
+    :param query_points: array of shape [Q x 3] of gamma triples
+    :param lambda_water_quality: weight of the health cost
+    :param radius: radius of the results taken into account
+    :param time_step_seconds: period of time-stamps of the sweep in seconds
+    :return: water use, health cost, and cost at the query points, zeros where no result is within the radius
+    """
+    time_adj = 60 * 60 / time_step_seconds
+
+    points = np.array([[d["gamma_l"], d["gamma_m"], d["gamma_h"]] for d in data], dtype=float)
+    water_uses = np.array([d["water use"] if "water use" in d else d["water_use"] for d in data], dtype=float)
+    health_costs = np.array([d["health_cost"] for d in data], dtype=float) / time_adj
+
+    number_of_queries = len(query_points)
+    index = build_gamma_grid_index(points, radius)
+    query_indices, point_indices, distances = query_gamma_grid_index(index, query_points, radius)
+
+    scores = np.exp(-2 * distances ** 2)
+    sum_scores = np.bincount(query_indices, scores, minlength=number_of_queries)
+    found = sum_scores > 0
+
+    water_use = np.zeros((number_of_queries,))
+    health_cost = np.zeros((number_of_queries,))
+    water_use[found] = np.bincount(query_indices, scores * water_uses[point_indices],
+                                   minlength=number_of_queries)[found] / sum_scores[found]
+    health_cost[found] = np.bincount(query_indices, scores * health_costs[point_indices],
+                                     minlength=number_of_queries)[found] / sum_scores[found]
+
+    cost = np.where(found, water_use + lambda_water_quality * health_cost, 0)
+    return water_use, health_cost, cost
+
+
 def find_costs_from_json(data, il, im, ih, lambda_water_quality=1):
-    time_step_seconds = 360
+    water_use, health_cost, cost = find_costs_for_points(data, [[il, im, ih]], lambda_water_quality)
+    return water_use[0], health_cost[0], cost[0]
+
+
+def get_pareto_front(water_uses, health_costs):
+    """
+    This function finds the results that no other result beats on both water use and health cost, with one sort
+    :param water_uses: water uses of the results
+    :param health_costs: health costs of the results
+    :return: indices of the results of the Pareto front, by increasing water use (and decreasing health cost)
+    """
+    water_uses = np.asarray(water_uses, dtype=float)
+    health_costs = np.asarray(health_costs, dtype=float)
+
+    order = np.lexsort((health_costs, water_uses))
+    sorted_health_costs = health_costs[order]
+
+    # A result is on the front if its health cost is below the health cost of every result using less water
+    previous_min = np.minimum.accumulate(np.concatenate([[np.inf], sorted_health_costs[:-1]]))
+    return order[sorted_health_costs < previous_min]
+
+
+def get_lambda_breakpoints(front_water_uses, front_health_costs):
+    """
+    This function finds the results of a Pareto front minimizing water_use + lambda * health_cost for some lambda,
+    which are the vertices of the lower convex hull of the front, and the lambda ranges over which each of them is
+    optimal
+    :param front_water_uses: water uses of the Pareto front, by increasing water use
+    :param front_health_costs: health costs of the Pareto front, by decreasing health cost
+    :return: indices of the hull vertices in the front, and the lambdas at which the optimum moves from one vertex to
+    the next (one less than vertices)
+    """
+    hull = []
+    for n, (w, h) in enumerate(zip(front_water_uses, front_health_costs)):
+        # Drop previous vertices which are not below the segment joining their neighbours
+        while len(hull) >= 2:
+            w1, h1 = front_water_uses[hull[-2]], front_health_costs[hull[-2]]
+            w2, h2 = front_water_uses[hull[-1]], front_health_costs[hull[-1]]
+            if (w2 - w1) * (h - h1) - (h2 - h1) * (w - w1) <= 0:
+                hull.pop()
+            else:
+                break
+        hull.append(n)
+
+    hull = np.array(hull, dtype=np.int64)
+    breakpoints = np.diff(np.asarray(front_water_uses)[hull]) / -np.diff(np.asarray(front_health_costs)[hull])
+    return hull, breakpoints
+
+
+def find_optimal_parameters_for_lambdas(data, lambdas, time_step_seconds):
+    """
+    This function reads the optimal gammas off the sweep results for many lambdas at once, through the Pareto front of
+    (water use, health cost) and its lower convex hull, without evaluating the cost of every result for every lambda.
+    Results must come from a sweep run without pruning: results pruned for one lambda may be optimal for another
+    :param data: sweep results as a list of dicts with gamma_l, gamma_m, gamma_h, water use (or water_use),
+    health_cost, and optionally pruned
+    :param lambdas: weights of the health cost
+    :param time_step_seconds: period of time-stamps of the sweep in seconds
+    :return: list of dicts of the optimum of each lambda, empty if there is no result
+    """
     time_adj = 60 * 60 / time_step_seconds
-    sel_vals = []
-    sum_dists = 0
+
+    if any(d.get("pruned", False) for d in data):
+        raise ValueError('the Pareto front needs the results of a sweep run without pruning')
+    if len(data) == 0:
+        return []
+
+    water_uses = np.array([d["water use"] if "water use" in d else d["water_use"] for d in data], dtype=float)
+    health_costs = np.array([d["health_cost"] for d in data], dtype=float) / time_adj
+
+    front = get_pareto_front(water_uses, health_costs)
+    hull, breakpoints = get_lambda_breakpoints(water_uses[front], health_costs[front])
+
+    optima = []
+    for lambda_water_quality, vertex in zip(lambdas, np.searchsorted(breakpoints, lambdas, side='left')):
+        n = front[hull[vertex]]
+        optima.append({"lambda": float(lambda_water_quality),
+                       "cost": water_uses[n] + lambda_water_quality * health_costs[n], "water_use": water_uses[n],
+                       "health_cost": health_costs[n], "g_l": data[n]["gamma_l"], "g_m": data[n]["gamma_m"],
+                       "g_h": data[n]["gamma_h"]})
+    return optima
+
+
+def main_pareto(lambdas=(0.1, 1.0, 10.0, 100.0)):
+    # Results of all stored sweeps, per configuration except lambda (results stored before setup hashes were recorded
+    # are kept per configuration)
+    with SweepResultStore.SweepResultStore() as store:
+        data = store.get_results(include_pruned=True)
+
+    setups = {}
     for d in data:
-        l = d["gamma_l"]
-        m = d["gamma_m"]
-        h = d["gamma_h"]
-        dist = ((l-il)**2 + (m-im)**2 + (h-ih)**2)**0.5
-        if dist <= 3:
-            sel_vals.append({"dist": dist, "water_use": d["water use"], "health_cost": d["health_cost"] / time_adj})
-
-    if len(sel_vals) == 0:
-        return 0, 0, 0
-
-    water_use = 0
-    health_cost = 0
-    sum_score = 0
-
-    for d in sel_vals:
-        score = np.exp(-2 * d["dist"]**2)
-        water_use += d["water_use"] * score
-        health_cost += d["health_cost"] * score
-        sum_score += score
-
-    water_use /= sum_score
-    health_cost /= sum_score
-
-    return water_use, health_cost, water_use + lambda_water_quality * health_cost
-
-
-min_l = 2
-max_l = 22
-
-min_m = 20
-max_m = 82
-
-min_h = 100
-max_h = 182
-
-lambda_water_quality = 10.0
-
-min_cost = 10000
-selected_params = []
-with open("data_T28C_20220807.json", "r") as i:
-    data = json.load(i)
-    for g_l in np.arange(start=min_l, stop=max_l, step=1):
-        print('start for g_l:{}'.format(g_l))
-        for g_m in np.arange(start=min_m, stop=max_m, step=1):
-            print('start for g_l:{}'.format(g_m))
-            costs_hist = []
-            for g_h in np.arange(start=min_h, stop=max_h, step=1):
-                if g_l < g_m < g_h:
-                    water_use, health_cost, cost = find_costs_from_json(data, g_l, g_m, g_h, lambda_water_quality)
-                    costs_hist.append(cost)
-                    if len(costs_hist) > 5:
-                       if  costs_hist[-1] > costs_hist[-2] and costs_hist[-2] > costs_hist[-3] and \
-                               costs_hist[-3] > costs_hist[-4] and costs_hist[-4] > costs_hist[-5]:
-                           break
-                    if water_use == 0:
-                        #print({"g_l": g_l, "g_m": g_m, "g_h": g_h,"Failed":True})
-                        continue
-                    if cost < min_cost:
-                        min_cost = cost
-                        selected_params = {"cost": cost, "water_use": water_use, "health_cost": health_cost,
-                                           "g_l": g_l, "g_m": g_m, "g_h": g_h}
-                        print(selected_params)
-
-print("Selected Parameters:{}".format(selected_params))
+        setups.setdefault(d["setup_hash"] or d["config_hash"], []).append(d)
+
+    for setup_hash, results in setups.items():
+        print('Setup: {}, water Temp: {}, occupancy profile: {}, seed: {}'.format(
+            setup_hash, results[0]["water_temperature"], results[0]["occupancy_profile"], results[0]["seed"]))
+        if results[0]["time_step_seconds"] is None:
+            print('Skipped, the time step of the sweep was not recorded')
+            continue
+        number_of_pruned_results = sum(1 for d in results if d["pruned"])
+        if number_of_pruned_results > 0:
+            print('Skipped, {} of {} results were pruned, the optima of other lambdas may be among them: run the sweep '
+                  'again without pruning'.format(number_of_pruned_results, len(results)))
+            continue
+        for optimum in find_optimal_parameters_for_lambdas(results, lambdas, results[0]["time_step_seconds"]):
+            print('Lambda = {} {}'.format(optimum["lambda"], optimum))
+
+
+def main(config_hash=None):
+    """
+    This function finds the gammas of lowest smoothed cost among the results of a stored sweep run without pruning
+    :param config_hash: hash of the configuration of the sweep (default: None, the sweep of the last stored result)
+    """
+    min_l = 2
+    max_l = 22
+
+    min_m = 20
+    max_m = 82
+
+    min_h = 100
+    max_h = 182
+
+    lambda_water_quality = 10.0
+
+    # Sweeps with pruned results are refused: pruned results are the costly neighbours of the others, smoothing without
+    # them would bias the costs downward next to them, and they were pruned for the lambda of the sweep only
+    with SweepResultStore.SweepResultStore() as store:
+        if config_hash is None:
+            config_hash = store.get_latest_configuration_hash()
+        data = store.get_results(config_hash, include_pruned=True)
+
+    if len(data) == 0:
+        print("No result stored for configuration {}".format(config_hash))
+        return
+    number_of_pruned_results = sum(1 for d in data if d["pruned"])
+    if number_of_pruned_results > 0:
+        print("The sweep of configuration {} pruned {} of {} results, run it again without pruning".format(
+            config_hash, number_of_pruned_results, len(data)))
+        return
+    if data[0]["time_step_seconds"] is None:
+        print("The time step of the sweep of configuration {} was not recorded".format(config_hash))
+        return
+    time_step_seconds = data[0]["time_step_seconds"]
+
+    # Smoothed costs of the whole grid are computed at once
+    g_l, g_m, g_h = np.meshgrid(np.arange(start=min_l, stop=max_l, step=1),
+                                np.arange(start=min_m, stop=max_m, step=1),
+                                np.arange(start=min_h, stop=max_h, step=1), indexing='ij')
+    grid_points = np.stack([g_l.ravel(), g_m.ravel(), g_h.ravel()], axis=1)
+    grid_points = grid_points[(grid_points[:, 0] < grid_points[:, 1]) & (grid_points[:, 1] < grid_points[:, 2])]
+
+    water_use, health_cost, cost = find_costs_for_points(data, grid_points, lambda_water_quality,
+                                                         time_step_seconds=time_step_seconds)
+
+    selected_params = []
+    candidates = np.flatnonzero(water_use != 0)
+    if len(candidates) > 0:
+        n = candidates[np.argmin(cost[candidates])]
+        selected_params = {"cost": cost[n], "water_use": water_use[n], "health_cost": health_cost[n],
+                           "g_l": grid_points[n, 0], "g_m": grid_points[n, 1], "g_h": grid_points[n, 2]}
+
+    print("Selected Parameters:{}".format(selected_params))
+
+
+if __name__ == "__main__":
+    main()
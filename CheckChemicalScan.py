@@ -0,0 +1,87 @@
+import numpy as np
+import utils
+import TimeGrid
+import OccupancyGenerator
+import ModelBodyFluidRelease
+import ModelWaterEvaporation
+import ModelWaterManagement
+import ModelChemicalParameters
+
+CHEMICAL_STATE_KEYS = ['toc', 'TCM', 'DCAA', 'TCAA', 'DCAN', 'VoW']
+
+
+def get_relative_errors(expected_states, states):
+    """
+    :param expected_states: chemical states of the sequential loop, dict of [S x T] arrays
+    :param states: chemical states to check, dict of [S x T] arrays
+    :return: dict of the relative error of each chemical content, largest absolute difference over largest absolute
+    value of the sequential loop
+    """
+    return {key: float(np.max(np.abs(states[key] - expected_states[key])) /
+                       max(float(np.max(np.abs(expected_states[key]))), np.finfo(float).tiny))
+            for key in CHEMICAL_STATE_KEYS}
+
+
+def check_scan_against_loop(start_date_time="2022/03/01 00:00:00", end_date_time="2022/03/15 00:00:00",
+                            time_step_seconds=360, gammas=((4, 20, 158), (18, 30, 130)),
+                            block_sizes=(1, 7, 64, 512, 4096), tolerance=1e-9, seed=2022):
+    """
+    This function checks that ModelChemicalParameters.process_chemical_parameters_scan integrates the same chemical
+    contents as the sequential loop of process_chemical_parameters_batch, within tolerance, for several block sizes.
+    Inputs come from the simulation pipeline (occupancy, body fluid release, bather load, water evaporation, and
+    occupancy based water management) on a short horizon
+    :param start_date_time: start date-time of the simulation (format: YYYY/MM/DD hh:mm:ss)
+    :param end_date_time: end date-time of the simulation (format: YYYY/MM/DD hh:mm:ss)
+    :param time_step_seconds: period of time-stamps in seconds
+    :param gammas: (gamma_L, gamma_M, gamma_H) triples of the water flows of the scenarios
+    :param block_sizes: block sizes of the scan to check
+    :param tolerance: largest relative error allowed
+    :param seed: seed of the occupancy simulation
+    :return: dict of the relative errors of each block size
+    """
+    swimming_pool_water_temperature_celsius = 30
+    swimming_pool_volume_of_water = 200 * 1000
+    initial_chemical_parameters = {"FAC": 1, "TCM": 0.0, "CC": 0, "pH": 7.8, "ORP": 700, "BF": 0}
+
+    time_grid = TimeGrid.TimeGrid.from_date_time_strings(start_date_time, end_date_time, time_step_seconds)
+    occupancy_table = OccupancyGenerator.OccupancyGenerator().generate(time_grid, seed)
+
+    body_fluid_release = ModelBodyFluidRelease.ModelBodyFluidRelease().simulate_body_fluid_release(
+        time_grid, occupancy_table, swimming_pool_water_temperature_celsius)
+    bather_load = utils.get_bather_load_for_datetime_stamps(time_grid, occupancy_table, time_step_seconds)
+    water_evaporation = ModelWaterEvaporation.ModelWaterEvaporation().process_water_evaporation(
+        time_grid, bather_load, 150, swimming_pool_water_temperature_celsius, 32, 0.5)
+
+    model_wm = ModelWaterManagement.ModelWaterManagement(150 * 1000, 250 * 1000)
+    activity_class_counts = model_wm.get_activity_class_counts(time_grid, occupancy_table)
+    wf_ins, wf_outs = model_wm.generate_occupancy_based_rate_water_flows(
+        time_grid, activity_class_counts, water_evaporation, swimming_pool_volume_of_water, gammas)
+
+    model_chemicals = ModelChemicalParameters.ModelChemicalParameters()
+    expected_states = model_chemicals.process_chemical_parameters_batch(
+        initial_chemical_parameters, time_grid, body_fluid_release, swimming_pool_water_temperature_celsius,
+        swimming_pool_volume_of_water, water_evaporation, wf_ins, wf_outs)
+
+    relative_errors = {}
+    for block_size in block_sizes:
+        states = model_chemicals.process_chemical_parameters_scan(
+            initial_chemical_parameters, time_grid, body_fluid_release, swimming_pool_water_temperature_celsius,
+            swimming_pool_volume_of_water, water_evaporation, wf_ins, wf_outs, block_size=block_size)
+        relative_errors[block_size] = get_relative_errors(expected_states, states)
+
+        worst_key = max(relative_errors[block_size], key=relative_errors[block_size].get)
+        if not relative_errors[block_size][worst_key] <= tolerance:
+            raise AssertionError('scan solver with block size {} is off the sequential loop by {} on {}, more than '
+                                 '{}'.format(block_size, relative_errors[block_size][worst_key], worst_key,
+                                             tolerance))
+
+    return relative_errors
+
+
+def main():
+    for block_size, relative_errors in check_scan_against_loop().items():
+        print('block size {}: largest relative error {}'.format(block_size, max(relative_errors.values())))
+
+
+if __name__ == "__main__":
+    main()
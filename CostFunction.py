@@ -0,0 +1,73 @@
+import numpy as np
+import utils
+
+
+def cost_function(water_ins, bather_load, chemical_parameters, tcm_threshold, lambda_water_quality=1000000,
+                  time_step_seconds=360):
+    """
+
+    :param water_ins:
+    :param chemical_parameters:
+    :param tcm_threshold:
+    :param lambda_water_quality:
+    :return:
+    """
+    liter_2_m3 = 0.001
+
+    # Cost of water use in cubic meters instead of liters
+    cost_water_use = liter_2_m3 * float(np.sum(water_ins))
+
+    time_adj = 60 * 60 / time_step_seconds
+
+    number_of_stamps = min(len(chemical_parameters), len(bather_load))
+    tcms = utils.get_chemical_parameter_values(chemical_parameters, 'TCM')[:number_of_stamps]
+    excess_tcm = np.where(tcms > tcm_threshold, (tcms - tcm_threshold) / tcm_threshold, 0.0)
+    cost_water_quality = float(excess_tcm @ np.asarray(bather_load[:number_of_stamps], dtype=float))
+
+    return cost_water_use + lambda_water_quality * (cost_water_quality / time_adj), cost_water_use, cost_water_quality
+
+
+def cost_function_batch(water_ins, bather_load, tcms, tcm_threshold, lambda_water_quality=1000000,
+                        time_step_seconds=360):
+    """
+    This function is the batched version of cost_function: it calculates the cost function terms of S scenarios at once
+    :param water_ins: input flows of fresh water of each scenario, [S x (T+1)]
+    :param bather_load: bather load per datetime stamp
+    :param tcms: TCM concentrations of each scenario per datetime stamp, [S x T]
+    :param tcm_threshold: TCM concentration threshold
+    :param lambda_water_quality: weight of the water quality cost
+    :param time_step_seconds: period of time-stamps in seconds
+    :return: costs, costs of water use, and costs of water quality of the scenarios
+    """
+    costs_water_use = cost_water_use_batch(water_ins)
+
+    time_adj = 60 * 60 / time_step_seconds
+
+    costs_water_quality = cost_water_quality_batch(bather_load, tcms, tcm_threshold)
+
+    return costs_water_use + lambda_water_quality * (costs_water_quality / time_adj), costs_water_use, \
+        costs_water_quality
+
+
+def cost_water_use_batch(water_ins):
+    """
+    :param water_ins: input flows of fresh water of each scenario, [S x (T+1)]
+    :return: costs of water use of the scenarios, in cubic meters
+    """
+    liter_2_m3 = 0.001
+
+    # Cost of water use in cubic meters instead of liters
+    return liter_2_m3 * np.sum(water_ins, axis=1)
+
+
+def cost_water_quality_batch(bather_load, tcms, tcm_threshold):
+    """
+    :param bather_load: bather load per datetime stamp
+    :param tcms: TCM concentrations of each scenario per datetime stamp, [S x T]
+    :param tcm_threshold: TCM concentration threshold
+    :return: costs of water quality of the scenarios, before weighting and time adjustment
+    """
+    number_of_stamps = min(np.shape(tcms)[1], len(bather_load))
+    tcms = np.asarray(tcms)[:, :number_of_stamps]
+    excess_tcm = np.where(tcms > tcm_threshold, (tcms - tcm_threshold) / tcm_threshold, 0.0)
+    return excess_tcm @ np.asarray(bather_load[:number_of_stamps], dtype=float)
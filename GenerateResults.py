@@ -1,7 +1,8 @@
-import datetime
 from typing import Any
 import utils
 import ModelOccupancyParameters
+import OccupancyTable
+import TimeGrid
 import ModelChemicalParameters
 import ModelWaterManagement
 import ModelBodyFluidRelease
@@ -27,18 +28,14 @@ min_swimming_pool_volume_of_water = 150 * 1000
 swimming_pool_surface_area = 150
 utils.validate_date_time_string(start_date_time)
 utils.validate_date_time_string(end_date_time)
-dt_start = datetime.datetime.strptime(start_date_time, '%Y/%m/%d %H:%M:%S')
-dt_end = datetime.datetime.strptime(end_date_time, '%Y/%m/%d %H:%M:%S')
-datetime_stamps_gen = utils.dates_bwn_two_date_times_generator(dt_start, dt_end, time_step_seconds)
-datetime_stamps = []
+datetime_stamps = TimeGrid.TimeGrid.from_date_time_strings(start_date_time, end_date_time, time_step_seconds)
 TCM_th = 100
-for n, dt in enumerate(datetime_stamps_gen):
-    datetime_stamps.append(dt)
 
 with open("run_Chemicals_Lambda1_0.json", "r") as f_chem:
     chemical_parameters = json.load(f_chem)
-with open("run_Occupancy_Lambda1_0.json", "r") as f_occ:
-    occupancy_data = json.load(f_occ)
+# Occupancy is read from its columnar directory, converted once from the json file of the run if needed
+occupancy_data = OccupancyTable.OccupancyTable.load_or_convert_json("run_Occupancy_Lambda1_0",
+                                                                    "run_Occupancy_Lambda1_0.json")
 bather_loads, dates = utils.get_daily_bather_load(datetime_stamps, occupancy_data)
 daily_water_use, daily_evaporation, daily_wastewater_drain = utils.get_daily_water_treatment(datetime_stamps,
                                                                                              chemical_parameters)
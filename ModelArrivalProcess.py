@@ -0,0 +1,61 @@
+import numpy as np
+import TimeGrid
+
+
+class ModelArrivalProcess:
+    def __init__(self, model_occupancy_parameters):
+        """
+        This class models arrivals of swimmers as a non-homogeneous Poisson process whose rate is piecewise-constant
+        over the hours of the calendar, as given by the occupancy model
+        :param model_occupancy_parameters: ModelOccupancyParameters providing the calendar tables
+        """
+        self.model_occupancy_parameters = model_occupancy_parameters
+
+    def get_rate_function(self, start_date_time, end_date_time):
+        """
+        This function builds the piecewise-constant arrival rate between two date-times: the rate of each clock hour is
+        the inverse of the mean inter-arrival time of its (month, weekday, hour) cell
+        :param start_date_time: start date-time of the arrival process
+        :param end_date_time: end date-time of the arrival process
+        :return: breakpoints of the pieces in seconds since the epoch (one more than pieces) and rates of the pieces in
+        arrivals per second
+        """
+        epoch_start = int(TimeGrid.datetime_to_epoch_seconds(start_date_time))
+        epoch_end = int(TimeGrid.datetime_to_epoch_seconds(end_date_time))
+
+        # Pieces are clock hours, clipped to the horizon
+        first_hour = (epoch_start // 3600 + 1) * 3600
+        breakpoints = np.concatenate(([epoch_start], np.arange(first_hour, epoch_end, 3600, dtype=np.int64),
+                                      [epoch_end])).astype(np.int64)
+
+        calendar_indices = self.model_occupancy_parameters.get_calendar_indices(breakpoints[:-1])
+        rates = 1 / self.model_occupancy_parameters.Calendar_InterArrivalTime_Seconds_Mean.reshape(-1)[calendar_indices]
+
+        return breakpoints, rates
+
+    def generate_arrival_times(self, start_date_time, end_date_time, rng=None):
+        """
+        This function generates every arrival between two date-times at once by inverting the cumulative intensity of
+        the arrival process: the number of arrivals is Poisson distributed with the total intensity as mean, and given
+        that number, the arrivals are uniformly distributed over the cumulative intensity
+        :param start_date_time: start date-time of the arrival process
+        :param end_date_time: end date-time of the arrival process
+        :param rng: numpy random Generator (default: a freshly seeded numpy.random.default_rng())
+        :return: sorted arrival times in seconds since the epoch (float)
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+
+        breakpoints, rates = self.get_rate_function(start_date_time, end_date_time)
+        if len(rates) == 0 or breakpoints[-1] <= breakpoints[0]:
+            return np.zeros((0,))
+
+        cumulative_intensity = np.concatenate(([0], np.cumsum(rates * np.diff(breakpoints))))
+
+        number_of_arrivals = rng.poisson(cumulative_intensity[-1])
+        intensities = np.sort(rng.uniform(0, cumulative_intensity[-1], number_of_arrivals))
+
+        pieces = np.searchsorted(cumulative_intensity, intensities, side='right') - 1
+        pieces = np.minimum(pieces, len(rates) - 1)
+
+        return breakpoints[pieces] + (intensities - cumulative_intensity[pieces]) / rates[pieces]
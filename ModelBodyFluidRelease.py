@@ -1,4 +1,6 @@
 import numpy as np
+import OccupancyTable
+import TimeGrid
 
 
 class ModelBodyFluidRelease:
@@ -39,38 +41,126 @@ class ModelBodyFluidRelease:
     def simulate_body_fluid_release(self, datetime_stamps, occupancy_data, swimming_pool_water_temperature_celsius):
         """
         This function estimates the total volume of sweat release for the swimmers based on occupancy data
-        :param datetime_stamps: date-time stamps of calculating sweat release
+        :param datetime_stamps: date-time stamps of calculating sweat release, as a time grid or a list of datetimes
         :param occupancy_data: occupancy data
         :param swimming_pool_water_temperature_celsius: water temperature of swimming pool in celsius
         :return: estimated volume of body fluid release
         """
-        total_volume_of_body_fluid_release_date_times = []
-
         if len(datetime_stamps) < 2:
-            return total_volume_of_body_fluid_release_date_times
+            return []
+
+        time_period_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
 
-        time_period_seconds = (datetime_stamps[1] - datetime_stamps[0]).seconds
+        time_steps, percentage_presence_in_cycle, activity_level, body_surface_area = \
+            self.get_presence_of_swimmers(datetime_stamps, occupancy_data, time_period_seconds)
 
         # Normalize Swear: L / h / m^2
-        for dt_stamp in datetime_stamps:
-            total_volume_of_body_fluid_release_date_time = 0
-            for swimmer in occupancy_data:
-                if swimmer['DT-Arrival'] < dt_stamp < swimmer['DT-Leave']:
-                    seconds_from_arrival = (dt_stamp - swimmer['DT-Arrival']).seconds
-                    percentage_presence_in_cycle = min(1, seconds_from_arrival / time_period_seconds)
-                    cycles_from_arrival = int(seconds_from_arrival / time_period_seconds)
-                    if len(swimmer['Act-Levels']) > cycles_from_arrival:
-                        activity_level = swimmer['Act-Levels'][cycles_from_arrival]
-
-                        normalized_sweat_release = \
-                            self.calculate_normalized_sweat_release(activity_level,
-                                                                    swimming_pool_water_temperature_celsius,
-                                                                    percentage_presence_in_cycle * time_period_seconds)
-
-                        body_surface_area = np.sqrt(swimmer['Weight'] * (swimmer['Height'] / 100.0)) / 6
-                        total_volume_of_body_fluid_release_date_time += body_surface_area * normalized_sweat_release
-
-            total_volume_of_body_fluid_release_date_times.append(total_volume_of_body_fluid_release_date_time)
-
-        return total_volume_of_body_fluid_release_date_times
+        normalized_sweat_release = \
+            self.calculate_normalized_sweat_release(activity_level, swimming_pool_water_temperature_celsius,
+                                                    percentage_presence_in_cycle * time_period_seconds)
+
+        total_volume_of_body_fluid_release_date_times = np.bincount(time_steps,
+                                                                    weights=body_surface_area * normalized_sweat_release,
+                                                                    minlength=len(datetime_stamps))
+
+        return list(total_volume_of_body_fluid_release_date_times)
+
+    def accumulate_body_fluid_release_components(self, datetime_stamps, occupancy_data):
+        """
+        This function accumulates the two water temperature independent series of the sweat release model
+        (a + b * exp(beta1 * (T - T0)) * exp(beta2 * (A / 100 - A0))) * (time_period_seconds / TimeBase): the
+        presence-weighted base term a and the activity exponential term b * exp(beta2 * (A / 100 - A0)), both weighted by
+        body surface area. The body fluid release at any water temperature T is base + exp(beta1 * (T - T0)) * activity
+        :param datetime_stamps: date-time stamps of calculating sweat release, as a time grid or a list of datetimes
+        :param occupancy_data: occupancy data as a list of dicts or an OccupancyTable
+        :return: base and activity series of body fluid release per date-time stamp
+        """
+        if len(datetime_stamps) < 2:
+            return np.zeros((len(datetime_stamps),)), np.zeros((len(datetime_stamps),))
+
+        a = self.sweat_release_parameters['a']
+        b = self.sweat_release_parameters['b']
+        beta2 = self.sweat_release_parameters['beta2']
+        A0 = self.sweat_release_parameters['A0']
+        TimeBase = self.sweat_release_parameters['TimeBase']
+
+        time_period_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
+
+        time_steps, percentage_presence_in_cycle, activity_level, body_surface_area = \
+            self.get_presence_of_swimmers(datetime_stamps, occupancy_data, time_period_seconds)
+
+        weights = body_surface_area * percentage_presence_in_cycle * time_period_seconds / TimeBase
+        A = activity_level / 100
+
+        base_release = np.bincount(time_steps, weights=weights * a, minlength=len(datetime_stamps))
+        activity_release = np.bincount(time_steps, weights=weights * b * np.exp(beta2 * (A / 100 - A0)),
+                                       minlength=len(datetime_stamps))
+
+        return base_release, activity_release
+
+    def simulate_body_fluid_release_for_temperatures(self, datetime_stamps, occupancy_data, water_temperatures):
+        """
+        This function estimates the body fluid release for several water temperatures at once, as a linear combination
+        of the series accumulated once by accumulate_body_fluid_release_components
+        :param datetime_stamps: date-time stamps of calculating sweat release, as a time grid or a list of datetimes
+        :param occupancy_data: occupancy data as a list of dicts or an OccupancyTable
+        :param water_temperatures: list of water temperatures of swimming pool in celsius
+        :return: estimated volume of body fluid release as an array of shape [temperatures x date-time stamps]
+        """
+        beta1 = self.sweat_release_parameters['beta1']
+        T0 = self.sweat_release_parameters['T0']
+
+        base_release, activity_release = self.accumulate_body_fluid_release_components(datetime_stamps, occupancy_data)
+
+        temperature_factors = np.exp(beta1 * (np.asarray(water_temperatures, dtype=float) - T0))
+
+        return base_release[None, :] + temperature_factors[:, None] * activity_release[None, :]
+
+    @staticmethod
+    def get_presence_of_swimmers(datetime_stamps, occupancy_data, time_period_seconds):
+        """
+        This function lists every (swimmer, date-time stamp) pair contributing to body fluid release: stamps strictly
+        between arrival and leave of the swimmer, for which the swimmer still has an activity level. It is computed
+        directly from the arrival offset and the activity levels of each swimmer, without scanning the stamps
+        :param datetime_stamps: date-time stamps of calculating sweat release, as a time grid or a list of datetimes
+        :param occupancy_data: occupancy data as a list of dicts or an OccupancyTable
+        :param time_period_seconds: time period between date-time stamps
+        :return: per pair, the index of the date-time stamp, the fraction of the period the swimmer was present, the
+        activity level of the swimmer, and the body surface area of the swimmer
+        """
+        occupancy_table = OccupancyTable.OccupancyTable.from_any(occupancy_data)
+
+        epoch_start = TimeGrid.TimeGrid.from_any(datetime_stamps).start_epoch_seconds
+        arrival = (occupancy_table.arrival - epoch_start).astype(float)
+        leave = (occupancy_table.leave - epoch_start).astype(float)
+        number_of_activity_levels = occupancy_table.number_of_activity_levels
+
+        # First stamp after the arrival, and first stamp at or after the leave of each swimmer; a swimmer has no
+        # activity level left after number_of_activity_levels + 1 stamps
+        first_stamp = np.maximum(0, np.floor(arrival / time_period_seconds) + 1).astype(np.int64)
+        end_stamp = np.minimum(np.ceil(leave / time_period_seconds).astype(np.int64), len(datetime_stamps))
+        end_stamp = np.minimum(end_stamp, first_stamp + number_of_activity_levels + 1)
+        number_of_stamps = np.maximum(0, end_stamp - first_stamp)
+
+        swimmers = np.repeat(np.arange(len(occupancy_table)), number_of_stamps)
+        pair_offsets = np.cumsum(number_of_stamps) - number_of_stamps
+        time_steps = np.repeat(first_stamp - pair_offsets, number_of_stamps) + np.arange(len(swimmers))
+
+        seconds_from_arrival = time_steps * time_period_seconds - arrival[swimmers]
+        cycles_from_arrival = np.floor(seconds_from_arrival / time_period_seconds).astype(np.int64)
+        has_activity_level = cycles_from_arrival < number_of_activity_levels[swimmers]
+
+        swimmers = swimmers[has_activity_level]
+        time_steps = time_steps[has_activity_level]
+        seconds_from_arrival = seconds_from_arrival[has_activity_level]
+        cycles_from_arrival = cycles_from_arrival[has_activity_level]
+
+        percentage_presence_in_cycle = np.minimum(1, seconds_from_arrival / time_period_seconds)
+        activity_level = occupancy_table.activity_levels[occupancy_table.activity_offsets[swimmers] +
+                                                          cycles_from_arrival].astype(float)
+
+        body_surface_area = np.sqrt(occupancy_table.weight[swimmers].astype(float) *
+                                    (occupancy_table.height[swimmers].astype(float) / 100.0)) / 6
+
+        return time_steps, percentage_presence_in_cycle, activity_level, body_surface_area
 
@@ -1,7 +1,19 @@
 import json
 import numpy as np
+import TimeGrid
 from matplotlib import pyplot as plt
 
+# Evaporation Rate of Chloroform: 11.6 (BuAc=1) link: http://colinmayfield.com/biology447/Assignments/assignment1/chloroform/chloroform.htm
+# Evaporation Rate of Water: 0.3 (BuAc=1)
+TCM_EVAPORATION_RATE = 11.6 / 0.3
+
+# Chemical parameters of one datetime stamp, as stored in the structured array given by process_chemical_parameters
+CHEMICAL_PARAMETERS_DTYPE = np.dtype([('FAC', np.float64), ('TCM', np.float64), ('DCAA', np.float64),
+                                      ('TCAA', np.float64), ('DCAN', np.float64), ('CC', np.float64),
+                                      ('pH', np.float64), ('ORP', np.float64), ('toc', np.float64),
+                                      ('VoW', np.float64), ('newTOC', np.float64), ('Evap', np.float64),
+                                      ('inW', np.float64), ('outW', np.float64)])
+
 
 class ModelChemicalParameters:
     def __init__(self, json_file_path='SwimmingPoolChemicalParameters.json'):
@@ -55,7 +67,8 @@ class ModelChemicalParameters:
 
     def process_chemical_parameters(self, initial_chemical_parameters, datetime_stamps, body_fluid_release,
                                     swimming_pool_water_temperature_celsius, swimming_pool_volume_of_water,
-                                    water_evaporation, input_flow_freshwater, output_flow_wastewater):
+                                    water_evaporation, input_flow_freshwater, output_flow_wastewater,
+                                    initial_chemical_state=None):
         """
         This function processes chemical components and parameters of swimming pool in the defines datetime stamps based
         on initial chemical parameters, body fluid releases happening at each datetime stamp, and water temperature
@@ -67,111 +80,412 @@ class ModelChemicalParameters:
         :param water_evaporation:
         :param input_flow_freshwater:
         :param output_flow_wastewater:
-        :return: chemical parameters per each datetime-stamp
+        :param initial_chemical_state: state to start from instead of initial_chemical_parameters, e.g. the final
+        state of a previous chunk of the simulation (default: None)
+        :return: chemical parameters per each datetime-stamp, as a structured array of CHEMICAL_PARAMETERS_DTYPE
         """
-        # calculate apparent reaction rate constant of TCM formation
-
-        abs_water_temp = 273.5 + swimming_pool_water_temperature_celsius
-
-        tcm_k1 = self.tcm_a * np.exp(-self.tcm_ea / (self.r * abs_water_temp))
-        dcaa_k1 = self.dcaa_a * np.exp(-self.dcaa_ea / (self.r * abs_water_temp))
-        tcaa_k1 = self.tcaa_a * np.exp(-self.tcaa_ea / (self.r * abs_water_temp))
-        dcan_k1 = self.dcan_a * np.exp(-self.dcan_ea / (self.r * abs_water_temp))
-
-        time_period_seconds = (datetime_stamps[1] - datetime_stamps[0]).seconds
+        chemical_states = self.process_chemical_parameters_scan(initial_chemical_parameters, datetime_stamps,
+                                                                body_fluid_release,
+                                                                swimming_pool_water_temperature_celsius,
+                                                                swimming_pool_volume_of_water, water_evaporation,
+                                                                input_flow_freshwater, output_flow_wastewater,
+                                                                initial_chemical_state)
+
+        number_of_stamps = chemical_states['TCM'].shape[1]
+
+        chemical_parameters = np.zeros((number_of_stamps,), dtype=CHEMICAL_PARAMETERS_DTYPE)
+        chemical_parameters['FAC'] = initial_chemical_parameters["FAC"]
+        chemical_parameters['CC'] = initial_chemical_parameters["CC"]
+        chemical_parameters['pH'] = initial_chemical_parameters["pH"]
+        chemical_parameters['ORP'] = initial_chemical_parameters["ORP"]
+        for key in ['TCM', 'DCAA', 'TCAA', 'DCAN', 'toc', 'VoW', 'newTOC']:
+            chemical_parameters[key] = chemical_states[key][0]
+        chemical_parameters['Evap'] = np.asarray(water_evaporation, dtype=float)[:number_of_stamps]
+        chemical_parameters['inW'] = np.asarray(input_flow_freshwater, dtype=float)[:number_of_stamps]
+        chemical_parameters['outW'] = np.asarray(output_flow_wastewater, dtype=float)[:number_of_stamps]
 
-        ratio_hour_2_period = time_period_seconds / 3600
-        initial_fac = initial_chemical_parameters["FAC"]
-        initial_tcm = initial_chemical_parameters["TCM"]
-
-        initial_cc = initial_chemical_parameters["CC"]
-        initial_ph = initial_chemical_parameters["pH"]
-        initial_orp = initial_chemical_parameters["ORP"]
-        initial_body_fluid_per_liter_of_swimming_pool_water = initial_chemical_parameters["BF"]
+        return chemical_parameters
 
-        # Evaporation Rate of Chloroform: 11.6 (BuAc=1) link: http://colinmayfield.com/biology447/Assignments/assignment1/chloroform/chloroform.htm
-        # Evaporation Rate of Water: 0.3 (BuAc=1)
-        tcm_evaporation_rate = 11.6 / 0.3
+    @staticmethod
+    def get_chemical_parameters_rows(chemical_parameters):
+        """
+        This function converts chemical parameters to a list of dicts, one per datetime stamp, e.g. to store them in
+        json files
+        :param chemical_parameters: chemical parameters as returned by process_chemical_parameters
+        :return: chemical parameters as a list of dicts
+        """
+        if not isinstance(chemical_parameters, np.ndarray):
+            return chemical_parameters
 
-        percentage_used_4_dbp = 1.0
+        names = chemical_parameters.dtype.names
+        return [dict(zip(names, row)) for row in chemical_parameters.tolist()]
 
-        tcm_coeff = ratio_hour_2_period * tcm_k1
-        dcaa_coeff = ratio_hour_2_period * dcaa_k1
-        tcaa_coeff = ratio_hour_2_period * tcaa_k1
-        dcan_coeff = ratio_hour_2_period * dcan_k1
+    def get_initial_chemical_state(self, initial_chemical_parameters, swimming_pool_volume_of_water):
+        """
+        This function builds the state integrated by process_chemical_parameters_batch from initial chemical parameters
+        :param initial_chemical_parameters: initial chemical parameters of the swimming pool
+        :param swimming_pool_volume_of_water: volume of water of the swimming pool (liter)
+        :return: chemical state as a dict of toc, TCM, DCAA, TCAA, DCAN, and VoW
+        """
+        total_body_fluid = initial_chemical_parameters["BF"] * swimming_pool_volume_of_water
 
-        # run simulation of chemical contents
-        fac = initial_fac
-        cc = initial_cc
-        orp = initial_orp
-        ph = initial_ph
-        tcm = initial_tcm
+        return {'toc': total_body_fluid * self.bf_2_toc_ratio_mg / swimming_pool_volume_of_water,
+                'TCM': initial_chemical_parameters["TCM"], 'DCAA': 0, 'TCAA': 0, 'DCAN': 0,
+                'VoW': swimming_pool_volume_of_water}
 
-        dcaa = 0
-        tcaa = 0
-        dcan = 0
+    @staticmethod
+    def get_final_chemical_state(chemical_states):
+        """
+        This function extracts the state at the last datetime stamp of a batched run, so that a following run can
+        continue from it
+        :param chemical_states: chemical states as returned by process_chemical_parameters_batch
+        :return: chemical state as a dict of toc, TCM, DCAA, TCAA, DCAN, and VoW with one value per scenario
+        """
+        return {key: chemical_states[key][:, -1] for key in ['toc', 'TCM', 'DCAA', 'TCAA', 'DCAN', 'VoW']}
 
-        total_body_fluid = initial_body_fluid_per_liter_of_swimming_pool_water * swimming_pool_volume_of_water
+    def get_batch_inputs(self, datetime_stamps, body_fluid_release, water_evaporation, input_flows_freshwater,
+                         output_flows_wastewater):
+        """
+        This function truncates inputs of the batched integrators to the number of datetime stamps and broadcasts them
+        to [S x T] arrays
+        :param datetime_stamps: datetime stamps of the simulation
+        :param body_fluid_release: body fluid release per datetime stamp, [T] or [S x T]
+        :param water_evaporation: water evaporation per datetime stamp, [T] or [S x T]
+        :param input_flows_freshwater: input flows of fresh water per datetime stamp, [T] or [S x T]
+        :param output_flows_wastewater: output flows of waste water per datetime stamp, [T] or [S x T]
+        :return: body fluid release, water evaporation, input flows, and output flows as [S x T] arrays
+        """
+        number_of_stamps = len(datetime_stamps)
 
-        chemical_parameters = []
-        vow = swimming_pool_volume_of_water
+        inputs = [np.atleast_2d(np.asarray(values, dtype=float)[..., :number_of_stamps]) for values in
+                  [body_fluid_release, water_evaporation, input_flows_freshwater, output_flows_wastewater]]
 
-        toc = total_body_fluid * self.bf_2_toc_ratio_mg / vow
+        shape = (max(len(values) for values in inputs), number_of_stamps)
+        return [np.broadcast_to(values, shape) for values in inputs]
 
-        tcms = []
+    def get_reaction_constants(self, swimming_pool_water_temperature_celsius, time_period_seconds, number_of_scenarios):
+        """
+        This function calculates the per time step reaction constants of TCM, DCAA, TCAA, and DCAN
+        :param swimming_pool_water_temperature_celsius: water temperature, scalar or one per scenario
+        :param time_period_seconds: period of datetime stamps in seconds
+        :param number_of_scenarios: number of scenarios
+        :return: per scenario reaction coefficients, per scenario formation potentials per unit of toc, and carbon
+        consumed per unit of formed DBP, each in the order TCM, DCAA, TCAA, DCAN
+        """
+        abs_water_temp = 273.5 + np.broadcast_to(np.asarray(swimming_pool_water_temperature_celsius, dtype=float),
+                                                 (number_of_scenarios,))
 
+        ratio_hour_2_period = time_period_seconds / 3600
         mug_2_mg = 0.001
 
-        for dt_stamp, new_body_fluid_rel, E, inW, outW in zip(datetime_stamps, body_fluid_release, water_evaporation,
-                                                              input_flow_freshwater, output_flow_wastewater):
+        coefficients = [ratio_hour_2_period * self.tcm_a * np.exp(-self.tcm_ea / (self.r * abs_water_temp)),
+                        ratio_hour_2_period * self.dcaa_a * np.exp(-self.dcaa_ea / (self.r * abs_water_temp)),
+                        ratio_hour_2_period * self.tcaa_a * np.exp(-self.tcaa_ea / (self.r * abs_water_temp)),
+                        ratio_hour_2_period * self.dcan_a * np.exp(-self.dcan_ea / (self.r * abs_water_temp))]
 
-            new_tcm = vow * tcm_coeff * ((toc * percentage_used_4_dbp) *
-                                         (self.tcm_m * abs_water_temp + self.tcm_n) - tcm)
+        # DCAN uses the m and n parameters of TCAA
+        potentials = [self.tcm_m * abs_water_temp + self.tcm_n,
+                      self.dcaa_m * abs_water_temp + self.dcaa_n,
+                      self.tcaa_m * abs_water_temp + self.tcaa_n,
+                      self.tcaa_m * abs_water_temp + self.tcaa_n]
 
-            new_dcaa = vow * dcaa_coeff * ((toc * percentage_used_4_dbp) *
-                                           (self.dcaa_m * abs_water_temp + self.dcaa_n) - dcaa)
+        carbons = [self.CarbonUseOfDBPs['TCM'] * mug_2_mg / self.tcm_molar_mass * self.carbon_molar_mass,
+                   self.CarbonUseOfDBPs['DCAA'] * mug_2_mg / self.dcaa_molar_mass * self.carbon_molar_mass,
+                   self.CarbonUseOfDBPs['TCAA'] * mug_2_mg / self.tcaa_molar_mass * self.carbon_molar_mass,
+                   self.CarbonUseOfDBPs['DCAN'] * mug_2_mg / self.dcan_molar_mass * self.carbon_molar_mass]
 
-            new_tcaa = vow * tcaa_coeff * ((toc * percentage_used_4_dbp) *
-                                           (self.tcaa_m * abs_water_temp + self.tcaa_n) - tcaa)
+        return coefficients, potentials, carbons
 
-            new_dcan = vow * dcan_coeff * ((toc * percentage_used_4_dbp) *
-                                           (self.tcaa_m * abs_water_temp + self.tcaa_n) - dcan)
-
-            consumed_toc_by_tcm = (self.CarbonUseOfDBPs['TCM'] * ((new_tcm * mug_2_mg) / self.tcm_molar_mass)) \
-                                  * self.carbon_molar_mass
-
-            consumed_toc_by_dcaa = (self.CarbonUseOfDBPs['DCAA'] * ((new_dcaa * mug_2_mg) / self.dcaa_molar_mass)) \
-                                  * self.carbon_molar_mass
-
-            consumed_toc_by_tcaa = (self.CarbonUseOfDBPs['TCAA'] * ((new_tcaa * mug_2_mg) / self.tcaa_molar_mass)) \
-                                   * self.carbon_molar_mass
-
-            consumed_toc_by_dcan = (self.CarbonUseOfDBPs['DCAN'] * ((new_dcan * mug_2_mg) / self.dcan_molar_mass)) \
-                                   * self.carbon_molar_mass
-
-            # must be calculated in mol
-            consumed_toc = consumed_toc_by_tcm + consumed_toc_by_dcaa + consumed_toc_by_tcaa + consumed_toc_by_dcan
+    @staticmethod
+    def get_transition_matrices(vow, water_evaporation, input_flow_freshwater, output_flow_wastewater, coefficients,
+                                potentials, carbons):
+        """
+        This function builds the matrices A of single time steps x <- A x + b of the state x = (toc, TCM, DCAA, TCAA,
+        DCAN), where b is the new toc divided by the new volume of water. Arguments broadcast together, so A can be
+        built for many scenarios and time steps at once
+        :param vow: volume of water before the time steps
+        :param water_evaporation: water evaporation of the time steps
+        :param input_flow_freshwater: input flows of fresh water of the time steps
+        :param output_flow_wastewater: output flows of waste water of the time steps
+        :param coefficients: reaction coefficients, as given by get_reaction_constants
+        :param potentials: formation potentials, as given by get_reaction_constants
+        :param carbons: carbon consumed per unit of formed DBP, as given by get_reaction_constants
+        :return: array of shape [... x 5 x 5] of the matrices
+        """
+        remaining_vow = vow - output_flow_wastewater
+        remaining_dbp_vow = vow - output_flow_wastewater - TCM_EVAPORATION_RATE * water_evaporation
+        new_vow = vow - output_flow_wastewater - water_evaporation + input_flow_freshwater
+
+        transition_matrices = np.zeros(np.shape(new_vow) + (5, 5))
+        transition_matrices[..., 0, 0] = remaining_vow
+        for n, (coefficient, potential, carbon) in enumerate(zip(coefficients, potentials, carbons)):
+            rate = vow * coefficient
+            transition_matrices[..., 0, 0] -= carbon * rate * potential
+            transition_matrices[..., 0, n + 1] = carbon * rate
+            transition_matrices[..., n + 1, 0] = rate * potential
+            transition_matrices[..., n + 1, n + 1] = remaining_dbp_vow - rate
+        transition_matrices /= np.asarray(new_vow)[..., None, None]
+
+        return transition_matrices
+
+    def process_chemical_parameters_batch(self, initial_chemical_parameters, datetime_stamps, body_fluid_release,
+                                          swimming_pool_water_temperature_celsius, swimming_pool_volume_of_water,
+                                          water_evaporation, input_flows_freshwater, output_flows_wastewater,
+                                          initial_chemical_state=None, fast_forward_steps=None):
+        """
+        This function is the batched version of process_chemical_parameters: it integrates the chemical contents of S
+        scenarios at once, one time step after another but vectorized over scenarios. Inputs are [S x T] arrays, or
+        [T] arrays shared by all scenarios. As in process_chemical_parameters, inputs are truncated to the number of
+        datetime stamps, so water flows with a leading zero can be passed as they are
+        :param initial_chemical_parameters: initial chemical parameters of the swimming pool
+        :param datetime_stamps: datetime stamps of the simulation
+        :param body_fluid_release: body fluid release per datetime stamp, [T] or [S x T]
+        :param swimming_pool_water_temperature_celsius: water temperature, scalar or one per scenario
+        :param swimming_pool_volume_of_water: volume of water of the swimming pool (liter)
+        :param water_evaporation: water evaporation per datetime stamp, [T] or [S x T]
+        :param input_flows_freshwater: input flows of fresh water per datetime stamp, [T] or [S x T]
+        :param output_flows_wastewater: output flows of waste water per datetime stamp, [T] or [S x T]
+        :param initial_chemical_state: state to start from instead of initial_chemical_parameters, e.g. the final
+        state of a previous run as given by get_final_chemical_state
+        :param fast_forward_steps: boolean array of the datetime stamps whose chemical contents are not needed, e.g.
+        stamps without bather load when only cost terms are calculated. Stretches of these stamps without body fluid
+        release, with constant water flows, and with constant volume of water are jumped over with powers of the
+        transition matrix of the (then linear, constant coefficient) recurrences. Chemical contents inside jumped
+        stretches are left as NaN until materialize_fast_forwarded_states is called, the last stamp of each stretch is
+        always calculated
+        :return: dict of [S x T] arrays of toc, TCM, DCAA, TCAA, DCAN, VoW, and newTOC per scenario and datetime stamp,
+        plus the list of jumped stretches under 'fast_forward_segments'
+        """
+        body_fluid_release, water_evaporation, input_flows_freshwater, output_flows_wastewater = \
+            self.get_batch_inputs(datetime_stamps, body_fluid_release, water_evaporation, input_flows_freshwater,
+                                  output_flows_wastewater)
+
+        number_of_scenarios, number_of_stamps = body_fluid_release.shape
+        shape = (number_of_scenarios, number_of_stamps)
+
+        time_period_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
+        coefficients, potentials, carbons = self.get_reaction_constants(swimming_pool_water_temperature_celsius,
+                                                                        time_period_seconds, number_of_scenarios)
+
+        tcm_coeff, dcaa_coeff, tcaa_coeff, dcan_coeff = coefficients
+        tcm_potential, dcaa_potential, tcaa_potential, dcan_potential = potentials
+        tcm_carbon, dcaa_carbon, tcaa_carbon, dcan_carbon = carbons
+
+        if initial_chemical_state is None:
+            initial_chemical_state = self.get_initial_chemical_state(initial_chemical_parameters,
+                                                                     swimming_pool_volume_of_water)
+
+        toc, tcm, dcaa, tcaa, dcan, vow = [np.broadcast_to(initial_chemical_state[key],
+                                                           number_of_scenarios).astype(float)
+                                           for key in ['toc', 'TCM', 'DCAA', 'TCAA', 'DCAN', 'VoW']]
+
+        chemical_states = {key: np.empty(shape) for key in ['toc', 'TCM', 'DCAA', 'TCAA', 'DCAN', 'VoW']}
+        chemical_states['newTOC'] = body_fluid_release * self.bf_2_toc_ratio_mg
+        chemical_states['fast_forward_segments'] = []
+
+        segment_stops = {}
+        if fast_forward_steps is not None:
+            segment_stops = dict(self.get_fast_forward_segments(fast_forward_steps, body_fluid_release,
+                                                                water_evaporation, input_flows_freshwater,
+                                                                output_flows_wastewater))
+
+        t = 0
+        while t < number_of_stamps:
+            E = water_evaporation[:, t]
+            inW = input_flows_freshwater[:, t]
+            outW = output_flows_wastewater[:, t]
+
+            if t in segment_stops:
+                stop = segment_stops[t]
+
+                # Without body fluid release and with constant flows and volume, every step of the stretch is the
+                # same x <- A x
+                transition_matrices = self.get_transition_matrices(vow, E, inW, outW, coefficients, potentials,
+                                                                   carbons)
+
+                state = np.stack([toc, tcm, dcaa, tcaa, dcan], axis=1)
+                chemical_states['fast_forward_segments'].append((t, stop, transition_matrices, state))
+
+                state = np.matmul(np.linalg.matrix_power(transition_matrices, stop - t), state[:, :, None])[:, :, 0]
+                toc, tcm, dcaa, tcaa, dcan = state.T
+
+                for key in ['toc', 'TCM', 'DCAA', 'TCAA', 'DCAN']:
+                    chemical_states[key][:, t:stop - 1] = np.nan
+                chemical_states['toc'][:, stop - 1] = toc
+                chemical_states['TCM'][:, stop - 1] = tcm
+                chemical_states['DCAA'][:, stop - 1] = dcaa
+                chemical_states['TCAA'][:, stop - 1] = tcaa
+                chemical_states['DCAN'][:, stop - 1] = dcan
+                chemical_states['VoW'][:, t:stop] = vow[:, None]
+
+                t = stop
+                continue
+
+            new_tcm = vow * tcm_coeff * (toc * tcm_potential - tcm)
+            new_dcaa = vow * dcaa_coeff * (toc * dcaa_potential - dcaa)
+            new_tcaa = vow * tcaa_coeff * (toc * tcaa_potential - tcaa)
+            new_dcan = vow * dcan_coeff * (toc * dcan_potential - dcan)
+
+            consumed_toc = tcm_carbon * new_tcm + dcaa_carbon * new_dcaa + tcaa_carbon * new_tcaa + \
+                dcan_carbon * new_dcan
+
+            remaining_vow = vow - outW
+            remaining_dbp_vow = vow - outW - TCM_EVAPORATION_RATE * E
+            new_vow = vow - outW - E + inW
+
+            toc = (remaining_vow * toc + chemical_states['newTOC'][:, t] - consumed_toc) / new_vow
+            tcm = (remaining_dbp_vow * tcm + new_tcm) / new_vow
+            dcaa = (remaining_dbp_vow * dcaa + new_dcaa) / new_vow
+            tcaa = (remaining_dbp_vow * tcaa + new_tcaa) / new_vow
+            dcan = (remaining_dbp_vow * dcan + new_dcan) / new_vow
+            vow = vow - outW + inW - E
 
-            new_toc = new_body_fluid_rel * self.bf_2_toc_ratio_mg
+            chemical_states['toc'][:, t] = toc
+            chemical_states['TCM'][:, t] = tcm
+            chemical_states['DCAA'][:, t] = dcaa
+            chemical_states['TCAA'][:, t] = tcaa
+            chemical_states['DCAN'][:, t] = dcan
+            chemical_states['VoW'][:, t] = vow
 
-            toc = ((vow - outW) * toc + new_toc - consumed_toc) / (vow - outW - E + inW)
+            t += 1
 
-            # TCM concentration at current datetime stamp
-            tcm = ((vow - outW - tcm_evaporation_rate * E) * tcm + new_tcm) / (vow - outW - E + inW)
+        return chemical_states
 
-            dcaa = ((vow - outW - tcm_evaporation_rate * E) * dcaa + new_dcaa) / (vow - outW - E + inW)
+    def process_chemical_parameters_scan(self, initial_chemical_parameters, datetime_stamps, body_fluid_release,
+                                         swimming_pool_water_temperature_celsius, swimming_pool_volume_of_water,
+                                         water_evaporation, input_flows_freshwater, output_flows_wastewater,
+                                         initial_chemical_state=None, block_size=512):
+        """
+        This function integrates the same chemical contents as process_chemical_parameters_batch without a loop over
+        time steps. With the water flows known, the volume of water is a cumulative sum and every time step is an affine
+        map x <- A x + b of the state x = (toc, TCM, DCAA, TCAA, DCAN). TOC and the DBPs are coupled both ways (DBP
+        formation consumes toc), so the 5 x 5 maps are composed with an associative scan rather than solved one species
+        after another, which also rules out the closed form with cumulative products and sums of a scalar recurrence.
+        The scan is blocked instead of rescaled: maps are composed by recursive doubling within blocks of block_size
+        steps only, and block end states are carried from one block to the next. Products of many contracting maps,
+        which underflow over a year and are what rescaling would guard against, are thus never formed. CheckChemicalScan
+        checks the scan against the sequential loop of process_chemical_parameters_batch to a relative error of 1e-9
+        :param initial_chemical_parameters: initial chemical parameters of the swimming pool
+        :param datetime_stamps: datetime stamps of the simulation
+        :param body_fluid_release: body fluid release per datetime stamp, [T] or [S x T]
+        :param swimming_pool_water_temperature_celsius: water temperature, scalar or one per scenario
+        :param swimming_pool_volume_of_water: volume of water of the swimming pool (liter)
+        :param water_evaporation: water evaporation per datetime stamp, [T] or [S x T]
+        :param input_flows_freshwater: input flows of fresh water per datetime stamp, [T] or [S x T]
+        :param output_flows_wastewater: output flows of waste water per datetime stamp, [T] or [S x T]
+        :param initial_chemical_state: state to start from instead of initial_chemical_parameters
+        :param block_size: number of time steps composed together
+        :return: dict of [S x T] arrays of toc, TCM, DCAA, TCAA, DCAN, VoW, and newTOC per scenario and datetime stamp
+        """
+        body_fluid_release, water_evaporation, input_flows_freshwater, output_flows_wastewater = \
+            self.get_batch_inputs(datetime_stamps, body_fluid_release, water_evaporation, input_flows_freshwater,
+                                  output_flows_wastewater)
+
+        number_of_scenarios, number_of_stamps = body_fluid_release.shape
+
+        time_period_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
+        coefficients, potentials, carbons = self.get_reaction_constants(swimming_pool_water_temperature_celsius,
+                                                                        time_period_seconds, number_of_scenarios)
+
+        if initial_chemical_state is None:
+            initial_chemical_state = self.get_initial_chemical_state(initial_chemical_parameters,
+                                                                     swimming_pool_volume_of_water)
+
+        state = np.stack([np.broadcast_to(initial_chemical_state[key], number_of_scenarios).astype(float)
+                          for key in ['toc', 'TCM', 'DCAA', 'TCAA', 'DCAN']], axis=1)
+        initial_vow = np.broadcast_to(initial_chemical_state['VoW'], number_of_scenarios).astype(float)
+
+        chemical_states = {'newTOC': body_fluid_release * self.bf_2_toc_ratio_mg}
+        chemical_states['VoW'] = initial_vow[:, None] + np.cumsum(input_flows_freshwater - output_flows_wastewater -
+                                                                  water_evaporation, axis=1)
+        vows = np.concatenate([initial_vow[:, None], chemical_states['VoW'][:, :-1]], axis=1)
+
+        # Steps padded to whole blocks with identity maps
+        number_of_blocks = -(-number_of_stamps // block_size)
+        padded_shape = (number_of_scenarios, number_of_blocks * block_size)
+
+        transition_matrices = np.zeros(padded_shape + (5, 5))
+        transition_matrices[...] = np.eye(5)
+        transition_matrices[:, :number_of_stamps] = self.get_transition_matrices(
+            vows, water_evaporation, input_flows_freshwater, output_flows_wastewater,
+            [coefficient[:, None] for coefficient in coefficients], [potential[:, None] for potential in potentials],
+            carbons)
+
+        translations = np.zeros(padded_shape + (5,))
+        translations[:, :number_of_stamps, 0] = chemical_states['newTOC'] / (vows - output_flows_wastewater -
+                                                                             water_evaporation + input_flows_freshwater)
+
+        transition_matrices = transition_matrices.reshape((number_of_scenarios, number_of_blocks, block_size, 5, 5))
+        translations = translations.reshape((number_of_scenarios, number_of_blocks, block_size, 5))
+
+        # Recursive doubling: after the pass with offset d, step k holds the composition of steps k - 2d + 1 .. k of its
+        # block, and finally the composition of all steps from the start of its block
+        offset = 1
+        while offset < block_size:
+            later_matrices = transition_matrices[:, :, offset:]
+            translations[:, :, offset:] = np.matmul(later_matrices, translations[:, :, :-offset, :, None])[..., 0] + \
+                translations[:, :, offset:]
+            transition_matrices[:, :, offset:] = np.matmul(later_matrices, transition_matrices[:, :, :-offset])
+            offset *= 2
+
+        states = np.empty((number_of_scenarios, number_of_blocks, block_size, 5))
+        for block in range(number_of_blocks):
+            states[:, block] = np.matmul(transition_matrices[:, block], state[:, None, :, None])[..., 0] + \
+                translations[:, block]
+            state = states[:, block, -1]
+
+        states = states.reshape((number_of_scenarios, -1, 5))[:, :number_of_stamps]
+        for n, key in enumerate(['toc', 'TCM', 'DCAA', 'TCAA', 'DCAN']):
+            chemical_states[key] = states[:, :, n]
+
+        return chemical_states
+
+    @staticmethod
+    def get_fast_forward_segments(fast_forward_steps, body_fluid_release, water_evaporation, input_flows_freshwater,
+                                  output_flows_wastewater, min_number_of_steps=4):
+        """
+        This function finds the stretches of datetime stamps that process_chemical_parameters_batch can jump over:
+        stamps whose output is not needed, without body fluid release, with water flows keeping the volume of water constant,
+        and with the same water flows as the previous stamp of the stretch (in all scenarios)
+        :param fast_forward_steps: boolean array of the datetime stamps whose chemical contents are not needed
+        :param body_fluid_release: body fluid release, [S x T]
+        :param water_evaporation: water evaporation, [S x T]
+        :param input_flows_freshwater: input flows of fresh water, [S x T]
+        :param output_flows_wastewater: output flows of waste water, [S x T]
+        :param min_number_of_steps: shorter stretches are stepped through, as a jump would not be cheaper
+        :return: list of (start, stop) datetime stamp indices of the stretches, stop excluded
+        """
+        number_of_stamps = body_fluid_release.shape[1]
 
-            tcaa = ((vow - outW - tcm_evaporation_rate * E) * tcaa + new_tcaa) / (vow - outW - E + inW)
+        quiet = np.asarray(fast_forward_steps, dtype=bool)[:number_of_stamps] & \
+            np.all(body_fluid_release == 0, axis=0) & \
+            np.all(input_flows_freshwater - output_flows_wastewater - water_evaporation == 0, axis=0)
 
-            dcan = ((vow - outW - tcm_evaporation_rate * E) * dcan + new_dcan) / (vow - outW - E + inW)
+        same_flows = np.zeros((number_of_stamps,), dtype=bool)
+        same_flows[1:] = np.all((water_evaporation[:, 1:] == water_evaporation[:, :-1]) &
+                                (input_flows_freshwater[:, 1:] == input_flows_freshwater[:, :-1]) &
+                                (output_flows_wastewater[:, 1:] == output_flows_wastewater[:, :-1]), axis=0)
 
-            vow = vow - outW + inW - E
+        continues = np.zeros((number_of_stamps,), dtype=bool)
+        continues[1:] = quiet[1:] & quiet[:-1] & same_flows[1:]
 
-            #if new_toc > 0:
-            #    print('new_toc:{}'.format(new_toc))
+        starts = np.flatnonzero(quiet & ~continues)
+        stops = np.flatnonzero(quiet & ~np.append(continues[1:], False)) + 1
 
-            chemical_parameters.append({"FAC": fac, "TCM": tcm, "DCAA": dcaa, "TCAA": tcaa, "TCAA": dcan, "CC": cc,
-                                        "pH": ph, "ORP": orp, "toc": toc, "VoW": vow, "newTOC": new_toc,
-                                        'Evap': E, 'inW': inW, 'outW': outW})
+        return [(int(start), int(stop)) for start, stop in zip(starts, stops) if stop - start >= min_number_of_steps]
 
-        return chemical_parameters
+    @staticmethod
+    def materialize_fast_forwarded_states(chemical_states):
+        """
+        This function fills in the chemical contents of the stretches jumped over by process_chemical_parameters_batch
+        :param chemical_states: chemical states as returned by process_chemical_parameters_batch
+        :return: the same chemical states, completed in place
+        """
+        for start, stop, transition_matrices, state in chemical_states['fast_forward_segments']:
+            for t in range(start, stop - 1):
+                state = np.matmul(transition_matrices, state[:, :, None])[:, :, 0]
+                for n, key in enumerate(['toc', 'TCM', 'DCAA', 'TCAA', 'DCAN']):
+                    chemical_states[key][:, t] = state[:, n]
+
+        chemical_states['fast_forward_segments'] = []
+        return chemical_states
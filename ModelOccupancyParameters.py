@@ -4,6 +4,14 @@ import random
 import numpy as np
 import utils
 
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+          'November', 'December']
+
+# Same order as datetime.weekday()
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Shape of the compiled calendar tables: [months x weekdays x hours]
+CALENDAR_SHAPE = (12, 7, 24)
 
 class ModelOccupancyParameters:
     def __init__(self, json_file_path='SwimmingPoolOccupancyParameters.json'):
@@ -431,9 +439,91 @@ class ModelOccupancyParameters:
                     '70': parameters["PhysicalModel"]["female"]["70"]["weight"],
                     '100': parameters["PhysicalModel"]["female"]["100"]["weight"]}
 
+                # Age ranges of the physical model as sorted arrays, used by the batch sampler
+                self.Physical_age_ranges = np.array(sorted(int(k) for k in self.Physical_female_weight.keys()))
+                self.Physical_male_weights = np.array([self.Physical_male_weight[str(k)]
+                                                       for k in self.Physical_age_ranges])
+                self.Physical_male_heights = np.array([self.Physical_male_height[str(k)]
+                                                       for k in self.Physical_age_ranges])
+                self.Physical_female_weights = np.array([self.Physical_female_weight[str(k)]
+                                                         for k in self.Physical_age_ranges])
+                self.Physical_female_heights = np.array([self.Physical_female_height[str(k)]
+                                                         for k in self.Physical_age_ranges])
+
+                self.compile_calendar_tables()
+
             except ValueError:
                 print('error extracting and initializing occupancy model parameters!')
 
+    def compile_calendar_tables(self):
+        """
+        This function compiles the monthly, week-daily, and hourly patterns of the occupancy model into dense tables of
+        shape [12 months x 7 weekdays x 24 hours] holding the effective distribution parameters of each calendar cell.
+        A date-time maps to its cell by integer indexing (see get_calendar_index)
+        :return:
+        """
+        def monthly(pattern):
+            return np.array([pattern[month] for month in MONTHS], dtype=float)[:, None, None]
+
+        def week_daily(pattern):
+            return np.array([pattern[weekday] for weekday in WEEKDAYS], dtype=float)[None, :, None]
+
+        def hourly(pattern):
+            return np.array([pattern[str(hour)] for hour in range(24)], dtype=float)[None, None, :]
+
+        def calendar(table):
+            return np.ascontiguousarray(np.broadcast_to(table, CALENDAR_SHAPE))
+
+        self.Calendar_InterArrivalTime_Seconds_Mean = calendar(
+            monthly(self.Monthly_InterArrivalTime_Seconds_Mean) / week_daily(self.WeekDaily_InterArrivalTime_Divider) /
+            hourly(self.Hourly_InterArrivalRate_Divider))
+        self.Calendar_InterArrivalTime_Seconds_Std = calendar(monthly(self.Monthly_InterArrivalRate_Seconds_Std))
+
+        self.Calendar_Gender_Male_Probability = calendar(
+            monthly(self.Monthly_Gender_Male_Probability) * week_daily(self.WeekDaily_Gender_Multiplier) *
+            hourly(self.Hourly_Gender_Multiplier))
+
+        self.Calendar_ProbabilityAdult = calendar(hourly(self.Hourly_ProbabilityAdult))
+
+        self.Calendar_Age_Low_Mean = calendar(
+            monthly(self.Monthly_Age_Low_Distribution_Mean) * week_daily(self.WeekDaily_AgeLow_Multiplier) *
+            hourly(self.Hourly_AgeLow_Multiplier))
+        self.Calendar_Age_Low_Std = calendar(monthly(self.Monthly_Age_Low_Distribution_Std))
+
+        self.Calendar_Age_High_Mean = calendar(
+            monthly(self.Monthly_Age_High_Distribution_Mean) * week_daily(self.WeekDaily_AgeHigh_Multiplier) *
+            hourly(self.Hourly_AgeHigh_Multiplier))
+        self.Calendar_Age_High_Std = calendar(monthly(self.Monthly_Age_High_Distribution_Std))
+
+        self.Calendar_TimeOfStay_Seconds_Mean = calendar(hourly(self.Hourly_TimeOfStay_Minutes_mean) * 60)
+        self.Calendar_TimeOfStay_Seconds_Std = calendar(hourly(self.Hourly_TimeOfStay_Minutes_std) * 60)
+
+        self.Calendar_ActivityLevel_Mean = calendar(hourly(self.Hourly_ActivityLevel_mean))
+        self.Calendar_ActivityLevel_Std = calendar(hourly(self.Hourly_ActivityLevel_std))
+
+    @staticmethod
+    def get_calendar_index(date_time):
+        """
+        This function maps a date-time to the flat index of its (month, weekday, hour) cell in the calendar tables
+        :param date_time: date-time
+        :return: flat index into the calendar tables
+        """
+        return ((date_time.month - 1) * 7 + date_time.weekday()) * 24 + date_time.hour
+
+    @staticmethod
+    def get_calendar_indices(epoch_seconds):
+        """
+        This function is the vectorized version of get_calendar_index for date-times given as seconds since the epoch
+        :param epoch_seconds: array of date-times as seconds since 1970-01-01 00:00:00
+        :return: array of flat indices into the calendar tables
+        """
+        epoch_seconds = np.asarray(epoch_seconds, dtype=np.int64)
+        months = epoch_seconds.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64) % 12
+        # 1970-01-01 was a Thursday, weekday 3 when Monday is 0
+        weekdays = (epoch_seconds // 86400 + 3) % 7
+        hours = (epoch_seconds // 3600) % 24
+        return (months * 7 + weekdays) * 24 + hours
+
     def get_a_swimmer_from_model(self, date_time, time_step_seconds):
         """
         This function provides distribution parameters of inter-arrival rate, weight, height, age, gender, and staying
@@ -445,38 +535,26 @@ class ModelOccupancyParameters:
         if type(date_time) is not datetime.datetime:
             raise TypeError('arg must be a datetime.datetime, not a %s' % type(date_time))
 
-        dt_day_of_week = date_time.strftime('%A')
-        dt_hour = "{}".format(date_time.hour)
-        dt_month = date_time.strftime("%B")
+        cell = np.unravel_index(self.get_calendar_index(date_time), CALENDAR_SHAPE)
 
-        inter_arrival_time_mean = self.Monthly_InterArrivalTime_Seconds_Mean[dt_month] / \
-                                  self.WeekDaily_InterArrivalTime_Divider[dt_day_of_week] / \
-                                  self.Hourly_InterArrivalRate_Divider[dt_hour]
+        inter_arrival_time_mean = self.Calendar_InterArrivalTime_Seconds_Mean[cell]
 
-        inter_arrival_time_std = self.Monthly_InterArrivalRate_Seconds_Std[dt_month]
+        inter_arrival_time_std = self.Calendar_InterArrivalTime_Seconds_Std[cell]
 
         inter_arrival_time = random.normalvariate(inter_arrival_time_mean, inter_arrival_time_std)
 
         time_to_arrival = random.expovariate(1 / inter_arrival_time)
 
-        gender_ismale_probability = self.Monthly_Gender_Male_Probability[dt_month] * \
-                                    self.WeekDaily_Gender_Multiplier[dt_day_of_week] * \
-                                    self.Hourly_Gender_Multiplier[dt_hour]
+        gender_ismale_probability = self.Calendar_Gender_Male_Probability[cell]
 
         gender = 'male' if random.random() < gender_ismale_probability else 'female'
 
-        probability_adult = self.Hourly_ProbabilityAdult[dt_hour]
-
         age = 1
 
-        if random.random() < self.Hourly_ProbabilityAdult[dt_hour]:
-            age_mean = self.Monthly_Age_High_Distribution_Mean[dt_month] * self.WeekDaily_AgeHigh_Multiplier[dt_day_of_week] * self.Hourly_AgeHigh_Multiplier[dt_hour]
-            age_std = self.Monthly_Age_High_Distribution_Std[dt_month]
-            age = random.normalvariate(age_mean, age_std)
+        if random.random() < self.Calendar_ProbabilityAdult[cell]:
+            age = random.normalvariate(self.Calendar_Age_High_Mean[cell], self.Calendar_Age_High_Std[cell])
         else:
-            age_mean = self.Monthly_Age_Low_Distribution_Mean[dt_month] * self.WeekDaily_AgeLow_Multiplier[dt_day_of_week] * self.Hourly_AgeLow_Multiplier[dt_hour]
-            age_std = self.Monthly_Age_Low_Distribution_Std[dt_month]
-            age = random.normalvariate(age_mean, age_std)
+            age = random.normalvariate(self.Calendar_Age_Low_Mean[cell], self.Calendar_Age_Low_Std[cell])
 
         age = max(1, min(100, age))
 
@@ -498,17 +576,108 @@ class ModelOccupancyParameters:
             weight = self.Physical_female_weight[sel_age_key]
             height = self.Physical_female_height[sel_age_key]
 
-        time_of_stay_seconds = random.normalvariate(self.Hourly_TimeOfStay_Minutes_mean[dt_hour] * 60,
-                                                    self.Hourly_TimeOfStay_Minutes_std[dt_hour] * 60)
+        time_of_stay_seconds = random.normalvariate(self.Calendar_TimeOfStay_Seconds_Mean[cell],
+                                                    self.Calendar_TimeOfStay_Seconds_Std[cell])
 
         datetime_arrival = date_time + datetime.timedelta(seconds=int(time_to_arrival))
         datetime_leave = date_time + datetime.timedelta(seconds=int(time_to_arrival + time_of_stay_seconds))
 
         als = []
 
+        activity_level_mean = self.Calendar_ActivityLevel_Mean[cell]
+        activity_level_std = self.Calendar_ActivityLevel_Std[cell]
         for n, dt in enumerate(utils.dates_bwn_two_date_times_generator(datetime_arrival, datetime_leave,
                                                                         time_step_seconds)):
-            als.append(np.max([0, np.min([1, random.normalvariate(self.Hourly_ActivityLevel_mean[dt_hour],
-                                                                  self.Hourly_ActivityLevel_std[dt_hour])])]) * 100.0)
+            als.append(np.max([0, np.min([1, random.normalvariate(activity_level_mean, activity_level_std)])]) * 100.0)
 
         return int(time_to_arrival), gender, int(age), weight, height, int(time_of_stay_seconds), als
+
+    def get_swimmers_from_model(self, calendar_index, number_of_swimmers, time_step_seconds, rng=None):
+        """
+        This function is the batch version of get_a_swimmer_from_model: it draws number_of_swimmers swimmers at once
+        using a numpy Generator. The swimmers are drawn from the distributions of one calendar cell, or of one cell per
+        swimmer when calendar_index is an array of length number_of_swimmers
+        :param calendar_index: flat index (or array of flat indices) into the calendar tables, see get_calendar_index
+        :param number_of_swimmers: number of swimmers to draw
+        :param time_step_seconds: time step between samples per seconds
+        :param rng: numpy random Generator (default: a freshly seeded numpy.random.default_rng())
+        :return: arrays of time to arrival, gender, age, weight, height, and staying time of the swimmers, plus a list
+        holding the array of activity levels of each swimmer
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+
+        inter_arrival_time = rng.normal(self.Calendar_InterArrivalTime_Seconds_Mean.reshape(-1)[calendar_index],
+                                        self.Calendar_InterArrivalTime_Seconds_Std.reshape(-1)[calendar_index],
+                                        number_of_swimmers)
+
+        # Same as random.expovariate(1 / inter_arrival_time), including its sign for negative inter-arrival times
+        time_to_arrival = rng.standard_exponential(number_of_swimmers) * inter_arrival_time
+
+        gender, age, weight, height, time_of_stay_seconds, als = \
+            self.get_swimmer_attributes_from_model(calendar_index, number_of_swimmers, time_step_seconds, rng,
+                                                   time_to_arrival)
+
+        return time_to_arrival.astype(np.int64), gender, age, weight, height, time_of_stay_seconds, als
+
+    def get_swimmer_attributes_from_model(self, calendar_index, number_of_swimmers, time_step_seconds, rng=None,
+                                          time_to_arrival=0.0):
+        """
+        This function draws gender, age, body size, staying time, and activity levels of number_of_swimmers swimmers
+        whose arrival times are already known, e.g. from ModelArrivalProcess
+        :param calendar_index: flat index (or array of flat indices) into the calendar tables, see get_calendar_index
+        :param number_of_swimmers: number of swimmers to draw
+        :param time_step_seconds: time step between samples per seconds
+        :param rng: numpy random Generator (default: a freshly seeded numpy.random.default_rng())
+        :param time_to_arrival: seconds from the reference date-time to the arrival of the swimmers, only its truncation
+        matters for the number of activity levels (default: 0, arrival on a whole second)
+        :return: arrays of gender, age, weight, height, and staying time of the swimmers, plus a list holding the array
+        of activity levels of each swimmer
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+
+        def cell(table):
+            return table.reshape(-1)[calendar_index]
+
+        is_male = rng.random(number_of_swimmers) < cell(self.Calendar_Gender_Male_Probability)
+
+        is_adult = rng.random(number_of_swimmers) < cell(self.Calendar_ProbabilityAdult)
+
+        age = np.where(is_adult,
+                       rng.normal(cell(self.Calendar_Age_High_Mean), cell(self.Calendar_Age_High_Std),
+                                  number_of_swimmers),
+                       rng.normal(cell(self.Calendar_Age_Low_Mean), cell(self.Calendar_Age_Low_Std),
+                                  number_of_swimmers))
+
+        age = np.clip(age, 1, 100)
+
+        # Smallest age range above the age of the swimmer, the last range otherwise
+        age_range_index = np.minimum(np.searchsorted(self.Physical_age_ranges, age, side='right'),
+                                     len(self.Physical_age_ranges) - 1)
+
+        weight = np.where(is_male, self.Physical_male_weights[age_range_index],
+                          self.Physical_female_weights[age_range_index])
+        height = np.where(is_male, self.Physical_male_heights[age_range_index],
+                          self.Physical_female_heights[age_range_index])
+
+        time_of_stay_seconds = rng.normal(cell(self.Calendar_TimeOfStay_Seconds_Mean),
+                                          cell(self.Calendar_TimeOfStay_Seconds_Std), number_of_swimmers)
+
+        # Number of time steps between arrival and leave, as generated by dates_bwn_two_date_times_generator
+        number_of_activity_levels = np.maximum(0, np.trunc((np.trunc(time_to_arrival + time_of_stay_seconds) -
+                                                            np.trunc(time_to_arrival)) / time_step_seconds))
+        number_of_activity_levels = number_of_activity_levels.astype(np.int64)
+
+        activity_level_mean = np.repeat(np.broadcast_to(cell(self.Calendar_ActivityLevel_Mean), number_of_swimmers),
+                                        number_of_activity_levels)
+        activity_level_std = np.repeat(np.broadcast_to(cell(self.Calendar_ActivityLevel_Std), number_of_swimmers),
+                                       number_of_activity_levels)
+
+        activity_levels = np.clip(rng.normal(activity_level_mean, activity_level_std), 0, 1) * 100.0
+
+        als = np.split(activity_levels, np.cumsum(number_of_activity_levels)[:-1]) if number_of_swimmers > 0 else []
+
+        gender = np.where(is_male, 'male', 'female')
+
+        return gender, age.astype(np.int64), weight, height, time_of_stay_seconds.astype(np.int64), als
@@ -1,4 +1,5 @@
 import numpy as np
+import TimeGrid
 
 
 class ModelWaterEvaporation:
@@ -21,7 +22,7 @@ class ModelWaterEvaporation:
     def process_water_evaporation(self, datetime_stamps, bather_load, swimming_pool_surface_area, water_temperature,
                                   room_temperature, room_humidity):
 
-        time_period_seconds = (datetime_stamps[1] - datetime_stamps[0]).seconds
+        time_period_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
 
         E0 = 0
         delta_roe = 0
@@ -32,12 +33,9 @@ class ModelWaterEvaporation:
                 E0 = r["E0"]
                 delta_roe = r["delta_roe"]
                 break
-        evaporations = []
-        for dt_stamp, num_bathers in zip(datetime_stamps, bather_load):
-            N_star = num_bathers / swimming_pool_surface_area
-            evaporation = E0
-            if N_star > 0.05:
-                evaporation = E0 * (1.9 - 21 * delta_roe + 5.3 * N_star)
-            evaporations.append(self.convert_water_kg_to_liter * swimming_pool_surface_area * evaporation *
-                                time_period_seconds / 3600)
-        return evaporations
+        number_of_stamps = min(len(datetime_stamps), len(bather_load))
+        N_star = np.asarray(bather_load[:number_of_stamps], dtype=float) / swimming_pool_surface_area
+        evaporation = np.where(N_star > 0.05, E0 * (1.9 - 21 * delta_roe + 5.3 * N_star), E0)
+        evaporations = self.convert_water_kg_to_liter * swimming_pool_surface_area * evaporation * \
+            time_period_seconds / 3600
+        return evaporations.tolist()
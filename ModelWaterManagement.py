@@ -1,5 +1,6 @@
-import datetime
 import numpy as np
+import OccupancyTable
+import TimeGrid
 
 class ModelWaterManagement:
 
@@ -40,7 +41,7 @@ class ModelWaterManagement:
         :return:
         """
 
-        time_step_seconds = (datetime_stamps[1] - datetime_stamps[0]).seconds
+        time_step_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
         VoW = swimming_pool_volume_of_water
 
         water_in = []
@@ -59,18 +60,56 @@ class ModelWaterManagement:
 
         return water_in, water_out
 
+    @staticmethod
+    def get_activity_class_counts(datetime_stamps, occupancy_data):
+        """
+        This function counts, per date-time stamp, the swimmers of low (activity level below 0.4), medium (below 0.7),
+        and high activity. The counts only depend on occupancy, so they can be computed once per occupancy dataset and
+        reused for every (gamma_L, gamma_M, gamma_H) of generate_occupancy_based_rate_water_flow
+        :param datetime_stamps: date-time stamps
+        :param occupancy_data: occupancy data as a list of dicts or an OccupancyTable
+        :return: array of shape [3 x date-time stamps] holding the counts of low, medium, and high activity swimmers
+        """
+        occupancy_table = OccupancyTable.OccupancyTable.from_any(occupancy_data)
+        time_grid = TimeGrid.TimeGrid.from_any(datetime_stamps)
+        number_of_time_steps = len(time_grid)
+        time_step_seconds = time_grid.time_step_seconds
+
+        epoch_start = time_grid.start_epoch_seconds
+        # Swimmers may arrive before the first stamp, e.g. swimmers carried over from a previous chunk of a simulation
+        dt_st_ind = np.floor((occupancy_table.arrival - epoch_start) / time_step_seconds).astype(np.int64)
+        dt_ed_ind = np.floor((occupancy_table.leave - epoch_start) / time_step_seconds).astype(np.int64)
+
+        # The m-th activity level of a swimmer falls in time step dt_st_ind + m, while the swimmer stays
+        number_of_steps = np.maximum(0, np.minimum(dt_ed_ind - dt_st_ind, occupancy_table.number_of_activity_levels))
+        swimmers = np.repeat(np.arange(len(occupancy_table)), number_of_steps)
+        m = np.arange(len(swimmers)) - np.repeat(np.cumsum(number_of_steps) - number_of_steps, number_of_steps)
+        n = dt_st_ind[swimmers] + m
+
+        activity_level = occupancy_table.activity_levels[occupancy_table.activity_offsets[swimmers] + m]
+        activity_level = activity_level.astype(float) / 100
+        activity_class = np.where(activity_level < 0.4, 0, np.where(activity_level < 0.7, 1, 2))
+
+        in_range = (n >= 0) & (n < number_of_time_steps)
+        activity_class_counts = np.bincount(activity_class[in_range] * number_of_time_steps + n[in_range],
+                                            minlength=3 * number_of_time_steps)
+
+        return activity_class_counts.reshape((3, number_of_time_steps)).astype(float)
+
     def generate_occupancy_based_rate_water_flow(self, datetime_stamps, occupancy_data, water_evaporation,
-                                                 swimming_pool_volume_of_water):
+                                                 swimming_pool_volume_of_water, activity_class_counts=None):
         """
 
         :param datetime_stamps:
         :param occupancy_data:
         :param water_evaporation:
         :param swimming_pool_volume_of_water:
+        :param activity_class_counts: counts of low, medium, and high activity swimmers per date-time stamp, as given by
+        get_activity_class_counts (default: computed from occupancy_data)
         :return:
         """
 
-        time_step_seconds = (datetime_stamps[1] - datetime_stamps[0]).seconds
+        time_step_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
         VoW = swimming_pool_volume_of_water
 
         alpha_L = self.gamma_L * time_step_seconds / self.time_base_seconds
@@ -80,21 +119,10 @@ class ModelWaterManagement:
         water_in = [0]
         water_out = [0]
 
-        water_to_add = np.zeros((len(datetime_stamps)))
-
-        for oc_d in occupancy_data:
-            dt_st_ind = int(((oc_d['DT-Arrival'] - datetime_stamps[0]).total_seconds()) / time_step_seconds)
-            dt_ed_ind = int(((oc_d['DT-Leave'] - datetime_stamps[0]).total_seconds()) / time_step_seconds)
-            for m, n in enumerate(np.arange(start=dt_st_ind, stop=dt_ed_ind, step=1)):
-                if len(oc_d['Act-Levels']) <= m:
-                    break
-                activity_level = oc_d['Act-Levels'][m] / 100
-                if activity_level < 0.4:
-                    water_to_add[n] += alpha_L
-                elif activity_level < 0.7:
-                    water_to_add[n] += alpha_M
-                else:
-                    water_to_add[n] += alpha_H
+        if activity_class_counts is None:
+            activity_class_counts = self.get_activity_class_counts(datetime_stamps, occupancy_data)
+
+        water_to_add = np.dot(np.array([alpha_L, alpha_M, alpha_H]), activity_class_counts)
 
         for dts, E, in_water in zip(datetime_stamps, water_evaporation, water_to_add):
             '''in_water = 0
@@ -126,6 +154,50 @@ class ModelWaterManagement:
 
         return water_in, water_out
 
+    def generate_occupancy_based_rate_water_flows(self, datetime_stamps, activity_class_counts, water_evaporation,
+                                                  swimming_pool_volume_of_water, gammas):
+        """
+        This function is the batched version of generate_occupancy_based_rate_water_flow: it generates the water flows of
+        P (gamma_L, gamma_M, gamma_H) triples at once. The time loop stays sequential because of the volume clamping,
+        while each step is vectorized across the triples
+        :param datetime_stamps:
+        :param activity_class_counts: counts of low, medium, and high activity swimmers per date-time stamp, as given by
+        get_activity_class_counts
+        :param water_evaporation:
+        :param swimming_pool_volume_of_water:
+        :param gammas: array of shape [P x 3] of (gamma_L, gamma_M, gamma_H) triples
+        :return: water_in and water_out arrays of shape [P x (date-time stamps + 1)], rows laid out as the lists of
+        generate_occupancy_based_rate_water_flow
+        """
+        time_step_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
+
+        alphas = np.asarray(gammas, dtype=float).reshape((-1, 3)) * time_step_seconds / self.time_base_seconds
+        number_of_parameters = alphas.shape[0]
+        number_of_time_steps = min(len(datetime_stamps), len(water_evaporation))
+
+        water_to_add = np.dot(alphas, activity_class_counts[:, :number_of_time_steps])
+
+        water_in = np.zeros((number_of_parameters, number_of_time_steps + 1))
+        water_out = np.zeros((number_of_parameters, number_of_time_steps + 1))
+
+        VoW = np.full((number_of_parameters,), float(swimming_pool_volume_of_water))
+
+        for n, E in enumerate(water_evaporation[:number_of_time_steps]):
+            in_water = water_to_add[:, n]
+            out_water = in_water - E
+
+            above_max = VoW > self.max_volume_of_water
+            below_min = ~above_max & (VoW < self.min_volume_of_water)
+            out_water = np.where(above_max, out_water + VoW - self.max_volume_of_water, out_water)
+            in_water = np.where(below_min, in_water + self.min_volume_of_water - VoW, in_water)
+
+            VoW += in_water - out_water - E
+
+            water_in[:, n + 1] = in_water
+            water_out[:, n + 1] = out_water
+
+        return water_in, water_out
+
     def generate_water_flow_based_on_bather_load_based(self, datetime_stamps, occupancy_data, water_evaporation,
                                                        swimming_pool_volume_of_water, daily_frequency=3,
                                                        liters_per_bather=15):
@@ -138,33 +210,31 @@ class ModelWaterManagement:
         :param liters_per_bather:
         :return:
         """
-        time_step_seconds = (datetime_stamps[1] - datetime_stamps[0]).seconds
-        dates = []
-        for dt in datetime_stamps:
-            date_ = dt.date()
-            if date_ not in dates:
-                dates.append(date_)
+        time_grid = TimeGrid.TimeGrid.from_any(datetime_stamps)
+        time_step_seconds = time_grid.time_step_seconds
+        occupancy_table = OccupancyTable.OccupancyTable.from_any(occupancy_data)
 
+        # Water is injected every day of the stamps at the hours hrs, injection n of day d has index d * len(hrs) + n
         hrs = np.linspace(11, 23, num=daily_frequency)
-        water_injection_date_times = []
-        for d in dates:
-            for h in hrs:
-                dt = datetime.datetime(d.year, d.month, d.day, int(h), 0, 0)
-                water_injection_date_times.append({'dt': dt, 'Applied': False})
-
-        occupancy_of_injection_periods = np.zeros((len(water_injection_date_times)))
-
-        for oc_d in occupancy_data:
-            ind_hr = 0
-            for n, hr in enumerate(hrs):
-                if oc_d['DT-Leave'].hour < hr:
-                    ind_hr = n
-                    break
-            diff_days = (oc_d['DT-Leave'].date() - datetime_stamps[1].date()).days
-            ind = diff_days * len(hrs) + ind_hr
-            occupancy_of_injection_periods[ind] += 1
-            #if oc_d['DT-Leave'] < dts + datetime.timedelta(seconds=time_step_seconds) and oc_d['DT-Leave'] > dts:
-            #    cumulative_volume_of_water += liters_per_bather
+        first_day = time_grid.start_epoch_seconds // TimeGrid.SECONDS_PER_DAY
+        injection_days = first_day + np.arange(len(time_grid.dates))
+        water_injection_epoch_seconds = (injection_days[:, None] * TimeGrid.SECONDS_PER_DAY +
+                                         hrs.astype(np.int64)[None, :] * 3600).reshape(-1)
+
+        # A swimmer counts for the first injection after the hour of leave on the day of leave (the first injection
+        # of the day if there is none), days being counted from the date of the second stamp
+        leave_hours = (occupancy_table.leave // 3600) % 24
+        ind_hr = np.searchsorted(hrs, leave_hours, side='right')
+        ind_hr = np.where(ind_hr < len(hrs), ind_hr, 0)
+        diff_days = occupancy_table.leave // TimeGrid.SECONDS_PER_DAY - \
+            (time_grid.start_epoch_seconds + time_grid.time_step_seconds) // TimeGrid.SECONDS_PER_DAY
+
+        occupancy_of_injection_periods = np.zeros((len(water_injection_epoch_seconds)))
+        np.add.at(occupancy_of_injection_periods, diff_days * len(hrs) + ind_hr, 1)
+
+        # Number of injections strictly before each stamp
+        number_of_applied_injections = np.searchsorted(water_injection_epoch_seconds, time_grid.epoch_seconds,
+                                                       side='left')
 
         max_water_rate_to_inject_liter_per_second = 1
 
@@ -174,15 +244,13 @@ class ModelWaterManagement:
         water_out = [0]
 
         cumulative_volume_of_water_to_add = 0
-        cumulative_volume_of_water = 0
-        for dts, E in zip(datetime_stamps, water_evaporation):
-            for item, occ in zip(water_injection_date_times, occupancy_of_injection_periods):
-                if not item['Applied']:
-                    if item['dt'] < dts:
-                        cumulative_volume_of_water_to_add = occ * liters_per_bather
-                        item['Applied'] = True
-                    else:
-                        break
+        applied_injections = 0
+        for applied_injections_at_stamp, E in zip(number_of_applied_injections, water_evaporation):
+            # The latest injection before the stamp replaces the water left to add
+            if applied_injections_at_stamp > applied_injections:
+                cumulative_volume_of_water_to_add = \
+                    occupancy_of_injection_periods[applied_injections_at_stamp - 1] * liters_per_bather
+                applied_injections = applied_injections_at_stamp
 
             out_water = 0
             in_water = 0
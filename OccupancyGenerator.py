@@ -0,0 +1,132 @@
+import os
+import multiprocessing
+import numpy as np
+import TimeGrid
+import OccupancyTable
+import ModelOccupancyParameters
+import ModelArrivalProcess
+
+# Models of a worker process, set up once per process by initialize_worker
+worker_models = {}
+
+
+class OccupancyGenerator:
+    def __init__(self, json_file_path='SwimmingPoolOccupancyParameters.json'):
+        """
+        This class simulates occupancy day by day. Every calendar day has its own random stream, the child of the
+        master seed sequence for the number of the day since 1970-01-01 (SeedSequence(seed, spawn_key=(day,)), which is
+        what SeedSequence(seed).spawn would give as child number day). Swimmers are attributed to the day of their
+        arrival, even when they stay past midnight, so days are independent: they are generated on a pool of processes
+        and merged in order. Days are always generated whole and then clipped to the simulation, so the swimmers
+        arriving at a given time only depend on the master seed and the time step, not on the number of processes,
+        nor on the start, end, or chunking of the simulation, even when these fall within a day
+        :param json_file_path: path of the occupancy parameters json file
+        """
+        self.json_file_path = json_file_path
+        self.model = None
+        self.arrival_process = None
+
+    def load_models(self):
+        """
+        This function loads the occupancy models, when swimmers are generated in the calling process
+        """
+        if self.model is None:
+            self.model = ModelOccupancyParameters.ModelOccupancyParameters(json_file_path=self.json_file_path)
+            self.arrival_process = ModelArrivalProcess.ModelArrivalProcess(self.model)
+
+    @staticmethod
+    def get_entropy(seed):
+        """
+        :param seed: master seed (None: unpredictable)
+        :return: entropy of the master seed sequence, to give to every chunk of a simulation
+        """
+        return np.random.SeedSequence(seed).entropy
+
+    @staticmethod
+    def get_days(time_grid):
+        """
+        This function splits the time steps of a time grid by calendar day
+        :param time_grid: time grid of the simulation
+        :return: list of (day since 1970-01-01, start, end) of each day, start and end in seconds since the epoch and
+        clipped to the time steps of the grid
+        """
+        start = time_grid.start_epoch_seconds
+        end = time_grid.end_epoch_seconds
+        days = range(start // TimeGrid.SECONDS_PER_DAY, -(-end // TimeGrid.SECONDS_PER_DAY))
+        return [(day, max(start, day * TimeGrid.SECONDS_PER_DAY), min(end, (day + 1) * TimeGrid.SECONDS_PER_DAY))
+                for day in days]
+
+    def generate(self, datetime_stamps, seed=None, number_of_processes=1, chunk_size=8):
+        """
+        This function simulates the swimmers arriving during the time steps of a simulation
+        :param datetime_stamps: datetime stamps of the simulation, as a time grid or a list of datetimes
+        :param seed: master seed, or entropy given by get_entropy (default: None, unpredictable)
+        :param number_of_processes: number of worker processes (default: 1, in the calling process; None: number of
+        CPUs)
+        :param chunk_size: number of days per task
+        :return: occupancy table of the swimmers, ordered by day of arrival
+        """
+        time_grid = TimeGrid.TimeGrid.from_any(datetime_stamps)
+        entropy = self.get_entropy(seed)
+        tasks = [(entropy, day, start, end, time_grid.time_step_seconds) for day, start, end in
+                 self.get_days(time_grid)]
+
+        if number_of_processes == 1:
+            self.load_models()
+            tables = [generate_day(self.model, self.arrival_process, *task) for task in tasks]
+        else:
+            chunks = [tasks[n:n + chunk_size] for n in range(0, len(tasks), chunk_size)]
+            with multiprocessing.Pool(number_of_processes or os.cpu_count(), initializer=initialize_worker,
+                                      initargs=(self.json_file_path,)) as pool:
+                tables = [table for chunk_tables in pool.imap(generate_days, chunks) for table in chunk_tables]
+
+        return OccupancyTable.OccupancyTable.concatenate(tables) if tables else \
+            OccupancyTable.OccupancyTable.from_swimmers([], [], [], [], [], [], [])
+
+
+def generate_day(model, arrival_process, entropy, day, start, end, time_step_seconds):
+    """
+    This function simulates the swimmers arriving during one day, from the random stream of the day. The whole day
+    is drawn from the stream and then clipped to [start, end), so that the swimmers do not depend on the clipping
+    :param model: occupancy model
+    :param arrival_process: arrival process of the occupancy model
+    :param entropy: entropy of the master seed sequence
+    :param day: day since 1970-01-01
+    :param start: start of the arrivals in seconds since the epoch
+    :param end: end of the arrivals in seconds since the epoch
+    :param time_step_seconds: period of time-stamps in seconds
+    :return: occupancy table of the swimmers arriving during the day between start and end
+    """
+    rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(day,)))
+
+    dt_start, dt_end = TimeGrid.epoch_seconds_to_datetimes([day * TimeGrid.SECONDS_PER_DAY,
+                                                            (day + 1) * TimeGrid.SECONDS_PER_DAY])
+    arrival_epoch_seconds = np.floor(arrival_process.generate_arrival_times(dt_start, dt_end, rng))
+    arrival_epoch_seconds = arrival_epoch_seconds.astype(np.int64)
+
+    gender, age, weight, height, time_of_stay_seconds, als = \
+        model.get_swimmer_attributes_from_model(model.get_calendar_indices(arrival_epoch_seconds),
+                                                len(arrival_epoch_seconds), time_step_seconds, rng)
+
+    table = OccupancyTable.OccupancyTable.from_swimmers(arrival_epoch_seconds,
+                                                        arrival_epoch_seconds + time_of_stay_seconds,
+                                                        gender, age, weight, height, als)
+    return table.take((arrival_epoch_seconds >= start) & (arrival_epoch_seconds < end))
+
+
+def initialize_worker(json_file_path):
+    """
+    This function loads the occupancy models in a worker process
+    :param json_file_path: path of the occupancy parameters json file
+    """
+    worker_models['model'] = ModelOccupancyParameters.ModelOccupancyParameters(json_file_path=json_file_path)
+    worker_models['arrival_process'] = ModelArrivalProcess.ModelArrivalProcess(worker_models['model'])
+
+
+def generate_days(tasks):
+    """
+    This function simulates the swimmers of a chunk of days in a worker process
+    :param tasks: list of (entropy, day, start, end, time_step_seconds) of the days
+    :return: list of the occupancy tables of the days
+    """
+    return [generate_day(worker_models['model'], worker_models['arrival_process'], *task) for task in tasks]
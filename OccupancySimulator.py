@@ -1,60 +1,51 @@
-import datetime
 from typing import Any
 
 import utils
-import ModelOccupancyParameters
+import OccupancyTable
+import TimeGrid
 import ModelChemicalParameters
 import ModelWaterManagement
 import ModelBodyFluidRelease
 import ModelWaterEvaporation
+import ParameterSweep
+import SurrogateOptimizer
+import SweepResultStore
+import CostFunction
+import StageCache
+import OccupancyGenerator
 import numpy as np
 import json
-from django.core.serializers.json import DjangoJSONEncoder
 
 
-def simulate_occupancy_between_two_date_times(start_date_time, end_date_time, time_step_seconds=300):
+def simulate_occupancy_between_two_date_times(start_date_time, end_date_time, time_step_seconds=300, seed=None,
+                                              as_table=False, number_of_processes=1):
     """
     This function provides occupancy model between two dates
     :param time_step_seconds: time difference between each consecutive time-sample (default: 300 seconds)
     :param start_date_time: start date-time of occupancy simulation (format: YYYY-MM-DD hh:mm:ss)
     :param end_date_time: end date-time of occupancy simulation (format: YYYY-MM-DD hh:mm:ss)
+    :param seed: master seed of the random streams of swimmers, one per day (default: None, unpredictable)
+    :param as_table: return the occupancy as an OccupancyTable instead of a list of dicts
+    :param number_of_processes: number of processes generating days in parallel, the occupancy does not depend on it
+    (default: 1; None: number of CPUs)
     :return: returns a json file of occupancy between the specified date-times as an array of objects which each object
     presents one single occupant with its weight, height, age, gender, and activity level data throughout the staying
     time.
     """
 
-    model = ModelOccupancyParameters.ModelOccupancyParameters()
+    generator = OccupancyGenerator.OccupancyGenerator()
 
     utils.validate_date_time_string(start_date_time)
 
     utils.validate_date_time_string(end_date_time)
 
-    dt_start = datetime.datetime.strptime(start_date_time, '%Y/%m/%d %H:%M:%S')
-
-    dt_end = datetime.datetime.strptime(end_date_time, '%Y/%m/%d %H:%M:%S')
-
-    dts = utils.dates_bwn_two_date_times_generator(dt_start, dt_end, time_step_seconds)
-    occupancy_data = []
-    datetime_stamps = []
-    for n, dt in enumerate(dts):
-        dt_ = dt
-        datetime_stamps.append(dt)
-        s = 0
-        while True:
-
-            time_to_arrival, gender, age, weight, height, time_of_stay_seconds, als = \
-                model.get_a_swimmer_from_model(dt_, time_step_seconds)
-
-            s += time_to_arrival
-            if s < time_step_seconds:
-                datetime_arrival = dt + datetime.timedelta(seconds=s)
-                datetime_leave = dt + datetime.timedelta(seconds=s + time_of_stay_seconds)
-                dt_ = datetime_arrival
-                occupancy_data.append({'DT-Arrival': datetime_arrival, 'Gender': gender, 'Age': age, 'Weight': weight,
-                                       'Height': height, 'DT-Leave': datetime_leave, 'Act-Levels': als})
-            else:
-                break
-    return datetime_stamps, occupancy_data
+    datetime_stamps = TimeGrid.TimeGrid.from_date_time_strings(start_date_time, end_date_time, time_step_seconds)
+
+    # Swimmers arrive during the time steps of the simulation, each day from its own random stream
+    occupancy_table = generator.generate(datetime_stamps, seed, number_of_processes)
+    if as_table:
+        return datetime_stamps, occupancy_table
+    return datetime_stamps, occupancy_table.to_occupancy_data()
 
 
 def generate_set_of_parameters(min_l, min_m, min_h, max_l, max_m, max_h, step_l=4, step_m=10, step_h=10):
@@ -81,37 +72,6 @@ def generate_set_of_parameters(min_l, min_m, min_h, max_l, max_m, max_h, step_l=
     return set_parameters
 
 
-def cost_function(water_ins, bather_load, chemical_parameters, tcm_threshold, lambda_water_quality=1000000,
-                  time_step_seconds=360):
-    """
-
-    :param water_ins:
-    :param chemical_parameters:
-    :param tcm_threshold:
-    :param lambda_water_quality:
-    :return:
-    """
-    cost_water_use = 0
-    cost_water_quality = 0
-
-    liter_2_m3 = 0.001
-
-    for water_in in water_ins:
-        cost_water_use += water_in
-
-    # Cost of water use in cubic meters instead of liters
-    cost_water_use = liter_2_m3 * cost_water_use
-
-    time_adj = 60 * 60 / time_step_seconds
-
-    for chem_param, bl in zip(chemical_parameters, bather_load):
-        tcm = chem_param['TCM']
-        if tcm > tcm_threshold:
-            cost_water_quality += bl * (tcm-tcm_threshold)/tcm_threshold
-
-    return cost_water_use + lambda_water_quality * (cost_water_quality / time_adj), cost_water_use, cost_water_quality
-
-
 def main():
     # start_date_time: Start date-time of simulation, format: YYYY/MM/DD HH:mm:ss
     start_date_time = "2022/03/01 00:00:00"
@@ -197,14 +157,16 @@ def main():
     utils.plot_toc_and_tcm_concentration_in_one_chart(datetime_stamps, chemical_parameters)
 
     with open("run_Chemicals.json", "w") as i:
-        json_string = json.dumps(chemical_parameters)
+        json_string = json.dumps(model_chemicals.get_chemical_parameters_rows(chemical_parameters))
         i.write(json_string)
         i.write(",\n")
 
-    with open("run_Occupancy.json", "w") as i:
-        json_string = json.dumps(occupancy_data, sort_keys=True, indent=1, cls=DjangoJSONEncoder)
-        i.write(json_string)
-        i.write(",\n")
+    OccupancyTable.OccupancyTable.from_any(occupancy_data).save(
+        "run_Occupancy", {'start_date_time': start_date_time, 'end_date_time': end_date_time,
+                          'time_step_seconds': time_step_seconds, 'seed': None,
+                          'occupancy_profile': 'SwimmingPoolOccupancyParameters.json',
+                          'occupancy_profile_hash': StageCache.StageCache.get_file_hash(
+                              'SwimmingPoolOccupancyParameters.json')})
 
     #utils.plot_tcm_concentration(datetime_stamps, chemical_parameters)
 
@@ -218,7 +180,13 @@ def main():
     print('bather load:{}'.format(len(occupancy_data)))
 
 
-def train():
+def train(prune=False):
+    """
+    This function sweeps the grid of gammas and stores the result of every evaluated triple
+    :param prune: abort triples as soon as they cannot beat the best cost found so far, which is faster but leaves
+    pruned triples without cost: the Pareto front and smoothed costs of AnalyzeExperimentalPoint need sweeps run
+    without pruning (default: False)
+    """
     # start_date_time: Start date-time of simulation, format: YYYY/MM/DD HH:mm:ss
     start_date_time = "2022/01/01 00:00:00"
     # end_date_time: End date-time of simulation, format: YYYY/MM/DD HH:mm:ss
@@ -239,6 +207,8 @@ def train():
     # Optimization parameters
     tcm_threshold = 100.0
     lambda_water_quality = 1
+    # seed: seed of the occupancy simulation, results are only reused for the same occupancy
+    seed = 2022
 
     min_l = 2
     max_l = 22
@@ -254,7 +224,7 @@ def train():
 
     # Simulate occupancy of swimming pool between start and end date-times
     datetime_stamps, occupancy_data = simulate_occupancy_between_two_date_times(start_date_time, end_date_time,
-                                                                                time_step_seconds)
+                                                                                time_step_seconds, seed=seed)
 
     # Simulate body fluid release based on occupancy data and water temperature
     model_bfa_release = ModelBodyFluidRelease.ModelBodyFluidRelease()
@@ -276,48 +246,167 @@ def train():
     model_wm = ModelWaterManagement.ModelWaterManagement(min_swimming_pool_volume_of_water,
                                                          max_swimming_pool_volume_of_water)
 
-    min_cost = 20000
-    selected_params = {}
-    cost_parameters = []
+    # Occupancy does not change between parameters, count swimmers per activity class once
+    activity_class_counts = model_wm.get_activity_class_counts(datetime_stamps, occupancy_data)
+
+    # Results are stored per configuration, parameters already evaluated by an interrupted sweep are skipped. Pruned
+    # parameters are stored without cost and are not evaluated again when the sweep is resumed, whether the sweep
+    # prunes is part of the configuration
+    configuration = {'start_date_time': start_date_time, 'end_date_time': end_date_time,
+                     'time_step_seconds': time_step_seconds,
+                     'swimming_pool_water_temperature_celsius': swimming_pool_water_temperature_celsius,
+                     'natatorium_room_temperature_celsius': natatorium_room_temperature_celsius,
+                     'natatorium_room_relative_humidity': natatorium_room_relative_humidity,
+                     'swimming_pool_volume_of_water': swimming_pool_volume_of_water,
+                     'max_swimming_pool_volume_of_water': max_swimming_pool_volume_of_water,
+                     'min_swimming_pool_volume_of_water': min_swimming_pool_volume_of_water,
+                     'swimming_pool_surface_area': swimming_pool_surface_area,
+                     'initial_chemical_parameters': initial_chemical_parameters, 'tcm_threshold': tcm_threshold,
+                     'lambda_water_quality': lambda_water_quality,
+                     'occupancy_profile': 'SwimmingPoolOccupancyParameters.json', 'seed': seed,
+                     'random_streams': 'whole-days', 'pruning': prune}
+    config_hash = SweepResultStore.SweepResultStore.get_configuration_hash(configuration)
+
+    with SweepResultStore.SweepResultStore() as store:
+        min_cost = 20000
+        selected_params = {}
+
+        best_result = store.get_best_result(config_hash)
+        if best_result is not None and best_result['cost'] < min_cost:
+            min_cost = best_result['cost']
+            selected_params = {'gamma_L': best_result['gamma_l'], 'gamma_M': best_result['gamma_m'],
+                               'gamma_H': best_result['gamma_h']}
+
+        evaluated_gammas = store.get_evaluated_gammas(config_hash)
+        set_parameters = [parameters for parameters in set_parameters
+                          if (float(parameters['gamma_L']), float(parameters['gamma_M']),
+                              float(parameters['gamma_H'])) not in evaluated_gammas]
+        print('parameters already evaluated: {}, parameters to evaluate: {}'.format(len(evaluated_gammas),
+                                                                                   len(set_parameters)))
+
+        gammas = [[parameters['gamma_L'], parameters['gamma_M'], parameters['gamma_H']]
+                  for parameters in set_parameters]
+
+        # Evaluate parameters on all cores, with the inputs shared between worker processes, and when pruning, abort
+        # parameters as soon as they cannot beat the best cost found so far
+        with ParameterSweep.ParameterSweep(datetime_stamps, activity_class_counts, body_fluid_release,
+                                           water_evaporation, bather_load, swimming_pool_water_temperature_celsius,
+                                           swimming_pool_volume_of_water, min_swimming_pool_volume_of_water,
+                                           max_swimming_pool_volume_of_water, initial_chemical_parameters,
+                                           tcm_threshold, lambda_water_quality, time_step_seconds) as sweep:
+            if prune:
+                results = sweep.evaluate_with_pruning(gammas, best_cost=min_cost)
+            else:
+                results = (result + (False,) for result in sweep.evaluate(gammas))
 
-    for parameters in set_parameters:
-        model_wm.set_parameters(gamma_l=parameters['gamma_L'], gamma_m=parameters['gamma_M'],
-                                gamma_h=parameters['gamma_H'])
+            for parameters, (_, cost, cost_water_use, cost_water_quality, pruned) in zip(set_parameters, results):
+                new_rec = {'cost': cost, 'gamma_l': float(parameters['gamma_L']),
+                           'gamma_m': float(parameters['gamma_M']), 'gamma_h': float(parameters['gamma_H']),
+                           'water use': cost_water_use, 'health_cost': float(cost_water_quality),
+                           'contribute': min_cost - cost, 'pruned': pruned}
 
-        # Generate water management input and output flows of water
-        wf_in, wf_out = model_wm.generate_occupancy_based_rate_water_flow(datetime_stamps,
-                                                                          occupancy_data,
-                                                                          water_evaporation,
-                                                                          swimming_pool_volume_of_water)
+                print(new_rec)
 
-        # Model chemical parameters and content
-        model_chemicals = ModelChemicalParameters.ModelChemicalParameters()
-        chemical_parameters = model_chemicals.process_chemical_parameters(initial_chemical_parameters, datetime_stamps,
-                                                                          body_fluid_release,
+                if not pruned and min_cost > cost:
+                    min_cost = cost
+                    selected_params = parameters
+
+                store.add_result(config_hash, configuration, parameters['gamma_L'], parameters['gamma_M'],
+                                 parameters['gamma_H'], cost, cost_water_use, cost_water_quality, pruned)
+
+            if prune:
+                print('pruned step evaluations: {} of {}'.format(sweep.pruned_step_evaluations,
+                                                                 sweep.total_step_evaluations))
+
+    print('total cost:{}, parameters:{}'.format(min_cost, selected_params))
+
+
+def train_surrogate():
+    # start_date_time: Start date-time of simulation, format: YYYY/MM/DD HH:mm:ss
+    start_date_time = "2022/01/01 00:00:00"
+    # end_date_time: End date-time of simulation, format: YYYY/MM/DD HH:mm:ss
+    end_date_time = "2022/12/31 23:55:00"
+    # time_step_seconds: period of time-stamps in seconds
+    time_step_seconds = 360
+    # swimming_pool_water_temperature_celsius: operational water temperature of the swimming pool
+    swimming_pool_water_temperature_celsius = 30
+    natatorium_room_temperature_celsius = 32
+    natatorium_room_relative_humidity = 0.5
+    # swimming_pool_volume_of_water: volume of water in the swimming pool (liter)
+    swimming_pool_volume_of_water = 200 * 1000
+    max_swimming_pool_volume_of_water = 250 * 1000
+    min_swimming_pool_volume_of_water = 150 * 1000
+    swimming_pool_surface_area = 150
+    # initial_chemical_parameters: initial chemical parameters of the swimming pool at the start datetime
+    initial_chemical_parameters = {"FAC": 1, "TCM": 0.0, "CC": 0, "pH": 7.8, "ORP": 700, "BF": 0}
+    # Optimization parameters
+    tcm_threshold = 100.0
+    lambda_water_quality = 1
+
+    # Budget of full-year simulations
+    number_of_evaluations = 100
+
+    min_l = 2
+    max_l = 22
+
+    min_m = 20
+    max_m = 82
+
+    min_h = 40
+    max_h = 182
+
+    # Simulate occupancy of swimming pool between start and end date-times
+    datetime_stamps, occupancy_data = simulate_occupancy_between_two_date_times(start_date_time, end_date_time,
+                                                                                time_step_seconds)
+
+    # Simulate body fluid release based on occupancy data and water temperature
+    model_bfa_release = ModelBodyFluidRelease.ModelBodyFluidRelease()
+    body_fluid_release = model_bfa_release.simulate_body_fluid_release(datetime_stamps, occupancy_data,
+                                                                       swimming_pool_water_temperature_celsius)
+
+    # Calculate bather load
+    bather_load = utils.get_bather_load_for_datetime_stamps(datetime_stamps, occupancy_data, time_step_seconds)
+
+    # Model water evaporation
+    model_water_evaporation = ModelWaterEvaporation.ModelWaterEvaporation()
+    water_evaporation = model_water_evaporation.process_water_evaporation(datetime_stamps, bather_load,
+                                                                          swimming_pool_surface_area,
                                                                           swimming_pool_water_temperature_celsius,
-                                                                          swimming_pool_volume_of_water,
-                                                                          water_evaporation, wf_in, wf_out)
+                                                                          natatorium_room_temperature_celsius,
+                                                                          natatorium_room_relative_humidity)
 
-        # Calculate cost function terms
-        cost, cost_water_use, cost_water_quality = cost_function(wf_in, bather_load, chemical_parameters,
-                                                                 tcm_threshold, lambda_water_quality, time_step_seconds)
+    # Model water management
+    model_wm = ModelWaterManagement.ModelWaterManagement(min_swimming_pool_volume_of_water,
+                                                         max_swimming_pool_volume_of_water)
 
-        new_rec = {'cost': cost, 'gamma_l': float(parameters['gamma_L']), 'gamma_m': float(parameters['gamma_M']),
-                   'gamma_h': float(parameters['gamma_H']), 'water use': cost_water_use,
-                   'health_cost': float(cost_water_quality), 'contribute': min_cost - cost}
+    # Occupancy does not change between parameters, count swimmers per activity class once
+    activity_class_counts = model_wm.get_activity_class_counts(datetime_stamps, occupancy_data)
 
-        cost_parameters.append(new_rec)
+    # Model chemical parameters and content
+    model_chemicals = ModelChemicalParameters.ModelChemicalParameters()
 
-        print(new_rec)
+    def evaluate_parameters(gamma_l, gamma_m, gamma_h):
+        # Generate water management input and output flows of water
+        wf_ins, wf_outs = model_wm.generate_occupancy_based_rate_water_flows(datetime_stamps, activity_class_counts,
+                                                                             water_evaporation,
+                                                                             swimming_pool_volume_of_water,
+                                                                             [[gamma_l, gamma_m, gamma_h]])
+
+        # A single scenario is integrated faster by the scan solver than step by step
+        chemical_states = model_chemicals.process_chemical_parameters_scan(initial_chemical_parameters,
+                                                                           datetime_stamps, body_fluid_release,
+                                                                           swimming_pool_water_temperature_celsius,
+                                                                           swimming_pool_volume_of_water,
+                                                                           water_evaporation, wf_ins, wf_outs)
 
-        if min_cost > cost:
-            min_cost = cost
-            selected_params = parameters
+        # Calculate cost function terms
+        costs, _, _ = CostFunction.cost_function_batch(wf_ins, bather_load, chemical_states['TCM'], tcm_threshold,
+                                                       lambda_water_quality, time_step_seconds)
+        return costs[0]
 
-        with open("data_T30C_20220807.json", "a") as i:
-            json_string = json.dumps(new_rec)
-            i.write(json_string)
-            i.write(",\n")
+    optimizer = SurrogateOptimizer.SurrogateOptimizer(evaluate_parameters, [min_l, min_m, min_h],
+                                                      [max_l, max_m, max_h], budget=number_of_evaluations, step=2)
+    selected_params, min_cost = optimizer.optimize()
 
     print('total cost:{}, parameters:{}'.format(min_cost, selected_params))
 
@@ -343,13 +432,15 @@ def train2():
     # Optimization parameters
     tcm_threshold = 100.0
     lambda_water_quality = 1
+    # seed: seed of the occupancy simulation, results are only reused for the same occupancy
+    seed = 2022
 
     params = [4, 20, 160]
 
     # Simulate occupancy of swimming pool between start and end date-times
     print("Occupancy Modeling!")
     datetime_stamps, occupancy_data = simulate_occupancy_between_two_date_times(start_date_time, end_date_time,
-                                                                                time_step_seconds)
+                                                                                time_step_seconds, seed=seed)
 
     # Simulate body fluid release based on occupancy data and water temperature
     print("Body Fluid Release!")
@@ -374,32 +465,62 @@ def train2():
     model_wm = ModelWaterManagement.ModelWaterManagement(min_swimming_pool_volume_of_water,
                                                          max_swimming_pool_volume_of_water)
 
+    # Occupancy does not change between parameters, count swimmers per activity class once
+    activity_class_counts = model_wm.get_activity_class_counts(datetime_stamps, occupancy_data)
+
+    # Results are stored per configuration, parameters already evaluated are not simulated again
+    configuration = {'start_date_time': start_date_time, 'end_date_time': end_date_time,
+                     'time_step_seconds': time_step_seconds,
+                     'swimming_pool_water_temperature_celsius': swimming_pool_water_temperature_celsius,
+                     'natatorium_room_temperature_celsius': natatorium_room_temperature_celsius,
+                     'natatorium_room_relative_humidity': natatorium_room_relative_humidity,
+                     'swimming_pool_volume_of_water': swimming_pool_volume_of_water,
+                     'max_swimming_pool_volume_of_water': max_swimming_pool_volume_of_water,
+                     'min_swimming_pool_volume_of_water': min_swimming_pool_volume_of_water,
+                     'swimming_pool_surface_area': swimming_pool_surface_area,
+                     'initial_chemical_parameters': initial_chemical_parameters, 'tcm_threshold': tcm_threshold,
+                     'lambda_water_quality': lambda_water_quality,
+                     'occupancy_profile': 'SwimmingPoolOccupancyParameters.json', 'seed': seed,
+                     'random_streams': 'whole-days'}
+    config_hash = SweepResultStore.SweepResultStore.get_configuration_hash(configuration)
+    store = SweepResultStore.SweepResultStore()
+
     min_cost = 922.71
     selected_params = {}
     cost_parameters = []
     print("Start Iterations!")
     while True:
 
-        model_wm.set_parameters(gamma_l=params[0], gamma_m=params[1],
-                                gamma_h=params[2])
-
-        # Generate water management input and output flows of water
-        wf_in, wf_out = model_wm.generate_occupancy_based_rate_water_flow(datetime_stamps,
-                                                                          occupancy_data,
-                                                                          water_evaporation,
-                                                                          swimming_pool_volume_of_water)
-
-        # Model chemical parameters and content
-        model_chemicals = ModelChemicalParameters.ModelChemicalParameters()
-        chemical_parameters = model_chemicals.process_chemical_parameters(initial_chemical_parameters, datetime_stamps,
-                                                                          body_fluid_release,
-                                                                          swimming_pool_water_temperature_celsius,
-                                                                          swimming_pool_volume_of_water,
-                                                                          water_evaporation, wf_in, wf_out)
+        result = store.get_result(config_hash, params[0], params[1], params[2])
+        if result is not None:
+            cost, cost_water_use, cost_water_quality = result['cost'], result['water_use'], result['health_cost']
+        else:
+            model_wm.set_parameters(gamma_l=params[0], gamma_m=params[1],
+                                    gamma_h=params[2])
 
-        # Calculate cost function terms
-        cost, cost_water_use, cost_water_quality = cost_function(wf_in, bather_load, chemical_parameters,
-                                                                 tcm_threshold, lambda_water_quality, time_step_seconds)
+            # Generate water management input and output flows of water
+            wf_in, wf_out = model_wm.generate_occupancy_based_rate_water_flow(datetime_stamps,
+                                                                              occupancy_data,
+                                                                              water_evaporation,
+                                                                              swimming_pool_volume_of_water,
+                                                                              activity_class_counts)
+
+            # Model chemical parameters and content
+            model_chemicals = ModelChemicalParameters.ModelChemicalParameters()
+            chemical_parameters = model_chemicals.process_chemical_parameters(initial_chemical_parameters,
+                                                                              datetime_stamps, body_fluid_release,
+                                                                              swimming_pool_water_temperature_celsius,
+                                                                              swimming_pool_volume_of_water,
+                                                                              water_evaporation, wf_in, wf_out)
+
+            # Calculate cost function terms
+            cost, cost_water_use, cost_water_quality = CostFunction.cost_function(wf_in, bather_load,
+                                                                                  chemical_parameters, tcm_threshold,
+                                                                                  lambda_water_quality,
+                                                                                  time_step_seconds)
+
+            store.add_result(config_hash, configuration, params[0], params[1], params[2], cost, cost_water_use,
+                             cost_water_quality)
 
         new_rec = {'cost': cost, 'gamma_l': float(params[0]), 'gamma_m': float(params[1]),
                    'gamma_h': float(params[2]), 'water use': cost_water_use,
@@ -413,11 +534,6 @@ def train2():
             min_cost = cost
             selected_params = params
 
-        with open("data.json", "a") as i:
-            json_string = json.dumps(new_rec)
-            i.write(json_string)
-            i.write(",\n")
-
         # Prepare for next step
         if cost_water_quality > 0:
             if params[2] < 180:
@@ -441,6 +557,8 @@ def train2():
 
         print('Next step: gamma_l={}, gamma_m={}, gamma_h={}'.format(params[0], params[1], params[2]))
 
+    store.close()
+
     print('total cost:{}, parameters:{}'.format(min_cost, selected_params))
 
 
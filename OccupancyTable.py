@@ -0,0 +1,231 @@
+import os
+import json
+import numpy as np
+import TimeGrid
+
+GENDER_FEMALE = 0
+GENDER_MALE = 1
+
+OCCUPANCY_TABLE_COLUMNS = ['arrival', 'leave', 'gender', 'age', 'weight', 'height', 'activity_levels',
+                           'activity_offsets']
+OCCUPANCY_TABLE_HEADER_FILE_NAME = 'header.json'
+
+
+class OccupancyTable:
+    def __init__(self, arrival, leave, gender, age, weight, height, activity_levels, activity_offsets):
+        """
+        This class stores occupancy data as columns (struct of arrays) instead of a list of dicts: one entry per swimmer
+        in each column, and the activity levels of all swimmers in one flat buffer where the activity levels of swimmer n
+        are activity_levels[activity_offsets[n]:activity_offsets[n + 1]]
+        :param arrival: arrival date-times of swimmers in seconds since the epoch
+        :param leave: leave date-times of swimmers in seconds since the epoch
+        :param gender: gender of swimmers, GENDER_MALE or GENDER_FEMALE
+        :param age: age of swimmers
+        :param weight: weight of swimmers (kg)
+        :param height: height of swimmers (cm)
+        :param activity_levels: activity levels of all swimmers, per time step of their stay, as a flat buffer
+        :param activity_offsets: offsets of the activity levels of each swimmer in the flat buffer (one more than swimmers)
+        """
+        self.arrival = np.asarray(arrival, dtype=np.int64)
+        self.leave = np.asarray(leave, dtype=np.int64)
+        self.gender = np.asarray(gender, dtype=np.uint8)
+        self.age = np.asarray(age, dtype=np.float32)
+        self.weight = np.asarray(weight, dtype=np.float32)
+        self.height = np.asarray(height, dtype=np.float32)
+        self.activity_levels = np.asarray(activity_levels, dtype=np.float32)
+        self.activity_offsets = np.asarray(activity_offsets, dtype=np.int64)
+
+        if len(self.activity_offsets) != len(self.arrival) + 1:
+            raise ValueError('activity_offsets must have one more entry than swimmers')
+
+    def __len__(self):
+        return len(self.arrival)
+
+    @property
+    def number_of_activity_levels(self):
+        """
+        :return: number of activity levels (time steps of stay) of each swimmer
+        """
+        return np.diff(self.activity_offsets)
+
+    def get_activity_levels(self, n):
+        """
+        :param n: index of the swimmer
+        :return: activity levels of swimmer n
+        """
+        return self.activity_levels[self.activity_offsets[n]:self.activity_offsets[n + 1]]
+
+    @classmethod
+    def from_swimmers(cls, arrival, leave, gender, age, weight, height, als):
+        """
+        This function builds an occupancy table from per-swimmer arrays, with activity levels as a list of arrays
+        :param arrival: arrival date-times of swimmers in seconds since the epoch
+        :param leave: leave date-times of swimmers in seconds since the epoch
+        :param gender: gender of swimmers as 'male'/'female' strings or GENDER_MALE/GENDER_FEMALE
+        :param age: age of swimmers
+        :param weight: weight of swimmers (kg)
+        :param height: height of swimmers (cm)
+        :param als: list holding the activity levels of each swimmer
+        :return: occupancy table
+        """
+        gender = np.asarray(gender)
+        if gender.dtype.kind in 'US':
+            gender = np.where(gender == 'male', GENDER_MALE, GENDER_FEMALE)
+
+        activity_offsets = np.zeros((len(als) + 1,), dtype=np.int64)
+        activity_offsets[1:] = np.cumsum([len(al) for al in als])
+        activity_levels = np.concatenate(als) if len(als) > 0 else np.zeros((0,))
+
+        return cls(arrival, leave, gender, age, weight, height, activity_levels, activity_offsets)
+
+    @classmethod
+    def from_occupancy_data(cls, occupancy_data):
+        """
+        This function converts occupancy data from the list of dicts format to an occupancy table. Date-times may be
+        datetime objects or ISO strings, as loaded back from json files
+        :param occupancy_data: occupancy data as a list of dicts
+        :return: occupancy table
+        """
+        return cls.from_swimmers(TimeGrid.datetime_to_epoch_seconds([oc_d['DT-Arrival'] for oc_d in occupancy_data]),
+                                 TimeGrid.datetime_to_epoch_seconds([oc_d['DT-Leave'] for oc_d in occupancy_data]),
+                                 [oc_d['Gender'] for oc_d in occupancy_data],
+                                 [oc_d['Age'] for oc_d in occupancy_data],
+                                 [oc_d['Weight'] for oc_d in occupancy_data],
+                                 [oc_d['Height'] for oc_d in occupancy_data],
+                                 [np.asarray(oc_d['Act-Levels'], dtype=np.float32) for oc_d in occupancy_data])
+
+    @classmethod
+    def from_any(cls, occupancy_data):
+        """
+        This function lets models accept occupancy data either as an occupancy table or as a list of dicts
+        :param occupancy_data: occupancy table or occupancy data as a list of dicts
+        :return: occupancy table
+        """
+        if isinstance(occupancy_data, cls):
+            return occupancy_data
+        return cls.from_occupancy_data(occupancy_data)
+
+    def to_occupancy_data(self):
+        """
+        This function converts the occupancy table to the list of dicts format
+        :return: occupancy data as a list of dicts
+        """
+        datetime_arrivals = TimeGrid.epoch_seconds_to_datetimes(self.arrival)
+        datetime_leaves = TimeGrid.epoch_seconds_to_datetimes(self.leave)
+        activity_levels = self.activity_levels.tolist()
+
+        occupancy_data = []
+        for n in range(len(self)):
+            occupancy_data.append({'DT-Arrival': datetime_arrivals[n],
+                                   'Gender': 'male' if self.gender[n] == GENDER_MALE else 'female',
+                                   'Age': int(self.age[n]), 'Weight': float(self.weight[n]),
+                                   'Height': float(self.height[n]), 'DT-Leave': datetime_leaves[n],
+                                   'Act-Levels': activity_levels[self.activity_offsets[n]:self.activity_offsets[n + 1]]})
+        return occupancy_data
+
+    def save(self, directory, header=None):
+        """
+        This function stores the occupancy table as a directory of .npy files, one per column, with a small json
+        header, so that it can be loaded back without parsing and memory-mapped
+        :param directory: directory of the occupancy table, created if it does not exist
+        :param header: dict of json serializable information of the run, such as start_date_time, end_date_time,
+        time_step_seconds, seed, and the hash of the occupancy profile (default: None)
+        """
+        os.makedirs(directory, exist_ok=True)
+        for column in OCCUPANCY_TABLE_COLUMNS:
+            np.save(os.path.join(directory, column + '.npy'), getattr(self, column))
+
+        with open(os.path.join(directory, OCCUPANCY_TABLE_HEADER_FILE_NAME), 'w') as f:
+            json.dump({'number_of_swimmers': len(self), 'columns': OCCUPANCY_TABLE_COLUMNS,
+                       'header': header if header is not None else {}}, f, sort_keys=True, indent=1)
+
+    @staticmethod
+    def load_header(directory):
+        """
+        :param directory: directory of an occupancy table, as written by save
+        :return: header of the occupancy table
+        """
+        with open(os.path.join(directory, OCCUPANCY_TABLE_HEADER_FILE_NAME), 'r') as f:
+            return json.load(f)['header']
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        This function loads an occupancy table written by save. Columns are memory-mapped by default, so that loading
+        takes no time and only the parts of the columns actually used are read
+        :param directory: directory of the occupancy table
+        :param mmap_mode: memory-map mode of the columns, as in np.load (default: 'r', read-only; None: read in memory)
+        :return: occupancy table
+        """
+        columns = {column: np.load(os.path.join(directory, column + '.npy'), mmap_mode=mmap_mode)
+                   for column in OCCUPANCY_TABLE_COLUMNS}
+        return cls(**columns)
+
+    @classmethod
+    def load_or_convert_json(cls, directory, json_file_path, header=None):
+        """
+        This function loads an occupancy table, converting it once from an occupancy json file (list of dicts) of
+        earlier runs if the table was not written yet
+        :param directory: directory of the occupancy table
+        :param json_file_path: path of the occupancy json file
+        :param header: header stored with the converted table (default: None)
+        :return: occupancy table
+        """
+        if not os.path.exists(os.path.join(directory, OCCUPANCY_TABLE_HEADER_FILE_NAME)):
+            with open(json_file_path, 'r') as f:
+                cls.from_occupancy_data(json.load(f)).save(directory, header)
+        return cls.load(directory)
+
+    def take(self, indices):
+        """
+        This function selects swimmers of the table
+        :param indices: indices (or boolean mask) of the swimmers to keep
+        :return: occupancy table of the selected swimmers
+        """
+        indices = np.arange(len(self))[indices]
+        starts = self.activity_offsets[indices]
+        counts = self.activity_offsets[indices + 1] - starts
+
+        activity_offsets = np.zeros((len(indices) + 1,), dtype=np.int64)
+        activity_offsets[1:] = np.cumsum(counts)
+        # Position of every kept activity level in the flat buffer
+        positions = np.repeat(starts - activity_offsets[:-1], counts) + np.arange(activity_offsets[-1])
+
+        return OccupancyTable(self.arrival[indices], self.leave[indices], self.gender[indices], self.age[indices],
+                              self.weight[indices], self.height[indices], self.activity_levels[positions],
+                              activity_offsets)
+
+    @classmethod
+    def concatenate(cls, tables):
+        """
+        This function joins occupancy tables, e.g. swimmers still in the swimming pool from a previous chunk of a
+        simulation and the swimmers arriving during the next chunk
+        :param tables: list of occupancy tables
+        :return: occupancy table holding the swimmers of all tables, in order
+        """
+        activity_offsets = [np.zeros((1,), dtype=np.int64)]
+        total_activity_levels = 0
+        for table in tables:
+            activity_offsets.append(table.activity_offsets[1:] - table.activity_offsets[0] + total_activity_levels)
+            total_activity_levels += table.activity_offsets[-1] - table.activity_offsets[0]
+
+        return cls(*[np.concatenate([getattr(table, column) for table in tables]) for column in
+                     ['arrival', 'leave', 'gender', 'age', 'weight', 'height']],
+                   np.concatenate([table.activity_levels[table.activity_offsets[0]:table.activity_offsets[-1]]
+                                   for table in tables]),
+                   np.concatenate(activity_offsets))
+
+    def slice_time_range(self, start_date_time, end_date_time, present=False):
+        """
+        This function selects the swimmers arriving between two date-times, or present in the swimming pool at some
+        point between them
+        :param start_date_time: start date-time (datetime or seconds since the epoch), inclusive
+        :param end_date_time: end date-time (datetime or seconds since the epoch), exclusive
+        :param present: select swimmers whose stay overlaps the range instead of swimmers arriving in it
+        :return: occupancy table of the selected swimmers
+        """
+        epoch_start = TimeGrid.datetime_to_epoch_seconds(start_date_time)
+        epoch_end = TimeGrid.datetime_to_epoch_seconds(end_date_time)
+        if present:
+            return self.take((self.arrival < epoch_end) & (self.leave > epoch_start))
+        return self.take((self.arrival >= epoch_start) & (self.arrival < epoch_end))
@@ -0,0 +1,266 @@
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import TimeGrid
+import ModelWaterManagement
+import ModelChemicalParameters
+import CostFunction
+
+# Inputs of the sweep as seen by a worker process, set up once per process by attach_shared_inputs
+worker_inputs = {}
+
+
+class ParameterSweep:
+    def __init__(self, datetime_stamps, activity_class_counts, body_fluid_release, water_evaporation, bather_load,
+                 swimming_pool_water_temperature_celsius, swimming_pool_volume_of_water,
+                 min_swimming_pool_volume_of_water, max_swimming_pool_volume_of_water, initial_chemical_parameters,
+                 tcm_threshold, lambda_water_quality, time_step_seconds):
+        """
+        This class evaluates the cost function for many (gamma_L, gamma_M, gamma_H) triples on a pool of processes.
+        The year-long inputs, which are the same for every triple, are copied once into shared memory, and worker
+        processes read them from there instead of receiving them with every task
+        :param datetime_stamps: datetime stamps of the simulation, as a time grid or a list of datetimes
+        :param activity_class_counts: counts of low, medium, and high activity swimmers per date-time stamp, as given by
+        ModelWaterManagement.get_activity_class_counts
+        :param body_fluid_release: body fluid release per datetime stamp
+        :param water_evaporation: water evaporation per datetime stamp
+        :param bather_load: bather load per datetime stamp
+        :param swimming_pool_water_temperature_celsius: operational water temperature of the swimming pool
+        :param swimming_pool_volume_of_water: volume of water in the swimming pool (liter)
+        :param min_swimming_pool_volume_of_water: minimum volume of water in the swimming pool (liter)
+        :param max_swimming_pool_volume_of_water: maximum volume of water in the swimming pool (liter)
+        :param initial_chemical_parameters: initial chemical parameters of the swimming pool at the start datetime
+        :param tcm_threshold: TCM concentration threshold
+        :param lambda_water_quality: weight of the water quality cost
+        :param time_step_seconds: period of time-stamps in seconds
+        """
+        self.arrays = {'activity_class_counts': np.asarray(activity_class_counts, dtype=float),
+                       'body_fluid_release': np.asarray(body_fluid_release, dtype=float),
+                       'water_evaporation': np.asarray(water_evaporation, dtype=float),
+                       'bather_load': np.asarray(bather_load, dtype=float)}
+
+        self.settings = {'swimming_pool_water_temperature_celsius': swimming_pool_water_temperature_celsius,
+                         'swimming_pool_volume_of_water': swimming_pool_volume_of_water,
+                         'min_swimming_pool_volume_of_water': min_swimming_pool_volume_of_water,
+                         'max_swimming_pool_volume_of_water': max_swimming_pool_volume_of_water,
+                         'initial_chemical_parameters': initial_chemical_parameters,
+                         'tcm_threshold': tcm_threshold,
+                         'lambda_water_quality': lambda_water_quality,
+                         'time_step_seconds': time_step_seconds,
+                         'time_grid': TimeGrid.TimeGrid.from_any(datetime_stamps)}
+
+        self.shared_memories = []
+        self.descriptors = {}
+
+        self.pruned_step_evaluations = 0
+        self.total_step_evaluations = 0
+
+    def __enter__(self):
+        self.share_inputs()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release_inputs()
+
+    def share_inputs(self):
+        """
+        This function copies the inputs of the sweep into shared memory blocks
+        """
+        for key, array in self.arrays.items():
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            self.shared_memories.append(shm)
+            self.descriptors[key] = (shm.name, array.shape, array.dtype.str)
+
+    def release_inputs(self):
+        """
+        This function frees the shared memory blocks of the inputs
+        """
+        for shm in self.shared_memories:
+            shm.close()
+            shm.unlink()
+        self.shared_memories = []
+        self.descriptors = {}
+
+    def evaluate(self, gammas, number_of_processes=None, chunk_size=16):
+        """
+        This function evaluates the cost function of gamma triples on a pool of processes. Triples are sent to workers
+        in chunks, each chunk being simulated at once by the batched models, and results are yielded in the order of
+        the triples as soon as they are available
+        :param gammas: list or array of shape [P x 3] of (gamma_L, gamma_M, gamma_H) triples
+        :param number_of_processes: number of worker processes (default: number of CPUs)
+        :param chunk_size: number of triples per task
+        :return: generator of (gamma triple, cost, cost of water use, cost of water quality) tuples
+        """
+        if not self.shared_memories:
+            raise RuntimeError('inputs are not shared, use the sweep as a context manager or call share_inputs')
+
+        gammas = np.asarray(gammas, dtype=float).reshape((-1, 3))
+        chunks = [gammas[n:n + chunk_size] for n in range(0, len(gammas), chunk_size)]
+
+        with multiprocessing.Pool(number_of_processes or os.cpu_count(), initializer=attach_shared_inputs,
+                                  initargs=(self.descriptors, self.settings)) as pool:
+            for chunk, (costs, costs_water_use, costs_water_quality) in zip(chunks, pool.imap(evaluate_chunk, chunks)):
+                for gamma, cost, cost_water_use, cost_water_quality in zip(chunk, costs, costs_water_use,
+                                                                           costs_water_quality):
+                    yield tuple(gamma.tolist()), float(cost), float(cost_water_use), float(cost_water_quality)
+
+    def evaluate_with_pruning(self, gammas, number_of_processes=None, chunk_size=16, best_cost=np.inf):
+        """
+        This function evaluates the cost function of gamma triples like evaluate, but aborts triples that cannot beat
+        the best cost found so far. Both terms of the cost only grow over time, so the cost of water use over the whole
+        simulation (known from the water flows) plus the cost of water quality up to some month is a lower bound of the
+        final cost. Chemical contents are integrated month by month, and triples whose lower bound already exceeds the
+        best complete cost, shared between worker processes, are not integrated any further. The number of pruned and
+        total (triple, datetime stamp) evaluations of the chemical model is kept in self.pruned_step_evaluations and
+        self.total_step_evaluations
+        :param gammas: list or array of shape [P x 3] of (gamma_L, gamma_M, gamma_H) triples
+        :param number_of_processes: number of worker processes (default: number of CPUs)
+        :param chunk_size: number of triples per task
+        :param best_cost: cost to beat, e.g. from a previous sweep (default: infinity)
+        :return: generator of (gamma triple, cost, cost of water use, cost of water quality, pruned) tuples, where cost
+        and cost of water quality of pruned triples are the lower bounds at which they were aborted. Which triples are
+        pruned depends on the order in which worker processes finish, but every pruned triple costs more than some
+        complete triple, so the best complete triple does not
+        """
+        if not self.shared_memories:
+            raise RuntimeError('inputs are not shared, use the sweep as a context manager or call share_inputs')
+
+        gammas = np.asarray(gammas, dtype=float).reshape((-1, 3))
+        chunks = [gammas[n:n + chunk_size] for n in range(0, len(gammas), chunk_size)]
+
+        self.pruned_step_evaluations = 0
+        self.total_step_evaluations = len(gammas) * len(self.settings['time_grid'])
+
+        shared_best_cost = multiprocessing.Value('d', best_cost)
+
+        with multiprocessing.Pool(number_of_processes or os.cpu_count(), initializer=attach_shared_inputs,
+                                  initargs=(self.descriptors, self.settings, shared_best_cost)) as pool:
+            for chunk, (costs, costs_water_use, costs_water_quality, pruned, pruned_step_evaluations) in \
+                    zip(chunks, pool.imap(evaluate_chunk_with_pruning, chunks)):
+                self.pruned_step_evaluations += pruned_step_evaluations
+                for gamma, cost, cost_water_use, cost_water_quality, is_pruned in zip(chunk, costs, costs_water_use,
+                                                                                      costs_water_quality, pruned):
+                    yield tuple(gamma.tolist()), float(cost), float(cost_water_use), float(cost_water_quality), \
+                        bool(is_pruned)
+
+
+def attach_shared_inputs(descriptors, settings, shared_best_cost=None):
+    """
+    This function initializes a worker process: it maps the shared inputs of the sweep and builds the models once
+    :param descriptors: name, shape, and dtype of the shared memory block of each input
+    :param settings: scalar settings of the sweep
+    :param shared_best_cost: best complete cost shared between worker processes, when pruning
+    """
+    worker_inputs.clear()
+    worker_inputs['shared_memories'] = []
+    for key, (name, shape, dtype) in descriptors.items():
+        shm = shared_memory.SharedMemory(name=name)
+        worker_inputs['shared_memories'].append(shm)
+        worker_inputs[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+    worker_inputs['settings'] = settings
+    worker_inputs['datetime_stamps'] = settings['time_grid']
+    worker_inputs['unoccupied_steps'] = worker_inputs['bather_load'] == 0
+    worker_inputs['shared_best_cost'] = shared_best_cost
+
+    # Chemical contents are integrated month by month when pruning, a chunk needs at least two datetime stamps
+    time_grid = settings['time_grid']
+    months = time_grid.year * 12 + time_grid.month
+    month_starts = [int(n) for n in np.flatnonzero(np.diff(months)) + 1 if len(months) - n > 1]
+    worker_inputs['month_bounds'] = list(zip([0] + month_starts, month_starts + [len(months)]))
+    worker_inputs['model_wm'] = ModelWaterManagement.ModelWaterManagement(
+        settings['min_swimming_pool_volume_of_water'], settings['max_swimming_pool_volume_of_water'])
+    worker_inputs['model_chemicals'] = ModelChemicalParameters.ModelChemicalParameters()
+
+
+def evaluate_chunk(gammas):
+    """
+    This function evaluates the cost function of a chunk of gamma triples in a worker process
+    :param gammas: array of shape [P x 3] of (gamma_L, gamma_M, gamma_H) triples
+    :return: costs, costs of water use, and costs of water quality of the triples
+    """
+    settings = worker_inputs['settings']
+    datetime_stamps = worker_inputs['datetime_stamps']
+
+    # Generate water management input and output flows of water
+    wf_ins, wf_outs = worker_inputs['model_wm'].generate_occupancy_based_rate_water_flows(
+        datetime_stamps, worker_inputs['activity_class_counts'], worker_inputs['water_evaporation'],
+        settings['swimming_pool_volume_of_water'], gammas)
+
+    # Model chemical parameters and content, only while there are swimmers
+    chemical_states = worker_inputs['model_chemicals'].process_chemical_parameters_batch(
+        settings['initial_chemical_parameters'], datetime_stamps, worker_inputs['body_fluid_release'],
+        settings['swimming_pool_water_temperature_celsius'], settings['swimming_pool_volume_of_water'],
+        worker_inputs['water_evaporation'], wf_ins, wf_outs, fast_forward_steps=worker_inputs['unoccupied_steps'])
+
+    # Calculate cost function terms
+    return CostFunction.cost_function_batch(wf_ins, worker_inputs['bather_load'], chemical_states['TCM'],
+                                            settings['tcm_threshold'], settings['lambda_water_quality'],
+                                            settings['time_step_seconds'])
+
+
+def evaluate_chunk_with_pruning(gammas):
+    """
+    This function evaluates the cost function of a chunk of gamma triples in a worker process, month by month, and
+    stops integrating triples whose cost lower bound exceeds the best complete cost
+    :param gammas: array of shape [P x 3] of (gamma_L, gamma_M, gamma_H) triples
+    :return: costs, costs of water use, costs of water quality, whether each triple was pruned, and the number of
+    pruned (triple, datetime stamp) evaluations
+    """
+    settings = worker_inputs['settings']
+    datetime_stamps = worker_inputs['datetime_stamps']
+    shared_best_cost = worker_inputs['shared_best_cost']
+    model_chemicals = worker_inputs['model_chemicals']
+
+    # Generate water management input and output flows of water
+    wf_ins, wf_outs = worker_inputs['model_wm'].generate_occupancy_based_rate_water_flows(
+        datetime_stamps, worker_inputs['activity_class_counts'], worker_inputs['water_evaporation'],
+        settings['swimming_pool_volume_of_water'], gammas)
+
+    # The whole cost of water use is known from the water flows
+    costs_water_use = CostFunction.cost_water_use_batch(wf_ins)
+    costs_water_quality = np.zeros((len(gammas),))
+    time_adj = 60 * 60 / settings['time_step_seconds']
+
+    active = np.flatnonzero(costs_water_use <= shared_best_cost.value)
+    pruned_step_evaluations = (len(gammas) - len(active)) * len(datetime_stamps)
+
+    chemical_state = None
+    for start, stop in worker_inputs['month_bounds']:
+        if len(active) == 0:
+            break
+
+        chemical_states = model_chemicals.process_chemical_parameters_batch(
+            settings['initial_chemical_parameters'], datetime_stamps[start:stop],
+            worker_inputs['body_fluid_release'][start:stop], settings['swimming_pool_water_temperature_celsius'],
+            settings['swimming_pool_volume_of_water'], worker_inputs['water_evaporation'][start:stop],
+            wf_ins[active, start:stop], wf_outs[active, start:stop], initial_chemical_state=chemical_state,
+            fast_forward_steps=worker_inputs['unoccupied_steps'][start:stop])
+
+        costs_water_quality[active] += CostFunction.cost_water_quality_batch(
+            worker_inputs['bather_load'][start:stop], chemical_states['TCM'], settings['tcm_threshold'])
+
+        if stop == len(datetime_stamps):
+            break
+
+        # Abort triples that cannot beat the best complete cost any more
+        lower_bounds = costs_water_use[active] + settings['lambda_water_quality'] * (costs_water_quality[active] /
+                                                                                     time_adj)
+        keep = lower_bounds <= shared_best_cost.value
+        pruned_step_evaluations += int(np.sum(~keep)) * (len(datetime_stamps) - stop)
+
+        chemical_state = {key: value[keep] for key, value in
+                          model_chemicals.get_final_chemical_state(chemical_states).items()}
+        active = active[keep]
+
+    costs = costs_water_use + settings['lambda_water_quality'] * (costs_water_quality / time_adj)
+    pruned = np.ones((len(gammas),), dtype=bool)
+    pruned[active] = False
+
+    if len(active) > 0:
+        with shared_best_cost.get_lock():
+            shared_best_cost.value = min(shared_best_cost.value, float(np.min(costs[active])))
+
+    return costs, costs_water_use, costs_water_quality, pruned, pruned_step_evaluations
@@ -0,0 +1,135 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+
+class StageCache:
+    def __init__(self, cache_dir='Data_main/StageCache', max_size_bytes=2 * 1024 ** 3):
+        """
+        This class caches the outputs of the stages of the simulation pipeline (occupancy, body fluid release, bather
+        load, water evaporation, ...). Outputs are stored as .npz files named after the hash of everything the stage
+        depends on: parameter-file contents, dates, time step, temperatures, seed, and the hashes of the outputs of
+        upstream stages, so that a stage is only computed again when one of its inputs changed. The least recently used
+        outputs are evicted when the cache grows beyond its maximum size
+        :param cache_dir: directory of the cached outputs
+        :param max_size_bytes: maximum total size of the cached outputs in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_file_hash(file_path):
+        """
+        :param file_path: path of a file the stage depends on, such as a json parameter file
+        :return: hash of the contents of the file
+        """
+        with open(file_path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    @staticmethod
+    def get_key(stage_name, inputs):
+        """
+        :param stage_name: name of the stage
+        :param inputs: dict of the inputs of the stage, json serializable
+        :return: hash identifying the outputs of the stage for these inputs
+        """
+        return hashlib.sha256(json.dumps({'stage': stage_name, 'inputs': inputs}, sort_keys=True,
+                                         default=str).encode('utf8')).hexdigest()
+
+    @staticmethod
+    def get_outputs_hash(outputs):
+        """
+        :param outputs: dict of arrays output by a stage
+        :return: hash of the contents of the outputs, given to downstream stages as an input
+        """
+        sha = hashlib.sha256()
+        for name in sorted(outputs):
+            array = np.ascontiguousarray(outputs[name])
+            sha.update(name.encode('utf8'))
+            sha.update(str(array.dtype).encode('utf8'))
+            sha.update(str(array.shape).encode('utf8'))
+            sha.update(array.tobytes())
+        return sha.hexdigest()
+
+    def get_file_path(self, stage_name, key):
+        return os.path.join(self.cache_dir, '{}-{}.npz'.format(stage_name, key))
+
+    def load(self, stage_name, key):
+        """
+        :param stage_name: name of the stage
+        :param key: key of the inputs of the stage, as given by get_key
+        :return: dict of the cached arrays and hash of the outputs, or (None, None) if they are not cached
+        """
+        file_path = self.get_file_path(stage_name, key)
+        try:
+            with np.load(file_path, allow_pickle=False) as npz:
+                outputs = {name: npz[name] for name in npz.files if name != '__outputs_hash__'}
+                outputs_hash = str(npz['__outputs_hash__'])
+        except (OSError, KeyError, ValueError):
+            return None, None
+
+        # The modification time of a cached file is its last use
+        os.utime(file_path)
+        return outputs, outputs_hash
+
+    def save(self, stage_name, key, outputs):
+        """
+        This function stores the outputs of a stage and evicts the least recently used outputs if the cache is full
+        :param stage_name: name of the stage
+        :param key: key of the inputs of the stage, as given by get_key
+        :param outputs: dict of arrays output by the stage
+        :return: hash of the outputs
+        """
+        outputs = {name: np.asarray(array) for name, array in outputs.items()}
+        outputs_hash = self.get_outputs_hash(outputs)
+
+        file_path = self.get_file_path(stage_name, key)
+        temporary_file_path = file_path + '.tmp.npz'
+        np.savez(temporary_file_path, __outputs_hash__=np.array(outputs_hash), **outputs)
+        os.replace(temporary_file_path, file_path)
+
+        self.evict(keep=file_path)
+        return outputs_hash
+
+    def evict(self, keep=None):
+        """
+        This function removes the least recently used outputs until the cache fits in its maximum size
+        :param keep: path of a file never to remove, such as the one just written
+        """
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith('.npz') or file_name.endswith('.tmp.npz'):
+                continue
+            file_path = os.path.join(self.cache_dir, file_name)
+            stat = os.stat(file_path)
+            entries.append((stat.st_mtime, stat.st_size, file_path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, file_path in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            if file_path == keep:
+                continue
+            os.remove(file_path)
+            total_size -= size
+
+    def run(self, stage_name, inputs, compute):
+        """
+        This function returns the outputs of a stage, from the cache if the stage already ran with the same inputs
+        :param stage_name: name of the stage
+        :param inputs: dict of the inputs of the stage, json serializable, including hashes of upstream outputs
+        :param compute: function without arguments computing the outputs of the stage as a dict of arrays
+        :return: dict of the outputs of the stage and hash of the outputs
+        """
+        key = self.get_key(stage_name, inputs)
+        outputs, outputs_hash = self.load(stage_name, key)
+        if outputs is not None:
+            print('{} loaded from cache!'.format(stage_name))
+            return outputs, outputs_hash
+
+        print('Computing {}'.format(stage_name))
+        outputs = {name: np.asarray(array) for name, array in compute().items()}
+        outputs_hash = self.save(stage_name, key, outputs)
+        return outputs, outputs_hash
@@ -0,0 +1,128 @@
+import numpy as np
+import utils
+import TimeGrid
+import OccupancyTable
+import OccupancyGenerator
+import ModelBodyFluidRelease
+import ModelWaterEvaporation
+import ModelWaterManagement
+import ModelChemicalParameters
+
+
+class StreamingSimulation:
+    def __init__(self, start_date_time, end_date_time, time_step_seconds, swimming_pool_water_temperature_celsius,
+                 natatorium_room_temperature_celsius, natatorium_room_relative_humidity, swimming_pool_volume_of_water,
+                 min_swimming_pool_volume_of_water, max_swimming_pool_volume_of_water, swimming_pool_surface_area,
+                 initial_chemical_parameters, gammas, chunk_days=7,
+                 json_file_path='SwimmingPoolOccupancyParameters.json', seed=None):
+        """
+        This class runs the whole simulation pipeline (occupancy, body fluid release, bather load, water evaporation,
+        occupancy based water management, and chemical parameters) chunk after chunk of chunk_days days, so that
+        memory use depends on the chunk size and not on the length of the simulation. What a chunk needs from the
+        previous ones is carried over: the swimmers still in the swimming pool, the volume of water seen by water
+        management, the last water flows, and the chemical contents (TOC and DBPs) and volume of water
+        :param start_date_time: start date-time of the simulation (format: YYYY/MM/DD hh:mm:ss)
+        :param end_date_time: end date-time of the simulation (format: YYYY/MM/DD hh:mm:ss)
+        :param time_step_seconds: period of time-stamps in seconds
+        :param swimming_pool_water_temperature_celsius: operational water temperature of the swimming pool
+        :param natatorium_room_temperature_celsius: room temperature of the natatorium
+        :param natatorium_room_relative_humidity: relative humidity of the natatorium
+        :param swimming_pool_volume_of_water: volume of water in the swimming pool at the start (liter)
+        :param min_swimming_pool_volume_of_water: minimum volume of water in the swimming pool (liter)
+        :param max_swimming_pool_volume_of_water: maximum volume of water in the swimming pool (liter)
+        :param swimming_pool_surface_area: surface area of the swimming pool (m^2)
+        :param initial_chemical_parameters: initial chemical parameters of the swimming pool at the start datetime
+        :param gammas: (gamma_L, gamma_M, gamma_H) of occupancy based water management
+        :param chunk_days: number of days simulated at once
+        :param json_file_path: path of the occupancy parameters json file
+        :param seed: master seed of the random streams of swimmers, one per day, so that the occupancy is the same as
+        in a simulation run at once (default: None, unpredictable)
+        """
+        self.time_grid = TimeGrid.TimeGrid.from_date_time_strings(start_date_time, end_date_time, time_step_seconds)
+        self.swimming_pool_water_temperature_celsius = swimming_pool_water_temperature_celsius
+        self.natatorium_room_temperature_celsius = natatorium_room_temperature_celsius
+        self.natatorium_room_relative_humidity = natatorium_room_relative_humidity
+        self.swimming_pool_volume_of_water = swimming_pool_volume_of_water
+        self.swimming_pool_surface_area = swimming_pool_surface_area
+        self.initial_chemical_parameters = initial_chemical_parameters
+        self.chunk_days = chunk_days
+        self.entropy = OccupancyGenerator.OccupancyGenerator.get_entropy(seed)
+
+        self.occupancy_generator = OccupancyGenerator.OccupancyGenerator(json_file_path=json_file_path)
+        self.model_bfa_release = ModelBodyFluidRelease.ModelBodyFluidRelease()
+        self.model_water_evaporation = ModelWaterEvaporation.ModelWaterEvaporation()
+        self.model_wm = ModelWaterManagement.ModelWaterManagement(min_swimming_pool_volume_of_water,
+                                                                  max_swimming_pool_volume_of_water)
+        self.model_wm.set_parameters(*gammas)
+        self.model_chemicals = ModelChemicalParameters.ModelChemicalParameters()
+
+    def get_chunks(self):
+        """
+        This function splits the time grid in chunks starting at midnight every chunk_days days, so that daily
+        aggregates of a chunk are complete
+        :return: list of (start, stop) indices of the chunks in the time grid
+        """
+        first_day = self.time_grid.start_epoch_seconds // TimeGrid.SECONDS_PER_DAY
+        last_day = -(-self.time_grid.end_epoch_seconds // TimeGrid.SECONDS_PER_DAY)
+        boundaries = np.arange(first_day + self.chunk_days, last_day, self.chunk_days) * TimeGrid.SECONDS_PER_DAY
+
+        # First stamp at or after each boundary
+        indices = -(-(boundaries - self.time_grid.start_epoch_seconds) // self.time_grid.time_step_seconds)
+        indices = np.unique(np.concatenate([[0], indices[indices < len(self.time_grid)], [len(self.time_grid)]]))
+        return [(int(start), int(stop)) for start, stop in zip(indices[:-1], indices[1:])]
+
+    def run(self):
+        """
+        This function simulates chunk after chunk. Nothing is kept from a chunk once the next one is requested but
+        the carried over state, callers write each chunk to disk or reduce it as it comes
+        :return: generator of dicts of the results of each chunk: time_grid, occupancy (occupancy table of the swimmers
+        present during the chunk), body_fluid_release, bather_load, water_evaporation, water_in, water_out (flows
+        of each stamp of the chunk), and chemical_parameters (structured array of
+        ModelChemicalParameters.CHEMICAL_PARAMETERS_DTYPE)
+        """
+        carried_swimmers = OccupancyTable.OccupancyTable.from_swimmers([], [], [], [], [], [], [])
+        water_management_vow = self.swimming_pool_volume_of_water
+        last_water_in = 0
+        last_water_out = 0
+        chemical_state = None
+
+        for start, stop in self.get_chunks():
+            time_grid = self.time_grid[start:stop]
+
+            arrivals = self.occupancy_generator.generate(time_grid, self.entropy)
+            occupancy_table = OccupancyTable.OccupancyTable.concatenate([carried_swimmers, arrivals])
+
+            body_fluid_release = self.model_bfa_release.simulate_body_fluid_release(
+                time_grid, occupancy_table, self.swimming_pool_water_temperature_celsius)
+            bather_load = utils.get_bather_load_for_datetime_stamps(time_grid, occupancy_table,
+                                                                    time_grid.time_step_seconds)
+            water_evaporation = self.model_water_evaporation.process_water_evaporation(
+                time_grid, bather_load, self.swimming_pool_surface_area,
+                self.swimming_pool_water_temperature_celsius, self.natatorium_room_temperature_celsius,
+                self.natatorium_room_relative_humidity)
+
+            water_in, water_out = self.model_wm.generate_occupancy_based_rate_water_flow(
+                time_grid, occupancy_table, water_evaporation, water_management_vow)
+            number_of_flows = len(water_in) - 1
+            water_management_vow += sum(water_in[1:]) - sum(water_out[1:]) - sum(water_evaporation[:number_of_flows])
+
+            # Flows are laid out with a leading entry, which is the last flow of the previous chunk
+            water_in[0] = last_water_in
+            water_out[0] = last_water_out
+            last_water_in = water_in[-1]
+            last_water_out = water_out[-1]
+
+            chemical_parameters = self.model_chemicals.process_chemical_parameters(
+                self.initial_chemical_parameters, time_grid, body_fluid_release,
+                self.swimming_pool_water_temperature_celsius, self.swimming_pool_volume_of_water, water_evaporation,
+                water_in, water_out, initial_chemical_state=chemical_state)
+            chemical_state = {key: chemical_parameters[key][-1] for key in ['toc', 'TCM', 'DCAA', 'TCAA', 'DCAN',
+                                                                            'VoW']}
+
+            # Swimmers still in the swimming pool at the end of the chunk are part of the next one
+            carried_swimmers = occupancy_table.take(occupancy_table.leave > time_grid.end_epoch_seconds)
+
+            yield {'time_grid': time_grid, 'occupancy': occupancy_table, 'body_fluid_release': body_fluid_release,
+                   'bather_load': bather_load, 'water_evaporation': water_evaporation,
+                   'water_in': water_in[:len(time_grid)], 'water_out': water_out[:len(time_grid)],
+                   'chemical_parameters': chemical_parameters}
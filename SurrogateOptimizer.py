@@ -0,0 +1,220 @@
+import math
+import numpy as np
+
+
+class SurrogateOptimizer:
+    def __init__(self, objective, lower_bounds, upper_bounds, budget=100, number_of_initial_points=12, step=None,
+                 log_transform=True, number_of_candidates=4000, seed=None):
+        """
+        This class minimizes an expensive cost function of (gamma_L, gamma_M, gamma_H) over a box with the constraint
+        gamma_L < gamma_M < gamma_H, within a fixed budget of evaluations. A Gaussian process surrogate of the cost is
+        fitted to the evaluated points, and the next point is the feasible candidate with the highest expected
+        improvement over the best cost found so far
+        :param objective: function of a (gamma_L, gamma_M, gamma_H) triple returning its cost
+        :param lower_bounds: lower bounds of gamma_L, gamma_M, and gamma_H, inclusive
+        :param upper_bounds: upper bounds of gamma_L, gamma_M, and gamma_H, exclusive as in generate_set_of_parameters
+        :param budget: total number of evaluations of the objective
+        :param number_of_initial_points: number of random feasible points evaluated before the surrogate is used
+        :param step: grid step of the gammas, points are snapped to the grid and never evaluated twice (default: None,
+        continuous gammas)
+        :param log_transform: fit the surrogate to the logarithm of the cost, which spans orders of magnitude
+        :param number_of_candidates: number of feasible candidates on which the expected improvement is maximized
+        :param seed: seed of the random generator (default: None, unpredictable)
+        """
+        self.objective = objective
+        self.lower_bounds = np.asarray(lower_bounds, dtype=float)
+        self.upper_bounds = np.asarray(upper_bounds, dtype=float)
+        self.budget = budget
+        self.number_of_initial_points = min(number_of_initial_points, budget)
+        self.step = step
+        self.log_transform = log_transform
+        self.number_of_candidates = number_of_candidates
+        self.rng = np.random.default_rng(seed)
+
+        self.length_scales = [0.05, 0.1, 0.2, 0.3, 0.5, 0.8]
+        self.noise = 1e-6
+        self.max_noise = 1e-2
+        self.max_initial_sampling_rounds = 100
+
+        self.evaluated_points = []
+        self.evaluated_costs = []
+
+    def is_feasible(self, points):
+        """
+        :param points: array of shape [N x 3] of gamma triples
+        :return: boolean array telling which points are inside the bounds (upper bounds excluded) and satisfy
+        gamma_L < gamma_M < gamma_H
+        """
+        points = np.atleast_2d(points)
+        return np.all(points >= self.lower_bounds, axis=1) & np.all(points < self.upper_bounds, axis=1) & \
+            (points[:, 0] < points[:, 1]) & (points[:, 1] < points[:, 2])
+
+    def snap(self, points):
+        """
+        :param points: array of shape [N x 3] of gamma triples
+        :return: the points snapped to the grid of gammas, if there is one
+        """
+        if self.step is None:
+            return points
+        return self.lower_bounds + np.round((points - self.lower_bounds) / self.step) * self.step
+
+    def sample_feasible_points(self, number_of_points):
+        """
+        This function draws points uniformly in the box and keeps the feasible ones
+        :param number_of_points: number of points to draw
+        :return: array of shape [N x 3] of feasible gamma triples, N <= number_of_points
+        """
+        points = self.snap(self.rng.uniform(self.lower_bounds, self.upper_bounds, (number_of_points, 3)))
+        return points[self.is_feasible(points)]
+
+    def sample_candidates(self):
+        """
+        This function draws the candidates of the next evaluation: points of the whole box, and points around the best
+        points evaluated so far. Evaluated points are removed when gammas are on a grid
+        :return: array of shape [N x 3] of feasible gamma triples
+        """
+        global_candidates = self.sample_feasible_points(self.number_of_candidates)
+
+        order = np.argsort(self.evaluated_costs)[:5]
+        scales = 0.05 * (self.upper_bounds - self.lower_bounds)
+        local_candidates = np.concatenate([np.asarray(self.evaluated_points)[order]] * (self.number_of_candidates //
+                                                                                       (2 * len(order)) + 1))
+        local_candidates = self.snap(local_candidates + self.rng.normal(0.0, 1.0, local_candidates.shape) * scales)
+        local_candidates = local_candidates[self.is_feasible(local_candidates)]
+
+        candidates = np.concatenate([global_candidates, local_candidates])
+        if self.step is not None:
+            candidates = np.unique(candidates, axis=0)
+            evaluated = np.asarray(self.evaluated_points)
+            is_new = ~np.any(np.all(np.isclose(candidates[:, None, :], evaluated[None, :, :]), axis=2), axis=1)
+            candidates = candidates[is_new]
+        return candidates
+
+    def normalize(self, points):
+        """
+        :param points: array of shape [N x 3] of gamma triples
+        :return: the points scaled to the unit cube
+        """
+        return (np.atleast_2d(points) - self.lower_bounds) / (self.upper_bounds - self.lower_bounds)
+
+    def fit_surrogate(self):
+        """
+        This function fits the Gaussian process surrogate (squared exponential kernel) to the evaluated points. The
+        length scale is chosen among self.length_scales by maximum marginal likelihood. If the covariance is not
+        positive definite for any length scale, e.g. when evaluated points nearly coincide, the noise added to its
+        diagonal is raised tenfold and the fit is retried, up to self.max_noise
+        :return: dict of what predict needs: training points, length scale, Cholesky factor, weights, and the scaling
+        of the costs
+        """
+        x = self.normalize(self.evaluated_points)
+        y = np.asarray(self.evaluated_costs, dtype=float)
+        if self.log_transform:
+            y = np.log(np.maximum(y, 1e-12))
+
+        y_mean = np.mean(y)
+        y_std = np.std(y) if np.std(y) > 0 else 1.0
+        y = (y - y_mean) / y_std
+
+        squared_distances = np.sum((x[:, None, :] - x[None, :, :]) ** 2, axis=2)
+
+        best = None
+        noise = self.noise
+        while best is None:
+            for length_scale in self.length_scales:
+                covariance = np.exp(-0.5 * squared_distances / length_scale ** 2) + noise * np.eye(len(x))
+                try:
+                    cholesky = np.linalg.cholesky(covariance)
+                except np.linalg.LinAlgError:
+                    continue
+                weights = np.linalg.solve(cholesky.T, np.linalg.solve(cholesky, y))
+                log_likelihood = -0.5 * y @ weights - np.sum(np.log(np.diag(cholesky)))
+                if best is None or log_likelihood > best[0]:
+                    best = (log_likelihood, length_scale, cholesky, weights)
+
+            if best is None:
+                if noise >= self.max_noise:
+                    raise np.linalg.LinAlgError('the covariance of the surrogate is not positive definite for any '
+                                                'length scale, even with a noise of {}'.format(noise))
+                noise *= 10
+
+        _, length_scale, cholesky, weights = best
+        return {'x': x, 'length_scale': length_scale, 'cholesky': cholesky, 'weights': weights, 'y_mean': y_mean,
+                'y_std': y_std}
+
+    @staticmethod
+    def predict(surrogate, x):
+        """
+        :param surrogate: surrogate as returned by fit_surrogate
+        :param x: array of shape [N x 3] of normalized points
+        :return: mean and standard deviation of the standardized surrogate at the points
+        """
+        squared_distances = np.sum((x[:, None, :] - surrogate['x'][None, :, :]) ** 2, axis=2)
+        cross_covariance = np.exp(-0.5 * squared_distances / surrogate['length_scale'] ** 2)
+
+        mean = cross_covariance @ surrogate['weights']
+        v = np.linalg.solve(surrogate['cholesky'], cross_covariance.T)
+        variance = np.maximum(1.0 - np.sum(v ** 2, axis=0), 1e-12)
+        return mean, np.sqrt(variance)
+
+    @staticmethod
+    def expected_improvement(mean, std, best, xi=0.01):
+        """
+        :param mean: predicted means (to be minimized)
+        :param std: predicted standard deviations
+        :param best: best value found so far
+        :param xi: exploration margin
+        :return: expected improvement over best
+        """
+        z = (best - mean - xi) / std
+        cdf = 0.5 * (1.0 + np.vectorize(math.erf)(z / math.sqrt(2.0)))
+        pdf = np.exp(-0.5 * z ** 2) / math.sqrt(2.0 * math.pi)
+        return (best - mean - xi) * cdf + std * pdf
+
+    def evaluate(self, point):
+        """
+        This function evaluates the objective at a point and records the result
+        :param point: gamma triple
+        :return: cost of the point
+        """
+        cost = float(self.objective(*[float(gamma) for gamma in point]))
+        self.evaluated_points.append(np.asarray(point, dtype=float))
+        self.evaluated_costs.append(cost)
+        print('evaluation {}/{}: gammas={}, cost={}'.format(len(self.evaluated_costs), self.budget,
+                                                             [float(gamma) for gamma in point], cost))
+        return cost
+
+    def optimize(self):
+        """
+        This function runs the optimization until the budget of evaluations is spent. Initial points are drawn in at
+        most self.max_initial_sampling_rounds rounds, so that fewer initial points are evaluated when the grid of
+        feasible gammas is smaller than number_of_initial_points
+        :return: best gamma triple and its cost
+        """
+        initial_points = np.zeros((0, 3))
+        for _ in range(self.max_initial_sampling_rounds):
+            if len(initial_points) >= self.number_of_initial_points:
+                break
+            new_points = self.sample_feasible_points(self.number_of_initial_points)
+            initial_points = np.concatenate([initial_points, new_points])
+            if self.step is not None:
+                initial_points = np.unique(initial_points, axis=0)
+
+        if len(initial_points) == 0:
+            raise ValueError('no feasible (gamma_L, gamma_M, gamma_H) triple was found within the bounds')
+        for point in self.rng.permutation(initial_points)[:self.number_of_initial_points]:
+            self.evaluate(point)
+
+        while len(self.evaluated_costs) < self.budget:
+            candidates = self.sample_candidates()
+            if len(candidates) == 0:
+                break
+
+            surrogate = self.fit_surrogate()
+            mean, std = self.predict(surrogate, self.normalize(candidates))
+            best = np.min((np.log(np.maximum(self.evaluated_costs, 1e-12)) if self.log_transform
+                           else np.asarray(self.evaluated_costs)) - surrogate['y_mean']) / surrogate['y_std']
+
+            self.evaluate(candidates[np.argmax(self.expected_improvement(mean, std, best))])
+
+        n = int(np.argmin(self.evaluated_costs))
+        return tuple(float(gamma) for gamma in self.evaluated_points[n]), self.evaluated_costs[n]
@@ -0,0 +1,187 @@
+import json
+import hashlib
+import sqlite3
+
+RESULT_COLUMNS = ['config_hash', 'gamma_l', 'gamma_m', 'gamma_h', 'lambda_water_quality', 'water_temperature',
+                  'occupancy_profile', 'seed', 'cost', 'water_use', 'health_cost', 'pruned', 'setup_hash',
+                  'time_step_seconds']
+
+# Columns added after the first version of the results table, with their SQLite types
+ADDED_RESULT_COLUMNS = {'setup_hash': 'TEXT', 'time_step_seconds': 'REAL'}
+
+
+class SweepResultStore:
+    def __init__(self, db_file_path='SweepResults.sqlite', batch_size=100):
+        """
+        This class stores results of parameter sweeps in a SQLite database, so that sweeps can be queried and resumed.
+        Results are identified by the hash of the configuration of the sweep (everything but the gammas) and by the
+        gammas, results of a configuration are never stored twice. Gammas whose evaluation was aborted by pruning are
+        stored without cost and health cost, as only lower bounds of them are known. Results also carry the hash of
+        the configuration without lambda_water_quality (the setup hash): water use and health cost do not depend on
+        lambda, so results of the same setup can be compared whatever their lambda
+        :param db_file_path: path of the SQLite database file
+        :param batch_size: number of results inserted at once
+        """
+        self.batch_size = batch_size
+        self.pending_results = []
+        self.setup_hashes = {}
+
+        self.connection = sqlite3.connect(db_file_path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results ('
+                                'id INTEGER PRIMARY KEY, config_hash TEXT NOT NULL, '
+                                'gamma_l REAL NOT NULL, gamma_m REAL NOT NULL, gamma_h REAL NOT NULL, '
+                                'lambda_water_quality REAL, water_temperature REAL, occupancy_profile TEXT, '
+                                'seed INTEGER, cost REAL, water_use REAL, health_cost REAL, pruned INTEGER, '
+                                'setup_hash TEXT, time_step_seconds REAL)')
+
+        # Databases written before columns were added are migrated, their former results have no value there
+        existing_columns = [row[1] for row in self.connection.execute('PRAGMA table_info(results)')]
+        for column, column_type in ADDED_RESULT_COLUMNS.items():
+            if column not in existing_columns:
+                self.connection.execute('ALTER TABLE results ADD COLUMN {} {}'.format(column, column_type))
+
+        self.connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS results_config_gammas '
+                                'ON results (config_hash, gamma_l, gamma_m, gamma_h)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_gammas ON results (gamma_l, gamma_m, gamma_h)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_setup '
+                                'ON results (lambda_water_quality, water_temperature, occupancy_profile, seed)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_setup_hash ON results (setup_hash)')
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        This function writes pending results and closes the database
+        """
+        self.flush()
+        self.connection.close()
+
+    @staticmethod
+    def get_configuration_hash(configuration):
+        """
+        :param configuration: dict of the settings of a sweep, json serializable
+        :return: hash identifying the configuration
+        """
+        return hashlib.sha256(json.dumps(configuration, sort_keys=True, default=str).encode('utf8')).hexdigest()
+
+    @staticmethod
+    def get_setup_hash(configuration):
+        """
+        :param configuration: dict of the settings of a sweep, json serializable
+        :return: hash identifying the configuration but its lambda_water_quality
+        """
+        return SweepResultStore.get_configuration_hash({key: value for key, value in configuration.items()
+                                                        if key != 'lambda_water_quality'})
+
+    def add_result(self, config_hash, configuration, gamma_l, gamma_m, gamma_h, cost, water_use, health_cost,
+                   pruned=False):
+        """
+        This function queues a result, results are written to the database in batches
+        :param config_hash: hash of the configuration, as given by get_configuration_hash
+        :param configuration: dict of the settings of the sweep, providing lambda_water_quality,
+        swimming_pool_water_temperature_celsius, occupancy_profile, seed, and time_step_seconds
+        :param gamma_l: gamma_L of the result
+        :param gamma_m: gamma_M of the result
+        :param gamma_h: gamma_H of the result
+        :param cost: cost of the gammas
+        :param water_use: cost of water use of the gammas
+        :param health_cost: cost of water quality of the gammas
+        :param pruned: whether the evaluation was aborted, cost and health_cost being lower bounds, which are stored
+        as NULL
+        """
+        if config_hash not in self.setup_hashes:
+            self.setup_hashes[config_hash] = self.get_setup_hash(configuration)
+
+        self.pending_results.append((config_hash, float(gamma_l), float(gamma_m), float(gamma_h),
+                                     configuration.get('lambda_water_quality'),
+                                     configuration.get('swimming_pool_water_temperature_celsius'),
+                                     configuration.get('occupancy_profile'), configuration.get('seed'),
+                                     None if pruned else float(cost), float(water_use),
+                                     None if pruned else float(health_cost), int(pruned),
+                                     self.setup_hashes[config_hash], configuration.get('time_step_seconds')))
+        if len(self.pending_results) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        This function writes the queued results in one transaction
+        """
+        if not self.pending_results:
+            return
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO results ({}) VALUES ({})'.format(
+                ', '.join(RESULT_COLUMNS), ', '.join(['?'] * len(RESULT_COLUMNS))), self.pending_results)
+        self.pending_results = []
+
+    def get_evaluated_gammas(self, config_hash):
+        """
+        :param config_hash: hash of the configuration
+        :return: set of the (gamma_l, gamma_m, gamma_h) triples already evaluated under the configuration, pruned
+        triples included: a resumed sweep never evaluates them again, even though which triples get pruned depends on
+        the order in which worker processes finished and on the best cost known when they ran
+        """
+        self.flush()
+        rows = self.connection.execute('SELECT gamma_l, gamma_m, gamma_h FROM results WHERE config_hash = ?',
+                                       (config_hash,))
+        return set(rows.fetchall())
+
+    def get_result(self, config_hash, gamma_l, gamma_m, gamma_h):
+        """
+        :param config_hash: hash of the configuration
+        :param gamma_l: gamma_L
+        :param gamma_m: gamma_M
+        :param gamma_h: gamma_H
+        :return: dict of the result of the gammas under the configuration, or None if they were not evaluated
+        """
+        self.flush()
+        row = self.connection.execute('SELECT {} FROM results WHERE config_hash = ? AND gamma_l = ? AND gamma_m = ? '
+                                      'AND gamma_h = ?'.format(', '.join(RESULT_COLUMNS)),
+                                      (config_hash, float(gamma_l), float(gamma_m), float(gamma_h))).fetchone()
+        return dict(zip(RESULT_COLUMNS, row)) if row is not None else None
+
+    def get_latest_configuration_hash(self):
+        """
+        :return: hash of the configuration of the last stored result, or None if there is no result
+        """
+        self.flush()
+        row = self.connection.execute('SELECT config_hash FROM results ORDER BY id DESC LIMIT 1').fetchone()
+        return row[0] if row is not None else None
+
+    def get_best_result(self, config_hash):
+        """
+        :param config_hash: hash of the configuration
+        :return: dict of the complete (not pruned) result of lowest cost under the configuration, or None
+        """
+        self.flush()
+        row = self.connection.execute('SELECT {} FROM results WHERE config_hash = ? AND pruned = 0 '
+                                      'ORDER BY cost LIMIT 1'.format(', '.join(RESULT_COLUMNS)),
+                                      (config_hash,)).fetchone()
+        return dict(zip(RESULT_COLUMNS, row)) if row is not None else None
+
+    def get_results(self, config_hash=None, include_pruned=False):
+        """
+        :param config_hash: hash of the configuration (default: None, results of all configurations)
+        :param include_pruned: also return pruned results, whose cost and health_cost are None (default: False)
+        :return: list of dicts of the results
+        """
+        self.flush()
+        conditions = []
+        parameters = []
+        if config_hash is not None:
+            conditions.append('config_hash = ?')
+            parameters.append(config_hash)
+        if not include_pruned:
+            conditions.append('pruned = 0')
+
+        query = 'SELECT {} FROM results'.format(', '.join(RESULT_COLUMNS))
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        rows = self.connection.execute(query, parameters)
+        return [dict(zip(RESULT_COLUMNS, row)) for row in rows.fetchall()]
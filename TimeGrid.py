@@ -0,0 +1,192 @@
+import datetime
+import numpy as np
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def datetime_to_epoch_seconds(date_times):
+    """
+    This function converts naive date-times to whole seconds since 1970-01-01 00:00:00 (no time zone is applied)
+    :param date_times: a date-time or a list of date-times
+    :return: int64 seconds since the epoch, as a scalar array or an array
+    """
+    return np.array(date_times, dtype='datetime64[s]').astype(np.int64)
+
+
+def epoch_seconds_to_datetimes(epoch_seconds):
+    """
+    This function converts seconds since 1970-01-01 00:00:00 back to naive date-times
+    :param epoch_seconds: an integer or an array of integer seconds since the epoch
+    :return: a date-time or a list of date-times
+    """
+    return np.asarray(epoch_seconds, dtype=np.int64).astype('datetime64[s]').tolist()
+
+
+def parse_date_time_string(date_text):
+    """
+    :param date_text: date-time (format: YYYY/MM/DD hh:mm:ss)
+    :return: the date-time
+    """
+    try:
+        return datetime.datetime.strptime(date_text, '%Y/%m/%d %H:%M:%S')
+    except ValueError:
+        raise ValueError("Incorrect data format, should be YYYY/MM/DD hh:mm:ss")
+
+
+class TimeGrid:
+    def __init__(self, start_epoch_seconds, time_step_seconds, length):
+        """
+        This class is the time axis of a simulation: length date-time stamps, time_step_seconds apart, from a start
+        date-time. Date-times are seconds since 1970-01-01 00:00:00 (no time zone is applied), so that calendar fields
+        are computed for all stamps at once and the stamp of a date-time is found in O(1). Iterating over the grid or
+        indexing it with an integer gives datetime objects, as the lists of datetime stamps the models used to receive
+        :param start_epoch_seconds: first date-time stamp in seconds since the epoch
+        :param time_step_seconds: period of date-time stamps in seconds
+        :param length: number of date-time stamps
+        """
+        self.start_epoch_seconds = int(start_epoch_seconds)
+        self.time_step_seconds = int(time_step_seconds)
+        self.length = int(length)
+
+        if self.length > 1 and self.time_step_seconds <= 0:
+            raise ValueError('time_step_seconds must be positive')
+
+    @classmethod
+    def from_date_time_strings(cls, start_date_time, end_date_time, time_step_seconds=300):
+        """
+        This function builds the grid of utils.generate_timestamps_between_two_date_times
+        :param start_date_time: start date-time (format: YYYY/MM/DD hh:mm:ss)
+        :param end_date_time: end date-time, exclusive (format: YYYY/MM/DD hh:mm:ss)
+        :param time_step_seconds: period of date-time stamps in seconds
+        :return: time grid
+        """
+        dt_start = parse_date_time_string(start_date_time)
+        dt_end = parse_date_time_string(end_date_time)
+        length = int((dt_end - dt_start).total_seconds() / time_step_seconds)
+        return cls(datetime_to_epoch_seconds(dt_start), time_step_seconds, length)
+
+    @classmethod
+    def from_datetime_stamps(cls, datetime_stamps):
+        """
+        This function builds the grid of a list of evenly spaced datetime stamps, from its first two stamps
+        :param datetime_stamps: list of datetime stamps
+        :return: time grid
+        """
+        if len(datetime_stamps) == 0:
+            return cls(0, 0, 0)
+        time_step_seconds = 0
+        if len(datetime_stamps) > 1:
+            time_step_seconds = int((datetime_stamps[1] - datetime_stamps[0]).total_seconds())
+        return cls(datetime_to_epoch_seconds(datetime_stamps[0]), time_step_seconds, len(datetime_stamps))
+
+    @classmethod
+    def from_any(cls, datetime_stamps):
+        """
+        This function lets models accept date-time stamps either as a time grid or as a list of datetime stamps
+        :param datetime_stamps: time grid or list of datetime stamps
+        :return: time grid
+        """
+        if isinstance(datetime_stamps, cls):
+            return datetime_stamps
+        return cls.from_datetime_stamps(datetime_stamps)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.to_datetimes())
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self.length)
+            if step <= 0:
+                raise ValueError('time grids only support increasing slices')
+            return TimeGrid(self.start_epoch_seconds + start * self.time_step_seconds, self.time_step_seconds * step,
+                            len(range(start, stop, step)))
+
+        n = range(self.length)[item]
+        return epoch_seconds_to_datetimes(self.start_epoch_seconds + n * self.time_step_seconds)
+
+    def __eq__(self, other):
+        return isinstance(other, TimeGrid) and (self.start_epoch_seconds, self.time_step_seconds, self.length) == \
+            (other.start_epoch_seconds, other.time_step_seconds, other.length)
+
+    def __repr__(self):
+        return 'TimeGrid(start={}, time_step_seconds={}, length={})'.format(
+            epoch_seconds_to_datetimes(self.start_epoch_seconds), self.time_step_seconds, self.length)
+
+    @property
+    def end_epoch_seconds(self):
+        """
+        :return: end of the last time step in seconds since the epoch
+        """
+        return self.start_epoch_seconds + self.length * self.time_step_seconds
+
+    @property
+    def epoch_seconds(self):
+        """
+        :return: int64 array of the date-time stamps in seconds since the epoch
+        """
+        return self.start_epoch_seconds + np.arange(self.length, dtype=np.int64) * self.time_step_seconds
+
+    def to_datetimes(self):
+        """
+        :return: list of datetime stamps, for I/O and plots
+        """
+        return epoch_seconds_to_datetimes(self.epoch_seconds)
+
+    def get_indices(self, epoch_seconds):
+        """
+        This function finds the time steps holding date-times
+        :param epoch_seconds: date-times in seconds since the epoch
+        :return: indices of the time steps (may fall outside [0, length) for date-times outside the grid)
+        """
+        return (np.asarray(epoch_seconds, dtype=np.int64) - self.start_epoch_seconds) // self.time_step_seconds
+
+    @property
+    def hour(self):
+        """
+        :return: hour of the day of every date-time stamp
+        """
+        return (self.epoch_seconds // 3600) % 24
+
+    @property
+    def weekday(self):
+        """
+        :return: day of the week of every date-time stamp, Monday is 0
+        """
+        # 1970-01-01 was a Thursday, weekday 3 when Monday is 0
+        return (self.epoch_seconds // SECONDS_PER_DAY + 3) % 7
+
+    @property
+    def month(self):
+        """
+        :return: month of every date-time stamp, January is 1
+        """
+        return self.epoch_seconds.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64) % 12 + 1
+
+    @property
+    def year(self):
+        """
+        :return: year of every date-time stamp
+        """
+        return self.epoch_seconds.astype('datetime64[s]').astype('datetime64[Y]').astype(np.int64) + 1970
+
+    @property
+    def day_index(self):
+        """
+        :return: index of the date of every date-time stamp in dates
+        """
+        return self.epoch_seconds // SECONDS_PER_DAY - self.start_epoch_seconds // SECONDS_PER_DAY
+
+    @property
+    def dates(self):
+        """
+        :return: list of the dates of the date-time stamps, in order
+        """
+        if self.length == 0:
+            return []
+        first_day = self.start_epoch_seconds // SECONDS_PER_DAY
+        last_day = (self.end_epoch_seconds - self.time_step_seconds) // SECONDS_PER_DAY
+        epoch_ordinal = datetime.date(1970, 1, 1).toordinal()
+        return [datetime.date.fromordinal(int(epoch_ordinal + day)) for day in range(first_day, last_day + 1)]
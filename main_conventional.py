@@ -1,61 +1,50 @@
-import datetime
+import os
 from typing import Any
 import utils
-import ModelOccupancyParameters
+import OccupancyTable
+import TimeGrid
+import StageCache
+import OccupancyGenerator
+import StreamingSimulation
 import ModelChemicalParameters
 import ModelWaterManagement
 import ModelBodyFluidRelease
 import ModelWaterEvaporation
 import numpy as np
 import json
-from django.core.serializers.json import DjangoJSONEncoder
 
 
 def simulate_occupancy_between_two_date_times(start_date_time, end_date_time, time_step_seconds=300,
-                                              json_file_path='SwimmingPoolOccupancyParameters.json'):
+                                              json_file_path='SwimmingPoolOccupancyParameters.json', seed=None,
+                                              as_table=False, number_of_processes=1):
     """
     This function provides occupancy model between two dates
     :param time_step_seconds: time difference between each consecutive time-sample (default: 300 seconds)
     :param start_date_time: start date-time of occupancy simulation (format: YYYY-MM-DD hh:mm:ss)
     :param end_date_time: end date-time of occupancy simulation (format: YYYY-MM-DD hh:mm:ss)
     :param json_file_path:
+    :param seed: master seed of the random streams of swimmers, one per day (default: None, unpredictable)
+    :param as_table: return the occupancy as an OccupancyTable instead of a list of dicts
+    :param number_of_processes: number of processes generating days in parallel, the occupancy does not depend on it
+    (default: 1; None: number of CPUs)
     :return: returns a json file of occupancy between the specified date-times as an array of objects which each object
     presents one single occupant with its weight, height, age, gender, and activity level data throughout the staying
     time.
     """
 
-    model = ModelOccupancyParameters.ModelOccupancyParameters(json_file_path=json_file_path)
+    generator = OccupancyGenerator.OccupancyGenerator(json_file_path=json_file_path)
 
     utils.validate_date_time_string(start_date_time)
 
     utils.validate_date_time_string(end_date_time)
 
-    dt_start = datetime.datetime.strptime(start_date_time, '%Y/%m/%d %H:%M:%S')
+    datetime_stamps = TimeGrid.TimeGrid.from_date_time_strings(start_date_time, end_date_time, time_step_seconds)
 
-    dt_end = datetime.datetime.strptime(end_date_time, '%Y/%m/%d %H:%M:%S')
-
-    dts = utils.dates_bwn_two_date_times_generator(dt_start, dt_end, time_step_seconds)
-    occupancy_data = []
-    datetime_stamps = []
-    for n, dt in enumerate(dts):
-        dt_ = dt
-        datetime_stamps.append(dt)
-        s = 0
-        while True:
-
-            time_to_arrival, gender, age, weight, height, time_of_stay_seconds, als = \
-                model.get_a_swimmer_from_model(dt_, time_step_seconds)
-
-            s += time_to_arrival
-            if s < time_step_seconds:
-                datetime_arrival = dt + datetime.timedelta(seconds=s)
-                datetime_leave = dt + datetime.timedelta(seconds=s + time_of_stay_seconds)
-                dt_ = datetime_arrival
-                occupancy_data.append({'DT-Arrival': datetime_arrival, 'Gender': gender, 'Age': age, 'Weight': weight,
-                                       'Height': height, 'DT-Leave': datetime_leave, 'Act-Levels': als})
-            else:
-                break
-    return datetime_stamps, occupancy_data
+    # Swimmers arrive during the time steps of the simulation, each day from its own random stream
+    occupancy_table = generator.generate(datetime_stamps, seed, number_of_processes)
+    if as_table:
+        return datetime_stamps, occupancy_table
+    return datetime_stamps, occupancy_table.to_occupancy_data()
 
 
 def main():
@@ -78,95 +67,80 @@ def main():
     # initial_chemical_parameters: initial chemical parameters of the swimming pool at the start datetime
     initial_chemical_parameters = {"FAC": 1, "TCM": 0, "CC": 0, "pH": 7.8, "ORP": 700, "BF": 0}
 
+    # seed: seed of the random generator of swimmers, cached occupancy is only reused for the same seed
+    seed = 2022
+    occupancy_parameters_json_file = 'SwimmingPoolOccupancyParameters.json'
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Stages are loaded from the cache when they already ran with the same inputs, and computed otherwise
+    # ------------------------------------------------------------------------------------------------------------------
+    stage_cache = StageCache.StageCache()
+    occupancy_profile_hash = stage_cache.get_file_hash(occupancy_parameters_json_file)
+
+    datetime_stamps = TimeGrid.TimeGrid.from_date_time_strings(start_date_time, end_date_time, time_step_seconds)
+
     # ------------------------------------------------------------------------------------------------------------------
-    # Load simulated occupancy of swimming pool between start and end date-times from Json file
+    # Simulate occupancy of swimming pool between start and end date-times
     # ------------------------------------------------------------------------------------------------------------------
-    load_occupancy_data_from_file = True
-    occupancy_data_json_file = 'Data_main/OccupancyData.json'
-    body_fluid_release_data_json_file = 'Data_main/BodyFluidReleaseData.json'
-    water_evaporation_data_json_file = 'Data_main/WaterEvaporationData.json'
-    bather_load_data_json_file = 'Data_main/BatherLoadData.json'
-
-    load_occupancy_data_from_file_failed = True
-    while load_occupancy_data_from_file:
-        try:
-            with open(occupancy_data_json_file, "r") as f_occ:
-                occupancy_data_json = json.load(f_occ)
-                if 'start_date_time' not in occupancy_data_json or \
-                        'end_date_time' not in occupancy_data_json or \
-                        'time_step_seconds' not in occupancy_data_json or \
-                        'Occupancy' not in occupancy_data_json:
-                    break
-                if occupancy_data_json['start_date_time'] != start_date_time or \
-                        occupancy_data_json['end_date_time'] != end_date_time or \
-                        occupancy_data_json['time_step_seconds'] != time_step_seconds:
-                    break
-                datetime_stamps = utils.generate_timestamps_between_two_date_times(start_date_time, end_date_time,
-                                                                                   time_step_seconds)
-                occupancy_data = occupancy_data_json['Occupancy']
-                for item in occupancy_data:
-                    item['DT-Arrival'] = datetime.datetime.strptime(item['DT-Arrival'], '%Y-%m-%dT%H:%M:%S')
-                    item['DT-Leave'] = datetime.datetime.strptime(item['DT-Leave'], '%Y-%m-%dT%H:%M:%S')
-                print('Occupancy data loaded from file!')
-                load_occupancy_data_from_file_failed = False
-                break
-        except:
-            print('Not able to find or load occupancy data json file!')
-            break
-
-    load_body_fluid_release_data_from_file_failed = True
-    water_evaporation_data_from_file_failed = True
-    bather_load_data_from_file_failed = True
-    if load_occupancy_data_from_file_failed:
-        # Simulate occupancy of swimming pool between start and end date-times
-        print("Generating simulated occupancy data between {} and {}".format(start_date_time, end_date_time))
-        datetime_stamps, occupancy_data = \
-            simulate_occupancy_between_two_date_times(start_date_time, end_date_time, time_step_seconds,
-                                                      json_file_path='SwimmingPoolOccupancyParameters.json')
-    else:
-        try:
-            with open(body_fluid_release_data_json_file, "r") as f_bfr:
-                body_fluid_release = json.load(f_bfr)
-            load_body_fluid_release_data_from_file_failed = False
-            print('Body fluid release data loaded from file!')
-            with open(water_evaporation_data_json_file, "r") as f_we:
-                water_evaporation = json.load(f_we)
-            print('water evaporation data loaded from file!')
-            water_evaporation_data_from_file_failed = False
-            with open(bather_load_data_json_file, "r") as f_bl:
-                bather_load = json.load(f_bl)
-            print('bather load data loaded from file!')
-            bather_load_data_from_file_failed = False
-        except:
-            print('Not able to find or load body fluid release data json file!')
+    def simulate_occupancy():
+        _, table = simulate_occupancy_between_two_date_times(start_date_time, end_date_time, time_step_seconds,
+                                                             json_file_path=occupancy_parameters_json_file,
+                                                             seed=seed, as_table=True)
+        return {'arrival': table.arrival, 'leave': table.leave, 'gender': table.gender, 'age': table.age,
+                'weight': table.weight, 'height': table.height, 'activity_levels': table.activity_levels,
+                'activity_offsets': table.activity_offsets}
+
+    occupancy_outputs, occupancy_hash = stage_cache.run(
+        'Occupancy', {'parameters': occupancy_profile_hash,
+                      'start_date_time': start_date_time, 'end_date_time': end_date_time,
+                      'time_step_seconds': time_step_seconds, 'seed': seed, 'random_streams': 'whole-days'},
+        simulate_occupancy)
+    occupancy_table = OccupancyTable.OccupancyTable(**occupancy_outputs)
+    occupancy_data = occupancy_table.to_occupancy_data()
 
     # ------------------------------------------------------------------------------------------------------------------
     # Simulate body fluid release based on occupancy data and water temperature
     # ------------------------------------------------------------------------------------------------------------------
-    if load_body_fluid_release_data_from_file_failed:
-        print("Generating body fluid release data")
+    def simulate_body_fluid_release():
         model_bfa_release = ModelBodyFluidRelease.ModelBodyFluidRelease()
-        body_fluid_release = model_bfa_release.simulate_body_fluid_release(datetime_stamps, occupancy_data,
-                                                                           swimming_pool_water_temperature_celsius)
+        return {'body_fluid_release': model_bfa_release.simulate_body_fluid_release(
+            datetime_stamps, occupancy_table, swimming_pool_water_temperature_celsius)}
+
+    body_fluid_release_outputs, _ = stage_cache.run(
+        'BodyFluidRelease', {'occupancy': occupancy_hash, 'start_date_time': start_date_time,
+                             'end_date_time': end_date_time, 'time_step_seconds': time_step_seconds,
+                             'water_temperature': swimming_pool_water_temperature_celsius},
+        simulate_body_fluid_release)
+    body_fluid_release = body_fluid_release_outputs['body_fluid_release'].tolist()
 
     # ------------------------------------------------------------------------------------------------------------------
     # Calculate bather load
     # ------------------------------------------------------------------------------------------------------------------
-    if bather_load_data_from_file_failed:
-        print("Calculating bather load")
-        bather_load = utils.get_bather_load_for_datetime_stamps(datetime_stamps, occupancy_data, time_step_seconds)
+    bather_load_outputs, bather_load_hash = stage_cache.run(
+        'BatherLoad', {'occupancy': occupancy_hash, 'start_date_time': start_date_time,
+                       'end_date_time': end_date_time, 'time_step_seconds': time_step_seconds},
+        lambda: {'bather_load': utils.get_bather_load_for_datetime_stamps(datetime_stamps, occupancy_table,
+                                                                          time_step_seconds)})
+    bather_load = bather_load_outputs['bather_load'].tolist()
 
     # ------------------------------------------------------------------------------------------------------------------
     # Calculate water evaporation based on occupancy
     # ------------------------------------------------------------------------------------------------------------------
-    if water_evaporation_data_from_file_failed:
-        print("Generating water evaporation data")
+    def simulate_water_evaporation():
         model_water_evaporation = ModelWaterEvaporation.ModelWaterEvaporation()
-        water_evaporation = model_water_evaporation.process_water_evaporation(datetime_stamps, bather_load,
-                                                                              swimming_pool_surface_area,
-                                                                              swimming_pool_water_temperature_celsius,
-                                                                              natatorium_room_temperature_celsius,
-                                                                              natatorium_room_relative_humidity)
+        return {'water_evaporation': model_water_evaporation.process_water_evaporation(
+            datetime_stamps, bather_load, swimming_pool_surface_area, swimming_pool_water_temperature_celsius,
+            natatorium_room_temperature_celsius, natatorium_room_relative_humidity)}
+
+    water_evaporation_outputs, _ = stage_cache.run(
+        'WaterEvaporation', {'bather_load': bather_load_hash, 'start_date_time': start_date_time,
+                             'end_date_time': end_date_time, 'time_step_seconds': time_step_seconds,
+                             'surface_area': swimming_pool_surface_area,
+                             'water_temperature': swimming_pool_water_temperature_celsius,
+                             'room_temperature': natatorium_room_temperature_celsius,
+                             'room_relative_humidity': natatorium_room_relative_humidity},
+        simulate_water_evaporation)
+    water_evaporation = water_evaporation_outputs['water_evaporation'].tolist()
 
     daily_bather_loads, dates = utils.get_daily_bather_load_2(datetime_stamps, occupancy_data)
 
@@ -251,28 +225,14 @@ def main():
     # Store simulated model
     # ------------------------------------------------------------------------------------------------------------------
     with open("run_Chemicals.json", "w") as i:
-        json_string = json.dumps(chemical_parameters)
-        i.write(json_string)
-
-    with open(occupancy_data_json_file, "w") as i:
-        occupancy_data_to_dump = {'start_date_time': start_date_time,
-                                  'end_date_time': end_date_time,
-                                  'time_step_seconds': time_step_seconds,
-                                  'Occupancy': occupancy_data}
-        json_string = json.dumps(occupancy_data_to_dump, sort_keys=True, indent=1, cls=DjangoJSONEncoder)
+        json_string = json.dumps({WMM: model_chemicals.get_chemical_parameters_rows(chemical_parameters[WMM])
+                                  for WMM in chemical_parameters})
         i.write(json_string)
 
-    with open(body_fluid_release_data_json_file, "w") as i:
-        json_string = json.dumps(body_fluid_release, sort_keys=True, indent=1, cls=DjangoJSONEncoder)
-        i.write(json_string)
-
-    with open(water_evaporation_data_json_file, "w") as i:
-        json_string = json.dumps(water_evaporation, sort_keys=True, indent=1, cls=DjangoJSONEncoder)
-        i.write(json_string)
-
-    with open(bather_load_data_json_file, "w") as i:
-        json_string = json.dumps(bather_load, sort_keys=True, indent=1, cls=DjangoJSONEncoder)
-        i.write(json_string)
+    occupancy_table.save('Data_main/Occupancy', {'start_date_time': start_date_time, 'end_date_time': end_date_time,
+                                                 'time_step_seconds': time_step_seconds, 'seed': seed,
+                                                 'occupancy_profile': occupancy_parameters_json_file,
+                                                 'occupancy_profile_hash': occupancy_profile_hash})
 
     # ------------------------------------------------------------------------------------------------------------------
     # Generate Plots/Charts/Results
@@ -285,5 +245,61 @@ def main():
     print('total bather load:{}'.format(len(occupancy_data)))
 
 
+def main_streaming():
+    # Multi-year simulation, run week by week so that memory use does not depend on the number of years
+    start_date_time = "2022/01/01 00:00:00"
+    end_date_time = "2031/12/31 23:54:00"
+    time_step_seconds = 360
+    swimming_pool_water_temperature_celsius = 28
+    natatorium_room_temperature_celsius = 30
+    natatorium_room_relative_humidity = 0.5
+    swimming_pool_volume_of_water = 200 * 1000
+    max_swimming_pool_volume_of_water = 250 * 1000
+    min_swimming_pool_volume_of_water = 150 * 1000
+    swimming_pool_surface_area = 150
+    TCM_th = 100 #ug/L
+    initial_chemical_parameters = {"FAC": 1, "TCM": 0, "CC": 0, "pH": 7.8, "ORP": 700, "BF": 0}
+    seed = 2022
+    output_directory = 'Data_main/Streaming'
+
+    simulation = StreamingSimulation.StreamingSimulation(start_date_time, end_date_time, time_step_seconds,
+                                                         swimming_pool_water_temperature_celsius,
+                                                         natatorium_room_temperature_celsius,
+                                                         natatorium_room_relative_humidity,
+                                                         swimming_pool_volume_of_water,
+                                                         min_swimming_pool_volume_of_water,
+                                                         max_swimming_pool_volume_of_water,
+                                                         swimming_pool_surface_area, initial_chemical_parameters,
+                                                         gammas=(4, 20, 158), chunk_days=7, seed=seed)
+
+    os.makedirs(output_directory, exist_ok=True)
+    dates = []
+    daily_water_use = []
+    daily_TCM = []
+    daily_TCM_above_th = []
+    total_bather_load = 0
+    for n, chunk in enumerate(simulation.run()):
+        # Chunks start at midnight, their daily aggregates are complete
+        np.save(os.path.join(output_directory, 'ChemicalParameters_{:05d}.npy'.format(n)), chunk['chemical_parameters'])
+
+        water_use, _, _ = utils.get_daily_water_treatment(chunk['time_grid'], chunk['chemical_parameters'])
+        tcm, _, tcm_above_th, _ = utils.get_daily_water_health_quality(chunk['time_grid'],
+                                                                       chunk['chemical_parameters'], TCM_th)
+        dates += chunk['time_grid'].dates
+        daily_water_use += water_use
+        daily_TCM += tcm
+        daily_TCM_above_th += tcm_above_th
+        total_bather_load += int(np.sum(chunk['occupancy'].arrival >= chunk['time_grid'].start_epoch_seconds))
+
+    np.save(os.path.join(output_directory, 'DailyAggregates.npy'),
+            np.array(list(zip(daily_water_use, daily_TCM, daily_TCM_above_th)),
+                     dtype=[('water_use', float), ('TCM', float), ('TCM_above_th', float)]))
+
+    print('# of days: {}, # of days with TCM above threshold: {}, maximum TCM:{}'.format(
+        len(dates), sum(daily_TCM_above_th), max(daily_TCM)))
+    print('Total Water Use: {}'.format(np.sum(np.array(daily_water_use))))
+    print('total bather load:{}'.format(total_bather_load))
+
+
 if __name__ == "__main__":
     main()
@@ -3,6 +3,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.ticker as plticker
 from matplotlib import rc, rcParams
+import OccupancyTable
+import TimeGrid
 
 
 def generate_timestamps_between_two_date_times(start_date_time, end_date_time, time_step_seconds=300):
@@ -44,96 +46,290 @@ def dates_bwn_two_date_times_generator(start_date_time, end_date_time, time_step
 
 
 def get_bather_load_for_datetime_stamps(datetime_stamps, occupancy_data, time_step_seconds):
-    occupancy_array = np.zeros((len(datetime_stamps),))
-    for oc_d in occupancy_data:
-        for n, dts in enumerate(datetime_stamps):
-            if oc_d['DT-Arrival'] < dts + datetime.timedelta(seconds=time_step_seconds) and oc_d['DT-Leave'] > dts:
-                occupancy_array[n] += 1
+    """
+    This function counts the swimmers present during each time step, i.e. arriving before the end of the step and
+    leaving after its start. Arrival and leave times are converted to step indices and the counts are accumulated with
+    one scatter of +1/-1 into a difference array followed by a cumulative sum
+    :param datetime_stamps: date-time stamps of the time steps
+    :param occupancy_data: occupancy data as a list of dicts or an OccupancyTable
+    :param time_step_seconds: time step between samples per seconds
+    :return: number of swimmers present per time step
+    """
+    occupancy_table = OccupancyTable.OccupancyTable.from_any(occupancy_data)
+    number_of_time_steps = len(datetime_stamps)
+    if number_of_time_steps == 0:
+        return []
+
+    epoch_start = TimeGrid.TimeGrid.from_any(datetime_stamps).start_epoch_seconds
+    arrival = occupancy_table.arrival - epoch_start
+    leave = occupancy_table.leave - epoch_start
+
+    # First time step ending after the arrival and first time step starting at or after the leave
+    first_step = np.clip(np.floor(arrival / time_step_seconds), 0, number_of_time_steps).astype(np.int64)
+    end_step = np.clip(np.ceil(leave / time_step_seconds), 0, number_of_time_steps).astype(np.int64)
+    present = first_step < end_step
+
+    difference = np.bincount(first_step[present], minlength=number_of_time_steps + 1) - \
+        np.bincount(end_step[present], minlength=number_of_time_steps + 1)
+
+    occupancy_array = np.cumsum(difference[:number_of_time_steps]).astype(float)
     return list(occupancy_array)
 
 
-def get_daily_bather_load(datetime_stamps, occupancy_data):
-    dates = []
-    for dt in datetime_stamps:
-        date_ = dt.date()
-        if date_ not in dates:
-            dates.append(date_)
+def get_fractional_bather_load_for_datetime_stamps(datetime_stamps, occupancy_data, time_step_seconds):
+    """
+    This function is the fractional variant of get_bather_load_for_datetime_stamps: each swimmer counts for the fraction
+    of the time step actually spent in the swimming pool. The total presence time up to each step boundary is evaluated
+    from the sorted arrival and leave times with prefix sums
+    :param datetime_stamps: date-time stamps of the time steps
+    :param occupancy_data: occupancy data as a list of dicts or an OccupancyTable
+    :param time_step_seconds: time step between samples per seconds
+    :return: presence-weighted number of swimmers per time step
+    """
+    occupancy_table = OccupancyTable.OccupancyTable.from_any(occupancy_data)
+    number_of_time_steps = len(datetime_stamps)
+    if number_of_time_steps == 0:
+        return []
 
-    occupancy_array = np.zeros((len(dates),))
-    for oc_d in occupancy_data:
-        date__ = datetime.datetime.strptime(oc_d['DT-Arrival'], '%Y-%m-%dT%H:%M:%S').date()
-        ind = dates.index(date__)
-        occupancy_array[ind] += 1
-    return list(occupancy_array), list(dates)
+    epoch_start = TimeGrid.TimeGrid.from_any(datetime_stamps).start_epoch_seconds
+    stays = occupancy_table.leave > occupancy_table.arrival
+    arrival = np.sort(occupancy_table.arrival[stays] - epoch_start).astype(float)
+    leave = np.sort(occupancy_table.leave[stays] - epoch_start).astype(float)
 
+    boundaries = np.arange(number_of_time_steps + 1) * float(time_step_seconds)
 
-def get_daily_bather_load2(datetime_stamps, occupancy_data):
-    dates = []
-    for dt in datetime_stamps:
-        date_ = dt.date()
-        if date_ not in dates:
-            dates.append(date_)
+    def time_since(times, cumulative_times):
+        # sum over times before each boundary of (boundary - time)
+        count = np.searchsorted(times, boundaries, side='left')
+        return count * boundaries - cumulative_times[count]
+
+    # Total presence time of all swimmers up to each boundary
+    presence_time = time_since(arrival, np.concatenate(([0], np.cumsum(arrival)))) - \
+        time_since(leave, np.concatenate(([0], np.cumsum(leave))))
+
+    return list(np.diff(presence_time) / time_step_seconds)
 
-    occupancy_array = np.zeros((len(dates),))
-    for oc_d in occupancy_data:
-        date__ = oc_d['DT-Arrival'].date()
-        ind = dates.index(date__)
-        occupancy_array[ind] += 1
-    return list(occupancy_array), list(dates)
+
+def get_arrival_epoch_seconds(occupancy_data):
+    """
+    :param occupancy_data: occupancy data as a list of dicts (date-times as datetime objects or ISO strings) or an
+    OccupancyTable
+    :return: arrival date-times of swimmers in seconds since the epoch
+    """
+    if isinstance(occupancy_data, OccupancyTable.OccupancyTable):
+        return occupancy_data.arrival
+    return TimeGrid.datetime_to_epoch_seconds([oc_d['DT-Arrival'] for oc_d in occupancy_data]).reshape(-1)
+
+
+def get_daily_bather_load(datetime_stamps, occupancy_data):
+    daily_bather_load, dates = resample_events(datetime_stamps, get_arrival_epoch_seconds(occupancy_data), 'day')
+    return list(daily_bather_load), list(dates)
+
+
+def get_daily_bather_load2(datetime_stamps, occupancy_data):
+    return get_daily_bather_load(datetime_stamps, occupancy_data)
 
 
 def get_daily_bather_load_2(datetime_stamps, occupancy_data):
-    dates = []
-    for dt in datetime_stamps:
-        date_ = dt.date()
-        if date_ not in dates:
-            dates.append(date_)
+    return get_daily_bather_load(datetime_stamps, occupancy_data)
+
+
+def get_chemical_parameter_values(chemical_parameters, key):
+    """
+    This function extracts one chemical parameter of all datetime stamps as an array
+    :param chemical_parameters: chemical parameters as a structured array or as a list of dicts (e.g. loaded from json)
+    :param key: name of the chemical parameter, e.g. 'TCM'
+    :return: array of the chemical parameter per datetime stamp
+    """
+    if isinstance(chemical_parameters, np.ndarray):
+        return chemical_parameters[key]
+    return np.array([chem_d[key] for chem_d in chemical_parameters], dtype=float)
+
+
+RESAMPLING_PERIODS = ['hour', 'day', 'week', 'month']
+
+
+def get_period_keys(epoch_seconds, period):
+    """
+    :param epoch_seconds: date-times in seconds since the epoch
+    :param period: 'hour', 'day', 'week' (starting on Monday), or 'month'
+    :return: integer key of the period of each date-time, increasing with time
+    """
+    epoch_seconds = np.asarray(epoch_seconds, dtype=np.int64)
+    if period == 'hour':
+        return epoch_seconds // 3600
+    if period == 'day':
+        return epoch_seconds // TimeGrid.SECONDS_PER_DAY
+    if period == 'week':
+        # 1970-01-01 was a Thursday, three days after the start of its week
+        return (epoch_seconds // TimeGrid.SECONDS_PER_DAY + 3) // 7
+    if period == 'month':
+        return epoch_seconds.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+    raise ValueError('period must be one of {}'.format(RESAMPLING_PERIODS))
+
+
+def get_period_labels(period_keys, period):
+    """
+    :param period_keys: keys of periods, as given by get_period_keys
+    :param period: 'hour', 'day', 'week', or 'month'
+    :return: list of the start of each period, as datetimes for hours and as dates otherwise
+    """
+    period_keys = np.asarray(period_keys, dtype=np.int64)
+    if period == 'hour':
+        return TimeGrid.epoch_seconds_to_datetimes(period_keys * 3600)
+    if period == 'day':
+        days = period_keys
+    elif period == 'week':
+        days = period_keys * 7 - 3
+    elif period == 'month':
+        days = period_keys.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+    else:
+        raise ValueError('period must be one of {}'.format(RESAMPLING_PERIODS))
+    epoch_ordinal = datetime.date(1970, 1, 1).toordinal()
+    return [datetime.date.fromordinal(int(epoch_ordinal + day)) for day in days]
+
+
+def get_period_indices(datetime_stamps, period='day'):
+    """
+    This function groups datetime stamps by hour, day, week, or month
+    :param datetime_stamps: datetime stamps, as a time grid or a list of datetimes
+    :param period: 'hour', 'day', 'week' (starting on Monday), or 'month'
+    :return: list of the periods of the stamps in order of appearance (labeled as in get_period_labels), array of the
+    period index of each stamp, and keys of the periods (as in get_period_keys)
+    """
+    if isinstance(datetime_stamps, TimeGrid.TimeGrid):
+        epoch_seconds = datetime_stamps.epoch_seconds
+    else:
+        epoch_seconds = TimeGrid.datetime_to_epoch_seconds(list(datetime_stamps)).reshape(-1)
+
+    unique_keys, first_indices, period_indices = np.unique(get_period_keys(epoch_seconds, period), return_index=True,
+                                                           return_inverse=True)
+
+    # np.unique sorts the periods, restore their order of appearance
+    order = np.argsort(first_indices)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
 
-    occupancy_array = np.zeros((len(dates),))
-    for oc_d in occupancy_data:
-        date__ = oc_d['DT-Arrival'].date()
-        ind = dates.index(date__)
-        occupancy_array[ind] += 1
-    return list(occupancy_array), list(dates)
+    return get_period_labels(unique_keys[order], period), rank[period_indices.reshape(-1)], unique_keys[order]
+
+
+def get_date_indices(datetime_stamps):
+    """
+    This function finds the dates of datetime stamps, in order of appearance, and the date index of each stamp
+    :param datetime_stamps: datetime stamps
+    :return: list of dates and array of date indices
+    """
+    dates, date_indices, _ = get_period_indices(datetime_stamps, 'day')
+    return dates, date_indices
+
+
+def aggregate_by_period(period_indices, number_of_periods, values=None, how='sum', threshold=None):
+    """
+    This function reduces values per period. Values past the last period index are ignored, periods without values
+    get 0
+    :param period_indices: period index of each value, as given by get_period_indices
+    :param number_of_periods: number of periods
+    :param values: values to reduce (not needed to count)
+    :param how: 'sum', 'mean', 'max', 'min', 'count', 'above' (1 if a value of the period exceeds threshold, 0
+    otherwise), or 'count_above' (number of values of the period exceeding threshold)
+    :param threshold: threshold of 'above' and 'count_above'
+    :return: array of the reduced values per period
+    """
+    period_indices = np.asarray(period_indices, dtype=np.int64)
+    if how == 'count':
+        return np.bincount(period_indices, minlength=number_of_periods).astype(float)
+
+    values = np.asarray(values, dtype=float)
+    number_of_values = min(len(period_indices), len(values))
+    period_indices = period_indices[:number_of_values]
+    values = values[:number_of_values]
+
+    if how == 'sum':
+        return np.bincount(period_indices, values, minlength=number_of_periods)
+    if how == 'mean':
+        sums = np.bincount(period_indices, values, minlength=number_of_periods)
+        counts = np.bincount(period_indices, minlength=number_of_periods)
+        return np.divide(sums, counts, out=np.zeros((number_of_periods,)), where=counts > 0)
+    if how in ['above', 'count_above']:
+        exceedances = np.bincount(period_indices[values > threshold], minlength=number_of_periods).astype(float)
+        return exceedances if how == 'count_above' else np.minimum(exceedances, 1)
+    if how in ['max', 'min']:
+        ufunc = np.maximum if how == 'max' else np.minimum
+        reduced = np.zeros((number_of_periods,))
+        if number_of_values == 0:
+            return reduced
+        if np.all(np.diff(period_indices) >= 0):
+            # Stamps of a time axis come period after period, each period is one contiguous segment
+            starts = np.flatnonzero(np.diff(period_indices, prepend=-1))
+            reduced[period_indices[starts]] = ufunc.reduceat(values, starts)
+        else:
+            present = np.bincount(period_indices, minlength=number_of_periods) > 0
+            reduced[present] = -np.inf if how == 'max' else np.inf
+            ufunc.at(reduced, period_indices, values)
+        return reduced
+    raise ValueError("how must be one of 'sum', 'mean', 'max', 'min', 'count', 'above', or 'count_above'")
+
+
+def resample(datetime_stamps, values, period='day', how='sum', threshold=None):
+    """
+    This function aggregates a series given per datetime stamp (a column of the chemical parameters, bather load, body
+    fluid release, ...) per hour, day, week, or month
+    :param datetime_stamps: datetime stamps, as a time grid or a list of datetimes
+    :param values: values per datetime stamp, or chemical parameters and the name of the column as a tuple
+    :param period: 'hour', 'day', 'week' (starting on Monday), or 'month'
+    :param how: reduction, as in aggregate_by_period
+    :param threshold: threshold of 'above' and 'count_above'
+    :return: array of the aggregated values and list of the periods
+    """
+    if isinstance(values, tuple):
+        values = get_chemical_parameter_values(*values)
+    labels, period_indices, _ = get_period_indices(datetime_stamps, period)
+    return aggregate_by_period(period_indices, len(labels), values, how, threshold), labels
+
+
+def resample_events(datetime_stamps, event_epoch_seconds, period='day', values=None, how='count', threshold=None):
+    """
+    This function aggregates events (e.g. arrivals of swimmers) per period of the datetime stamps
+    :param datetime_stamps: datetime stamps, as a time grid or a list of datetimes
+    :param event_epoch_seconds: date-times of the events in seconds since the epoch
+    :param period: 'hour', 'day', 'week' (starting on Monday), or 'month'
+    :param values: values of the events, if they are not only counted
+    :param how: reduction, as in aggregate_by_period (default: 'count')
+    :param threshold: threshold of 'above' and 'count_above'
+    :return: array of the aggregated events and list of the periods
+    """
+    labels, _, keys = get_period_indices(datetime_stamps, period)
+    event_keys = get_period_keys(event_epoch_seconds, period)
+
+    sorter = np.argsort(keys)
+    positions = np.minimum(np.searchsorted(keys, event_keys, sorter=sorter), max(len(keys) - 1, 0))
+    period_indices = sorter[positions] if len(keys) > 0 else positions
+    if len(event_keys) > 0 and (len(keys) == 0 or np.any(keys[period_indices] != event_keys)):
+        raise ValueError('events happen outside the periods of the datetime stamps')
+
+    return aggregate_by_period(period_indices, len(labels), values, how, threshold), labels
 
 
 def get_daily_water_treatment(datetime_stamps, chemical_parameters):
-    dates = []
-    for dt in datetime_stamps:
-        date_ = dt.date()
-        if date_ not in dates:
-            dates.append(date_)
-
-    daily_water_use = np.zeros((len(dates),))
-    daily_water_evap = np.zeros((len(dates),))
-    daily_water_drain = np.zeros((len(dates),))
-    for dt, chem_d in zip(datetime_stamps, chemical_parameters):
-        ind = dates.index(dt.date())
-        daily_water_use[ind] += chem_d['inW']
-        daily_water_evap[ind] += chem_d['Evap']
-        daily_water_drain[ind] += chem_d['outW']
+    dates, date_indices = get_date_indices(datetime_stamps)
+
+    daily_water_use, daily_water_evap, daily_water_drain = \
+        [aggregate_by_period(date_indices, len(dates), get_chemical_parameter_values(chemical_parameters, key), 'sum')
+         for key in ['inW', 'Evap', 'outW']]
     return list(daily_water_use), list(daily_water_evap), list(daily_water_drain)
 
 
 def get_daily_water_health_quality(datetime_stamps, chemical_parameters, TCM_th):
-    dates = []
-    for dt in datetime_stamps:
-        date_ = dt.date()
-        if date_ not in dates:
-            dates.append(date_)
-
-    daily_TCM_above_th = np.zeros((len(dates),))
-    max_TCM = 0
-    daily_TOC_added = np.zeros((len(dates),))
-    daily_TCM = np.zeros((len(dates),))
-    for dt, chem_d in zip(datetime_stamps, chemical_parameters):
-        ind = dates.index(dt.date())
-        daily_TOC_added[ind] += chem_d['newTOC']
-        daily_TCM[ind] = max(daily_TCM[ind], chem_d['TCM'])
-        max_TCM = max(max_TCM, chem_d['TCM'])
-        if chem_d['TCM'] > TCM_th:
-            daily_TCM_above_th[ind] = 1
+    dates, date_indices = get_date_indices(datetime_stamps)
+
+    number_of_stamps = min(len(datetime_stamps), len(chemical_parameters))
+    tcms = get_chemical_parameter_values(chemical_parameters, 'TCM')[:number_of_stamps]
 
+    daily_TOC_added = aggregate_by_period(date_indices, len(dates),
+                                          get_chemical_parameter_values(chemical_parameters, 'newTOC'), 'sum')
+    daily_TCM = np.maximum(aggregate_by_period(date_indices, len(dates), tcms, 'max'), 0)
+    daily_TCM_above_th = aggregate_by_period(date_indices, len(dates), tcms, 'above', TCM_th)
+    max_TCM = max(0, float(np.max(tcms))) if number_of_stamps > 0 else 0
 
     return list(daily_TCM), list(daily_TOC_added), list(daily_TCM_above_th), max_TCM
 
@@ -335,7 +531,7 @@ def plot_bather_load_and_body_fluid_release_in_one_chart(datetime_stamps, bather
     """
 
     ticks_period_minutes = 420
-    time_period_seconds = (datetime_stamps[1] - datetime_stamps[0]).seconds
+    time_period_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
     ticks_multiplier = ticks_period_minutes * 60 / time_period_seconds
     x_ticks = []
 
@@ -381,7 +577,7 @@ def plot_bather_load_and_tcm_concentration_in_one_chart(datetime_stamps, bather_
     :return:
     """
     ticks_period_minutes = 60 * 24 * 7
-    time_period_seconds = (datetime_stamps[1] - datetime_stamps[0]).seconds
+    time_period_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
     ticks_multiplier = ticks_period_minutes * 60 / time_period_seconds
     x_ticks = []
     tcms = []
@@ -427,7 +623,7 @@ def plot_toc_generated_and_tcm_concentration_in_one_chart(datetime_stamps, chemi
     :return:
     """
     ticks_period_minutes = 60 * 24 * 7
-    time_period_seconds = (datetime_stamps[1] - datetime_stamps[0]).seconds
+    time_period_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
     ticks_multiplier = ticks_period_minutes * 60 / time_period_seconds
     x_ticks = []
     tcms = []
@@ -474,7 +670,7 @@ def plot_toc_and_tcm_concentration_in_one_chart(datetime_stamps, chemical_parame
     :return:
     """
     ticks_period_minutes = 60 * 24 * 7
-    time_period_seconds = (datetime_stamps[1] - datetime_stamps[0]).seconds
+    time_period_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
     ticks_multiplier = ticks_period_minutes * 60 / time_period_seconds
     x_ticks = []
     tcms = []
@@ -521,7 +717,7 @@ def plot_tcm_concentration(datetime_stamps, chemical_parameters):
     :return:
     """
     ticks_period_minutes = 3600
-    time_period_seconds = (datetime_stamps[1] - datetime_stamps[0]).seconds
+    time_period_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
     ticks_multiplier = ticks_period_minutes * 60 / time_period_seconds
     x_ticks = []
     tcms = []
@@ -553,7 +749,7 @@ def plot_toc_concentration(datetime_stamps, chemical_parameters):
     :return:
     """
     ticks_period_minutes = 3600
-    time_period_seconds = (datetime_stamps[1] - datetime_stamps[0]).seconds
+    time_period_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
     ticks_multiplier = ticks_period_minutes * 60 / time_period_seconds
     x_ticks = []
     tocs = []
@@ -588,7 +784,7 @@ def plot_water_in_one_chart(datetime_stamps, water_evaporation, water_flow_in, w
     :return:
     """
     ticks_period_minutes = 60 * 24
-    time_period_seconds = (datetime_stamps[1] - datetime_stamps[0]).seconds
+    time_period_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
     ticks_multiplier = ticks_period_minutes * 60 / time_period_seconds
 
     x_ticks = []
@@ -636,7 +832,7 @@ def plot_bather_load_and_tcm_concentration_in_one_chart_v2(datetime_stamps, wf_i
     :return:
     """
     ticks_period_minutes = 60 * 24
-    time_period_seconds = (datetime_stamps[1] - datetime_stamps[0]).seconds
+    time_period_seconds = TimeGrid.TimeGrid.from_any(datetime_stamps).time_step_seconds
     ticks_multiplier = ticks_period_minutes * 60 / time_period_seconds
     x_ticks = []
 